@@ -13,14 +13,61 @@ import time
 from st_aggrid import AgGrid
 
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 # from google_auth_httplib2 import Request # Not explicitly used, http is built directly
 from googleapiclient.errors import HttpError
-from google_auth_httplib2 import AuthorizedHttp # Asegúrate de que esta librería esté instalada
+
+from ageai.bundle import BUNDLE_DIR, bundle_members, open_bundle
+from ageai.columnar import COLUMNAR_NAME, read_csv_cached
+from ageai.dataset import Dataset
+from ageai.dataset_cache import ARCHIVE_NAME, DatasetCache, cache_key
+from ageai.drive import DriveClientPool, DriveRangeFetcher, download_identity, get_file_metadata, list_folder
+from ageai.facet_index import TEXT_COST, FacetIndex
+from ageai.filtered_rows import FilteredRows
+from ageai.jobs import CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, JobCancelled, JobError, JobRunner
+from ageai.list_columns import parse_list_columns
+from ageai.phrase_matcher import PhraseMatcher
+from ageai.schema import optimize_dtypes, str_value_counts
+from ageai.ranged_download import RangesNotSupportedError, download_ranges, resumable_download
+from ageai.result_cache import ResultCache
+from ageai.streaming import active_stream, start_stream
+from ageai.text_search import SearchIndex
+from ageai.zip_store import ZipStore, add_image_to_zip, extract_members, find_csv_member, image_error, image_pending, image_source, manifest_members, open_store
 
 st.set_page_config(layout="wide")
 
+# Descarga del ZIP en rangos de bytes concurrentes (AGEAI_PARALLEL_DOWNLOAD=0 para desactivar)
+PARALLEL_DOWNLOAD = os.getenv('AGEAI_PARALLEL_DOWNLOAD', '1') != '0'
+DOWNLOAD_WORKERS = int(os.getenv('AGEAI_DOWNLOAD_WORKERS', '8'))
+DOWNLOAD_RANGE_SIZE = int(os.getenv('AGEAI_DOWNLOAD_RANGE_MB', '16')) * 1024 * 1024
+# Guardar los rangos completados en '<zip>.part.json' para reanudar tras un fallo o reinicio
+RESUMABLE_DOWNLOAD = os.getenv('AGEAI_RESUMABLE_DOWNLOAD', '1') != '0'
+
+# Conexiones a Drive compartidas por todas las sesiones (listados, metadatos y descargas); el resto espera
+DRIVE_POOL_SIZE = int(os.getenv('AGEAI_DRIVE_POOL_SIZE', '16'))
+
+# Listados de carpetas de Drive en caché durante AGEAI_LISTING_TTL segundos; AGEAI_LIST_RECURSIVE=1 incluye subcarpetas
+LISTING_TTL = int(os.getenv('AGEAI_LISTING_TTL', '60'))
+LIST_RECURSIVE = os.getenv('AGEAI_LIST_RECURSIVE', '0') == '1'
+
+# Caché persistente de datasets extraídos por id de Drive + checksum (AGEAI_CACHE_MAX_GB=0 para desactivar)
+DATASET_CACHE_DIR = os.getenv('AGEAI_CACHE_DIR', './dataset_cache')
+DATASET_CACHE_MAX_BYTES = int(float(os.getenv('AGEAI_CACHE_MAX_GB', '20')) * 1024**3)
+
+# 'zip': las imágenes se leen directamente del ZIP descargado; 'extract': se descomprime primero a disco
+IMAGE_STORE = os.getenv('AGEAI_IMAGE_STORE', 'zip')
+EXTRACT_WORKERS = int(os.getenv('AGEAI_EXTRACT_WORKERS', '8'))
+# En modo 'zip', abrir el dashboard en cuanto llega el CSV; las imágenes aparecen a medida que se descargan
+STREAM_ARCHIVE = os.getenv('AGEAI_STREAM_ARCHIVE', '1') != '0'
+
+# Las cargas se ejecutan en jobs en segundo plano; como máximo AGEAI_INGEST_WORKERS a la vez entre todas las sesiones
+INGEST_WORKERS = int(os.getenv('AGEAI_INGEST_WORKERS', '4'))
+
+# Filas de los estados de filtro recientes, compartidas por las sesiones del mismo dataset (AGEAI_RESULT_CACHE_MB=0 para desactivar)
+RESULT_CACHE_MAX_BYTES = int(float(os.getenv('AGEAI_RESULT_CACHE_MB', '256')) * 1024**2)
+# La tabla muestra las filas filtradas por páginas; solo se extrae del DF cargado la página visible
+TABLE_PAGE_ROWS = 1000
+
 EXPECTED_GROUP_FOLDERS = {
     "older": "OLD",
     "young": "YOUNG",
@@ -30,6 +77,7 @@ EXPECTED_GROUP_FOLDERS = {
 
 if 'data_loaded' not in st.session_state:
     st.session_state.data_loaded = False
+    st.session_state.dataset = None
     st.session_state.df_results = None
     st.session_state.image_folders = {}
     st.session_state.group_filter = "Todos"
@@ -41,48 +89,46 @@ if 'data_loaded' not in st.session_state:
     st.session_state.images_per_row_slider_val = 5
 
 # --- Funciones Cacheadas ---
-@st.cache_data()
-def count_observations(df, category_column_name, options, is_activity_filter=False):
+# Las funciones cacheadas sobre los metadatos reciben el Dataset y se indexan por su versión, sin hashear el DF entero
+DATASET_HASH_FUNCS = {Dataset: lambda dataset: dataset.version}
+
+@st.cache_data(hash_funcs=DATASET_HASH_FUNCS)
+def count_observations(dataset, category_column_name, options):
+    df = dataset.df if dataset is not None else None
     if df is None or df.empty:
         return {option: 0 for option in options}
-    if is_activity_filter:
-        return {option: df['prompt'].str.contains(option, case=False, na=False).sum() for option in options}
-    elif category_column_name in df.columns:
-        if df[category_column_name].apply(lambda x: isinstance(x, list)).any():
-             return {option: df[category_column_name].apply(lambda x: option in x if isinstance(x, list) else False).sum() for option in options}
-        return {option: df[df[category_column_name].astype(str) == str(option)].shape[0] for option in options}
+    if category_column_name in df.columns: # Solo columnas categóricas; las de listas y las actividades se cuentan por sus facetas
+        counts = str_value_counts(df[category_column_name]) # Una pasada; sobre los códigos si la columna es categórica
+        return {option: counts.get(str(option), 0) for option in options}
     return {option: 0 for option in options}
 
-@st.cache_data()
-def get_sorted_options(_df_results, category_key, options): # _df_results para indicar que su contenido importa para la caché
-    # Usar st.session_state.df_results directamente aquí puede ser problemático si cambia
-    # Es mejor pasar el df como argumento para que la caché funcione correctamente
-    # Sin embargo, las opciones de filtro se basan en el df completo, no el filtrado.
-    df_full = st.session_state.get('df_results_for_filters_options', pd.DataFrame()) # Usar una copia para opciones
-    if df_full.empty:
+@st.cache_data(hash_funcs=DATASET_HASH_FUNCS)
+def get_sorted_options(dataset, category_key, options): # Cuentas sobre el DF completo, no el filtrado
+    if dataset is None or dataset.df.empty:
         return []
 
     column_name_for_counting = category_key
-    is_activity = False
-    if category_key == 'activities':
-        column_name_for_counting = 'prompt'
-        is_activity = True
-    elif category_key in ['assistive_devices', 'digital_devices']: # Ya son nombres de columna
+    if category_key in ['assistive_devices', 'digital_devices']: # Ya son nombres de columna
         pass
     # Añadir más mapeos si es necesario
 
-    counts = count_observations(df_full, column_name_for_counting, options, is_activity_filter=is_activity)
+    counts = count_observations(dataset, column_name_for_counting, options)
+    return sort_options(counts)
+
+def sort_options(counts): # Las opciones presentes en el dataset, de más a menos frecuente
     options_with_count = sorted([(option, count) for option, count in counts.items()], key=lambda x: x[1], reverse=True)
-    return [f"{option} ({count})" for option, count in options_with_count if count > 0]
+    return [option for option, count in options_with_count if count > 0]
 
-@st.cache_data(max_entries=1) # Solo necesitamos una copia del zip en memoria a la vez
-def create_downloadable_zip(_filtered_df, _image_folders_dict): # Cachear la creación del ZIP
+@st.cache_data(max_entries=1, hash_funcs={FilteredRows: lambda rows: rows.key}) # Solo necesitamos una copia del zip en memoria a la vez
+def create_downloadable_zip(filtered_rows, _image_folders_dict, images_complete=True): # Un ZIP por estado de filtros y de las imágenes
     zip_buffer = io.BytesIO()
     actual_fn_col = st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN
     original_fn_col = st.session_state.ORIGINAL_FILENAME_COLUMN
+    # Solo las columnas que se usan aquí, y cada imagen una vez por grupo
+    rows_for_zip = filtered_rows.columns([actual_fn_col, 'age_group', 'ID']).drop_duplicates(subset=[actual_fn_col, 'age_group'], keep='first')
 
     with ZipFile(zip_buffer, 'w') as zip_file:
-        for _, row in _filtered_df.iterrows():
+        for _, row in rows_for_zip.iterrows():
             image_name_for_path = row.get(actual_fn_col)
             # image_name_original_for_zip = row.get(original_fn_col) # Usar el actual para el nombre en el zip también
             age_group = row.get('age_group')
@@ -102,104 +148,180 @@ def create_downloadable_zip(_filtered_df, _image_folders_dict): # Cachear la cre
                 print(f"Advertencia (ZIP): No hay imágenes para grupo {folder_name_in_zip}")
                 continue
 
-            image_path_on_disk = current_group_images.get(image_name_for_path)
-            if image_path_on_disk and os.path.exists(image_path_on_disk):
-                zip_file.write(image_path_on_disk, os.path.join(folder_name_in_zip, image_name_for_path))
-            else:
-                print(f"Advertencia (ZIP): Imagen no encontrada en disco '{image_name_for_path}' en '{folder_name_in_zip}'")
+            image_ref = current_group_images.get(image_name_for_path)
+            if not add_image_to_zip(zip_file, image_ref, os.path.join(folder_name_in_zip, image_name_for_path)):
+                print(f"Advertencia (ZIP): Imagen no encontrada '{image_name_for_path}' en '{folder_name_in_zip}'")
     zip_buffer.seek(0)
     return zip_buffer
 
-@st.cache_resource
-def get_drive_service():
-    try:
-        encoded_sa = os.getenv('GOOGLE_SERVICE_ACCOUNT')
-        if not encoded_sa:
-            # Intenta cargar desde los secretos de Streamlit si no está en el entorno
-            if 'GOOGLE_SERVICE_ACCOUNT_B64' in st.secrets:
-                encoded_sa = st.secrets['GOOGLE_SERVICE_ACCOUNT_B64']
-            else:
-                raise ValueError("La variable de entorno GOOGLE_SERVICE_ACCOUNT o el secreto GOOGLE_SERVICE_ACCOUNT_B64 no están configurados")
-
-        sa_json = base64.b64decode(encoded_sa).decode('utf-8')
-        sa_dict = json.loads(sa_json)
-
-        credentials = service_account.Credentials.from_service_account_info(
-            sa_dict,
-            scopes=['https://www.googleapis.com/auth/drive.readonly']
-        )
-
-        # Crear un cliente HTTP autorizado a partir de las credenciales
-        authed_http = AuthorizedHttp(credentials)
-
-        if hasattr(authed_http, 'timeout'):
-             authed_http.timeout = 120
+@st.cache_data(max_entries=1, hash_funcs={FilteredRows: lambda rows: rows.key}) # Como el ZIP: un CSV por estado de filtros
+def filtered_rows_csv(filtered_rows):
+    return filtered_rows.to_csv().encode('utf-8') # Escrito por bloques de filas
+
+@st.cache_resource # El pool de clientes de Drive crea sus conexiones a partir de estas credenciales
+def get_drive_credentials():
+    encoded_sa = os.getenv('GOOGLE_SERVICE_ACCOUNT')
+    if not encoded_sa:
+        # Intenta cargar desde los secretos de Streamlit si no está en el entorno
+        if 'GOOGLE_SERVICE_ACCOUNT_B64' in st.secrets:
+            encoded_sa = st.secrets['GOOGLE_SERVICE_ACCOUNT_B64']
         else:
-            import httplib2
-            http_client = httplib2.Http(timeout=120)
-            authed_http = AuthorizedHttp(credentials, http=http_client)
+            raise ValueError("La variable de entorno GOOGLE_SERVICE_ACCOUNT o el secreto GOOGLE_SERVICE_ACCOUNT_B64 no están configurados")
+
+    sa_json = base64.b64decode(encoded_sa).decode('utf-8')
+    sa_dict = json.loads(sa_json)
 
+    return service_account.Credentials.from_service_account_info(
+        sa_dict,
+        scopes=['https://www.googleapis.com/auth/drive.readonly']
+    )
 
-        # Construir el servicio usando el cliente HTTP autorizado y configurado
-        service = build('drive', 'v3', http=authed_http)
-        return service
+@st.cache_resource # Un pool por proceso; cada petición usa su propia conexión
+def get_drive_pool():
+    try:
+        # Cada cliente del pool tiene su propio AuthorizedHttp (httplib2 con timeout de 120 s)
+        drive_pool = DriveClientPool(get_drive_credentials(), size=DRIVE_POOL_SIZE)
+        with drive_pool.client():
+            pass # Crear el primer cliente ya, para detectar aquí los problemas de credenciales
+        return drive_pool
     except Exception as e:
-        # Captura el error específico si es de tipo AttributeError por 'timeout'
-        if isinstance(e, AttributeError) and "'AuthorizedHttp' object has no attribute 'timeout'" in str(e):
-             st.error(f"Error configurando timeout en AuthorizedHttp: {str(e)}. "
-                      "Esto podría requerir un ajuste en cómo se instancia httplib2.Http "
-                      "con el timeout antes de pasarlo a AuthorizedHttp.")
         st.error(f"Error al obtener el servicio de Google Drive: {str(e)}")
         return None
 
-def list_files_in_folder(service, folder_id, retries=3): # No cachear, puede cambiar
+@st.cache_data(ttl=LISTING_TTL, show_spinner=False) # Caché corta: los reruns no vuelven a listar; _drive_pool no se hashea
+def list_files_in_folder(_drive_pool, folder_id, recursive=LIST_RECURSIVE, retries=3):
     for attempt in range(retries):
         try:
-            results = service.files().list(
-                q=f"'{folder_id}' in parents", fields="files(id, name)"
-            ).execute()
-            return results.get('files', [])
+            # Sigue nextPageToken; los archivos de subcarpetas llevan 'path' como 'sub/archivo.zip'
+            with _drive_pool.client() as client:
+                return list_folder(client.service, folder_id, recursive=recursive)
         except HttpError as error:
             st.error(f"Error al listar archivos (intento {attempt+1}): {error}")
             if attempt < retries - 1: time.sleep(5)
             else: raise
 
-def download_file_from_google_drive(service, file_id, dest_path, retries=3): # No cachear, es una acción
+def download_file_parallel(drive_pool, file_id, dest_path, job, workers=DOWNLOAD_WORKERS, range_size=DOWNLOAD_RANGE_SIZE,
+                           resumable=RESUMABLE_DOWNLOAD):
+    """Descarga el archivo en rangos de bytes concurrentes. Devuelve False si Drive no informa el tamaño."""
+    with drive_pool.client() as client:
+        metadata = get_file_metadata(client.service, file_id)
+    total_size = metadata.get('size')
+    if not total_size:
+        return False
+
+    def show_progress(done_bytes, total_bytes):
+        job.update(done_bytes / total_bytes, f"{done_bytes / 1024**2:.0f} de {total_bytes / 1024**2:.0f} MB ({workers} conexiones)")
+
+    fetcher = DriveRangeFetcher(drive_pool, file_id)
+    if resumable:
+        # Verifica el md5Checksum de Drive antes de mover el archivo a su destino
+        resumable_download(fetcher, dest_path, total_size, download_identity(metadata),
+                           md5_checksum=metadata.get('md5Checksum'), workers=workers,
+                           range_size=range_size, progress=show_progress, cancel_event=job.cancel_event)
+    else:
+        download_ranges(fetcher, dest_path, total_size, workers=workers, range_size=range_size, progress=show_progress,
+                        cancel_event=job.cancel_event)
+    job.check_cancelled() # Una descarga cancelada termina antes con rangos pendientes
+    return True
+
+def download_file_from_google_drive(drive_pool, file_id, dest_path, job, retries=3, parallel=PARALLEL_DOWNLOAD): # No cachear, es una acción
+    if parallel:
+        for attempt in range(retries):
+            try:
+                if download_file_parallel(drive_pool, file_id, dest_path, job):
+                    return
+                break # Drive no informa tamaño: usar una sola conexión
+            except JobCancelled:
+                raise
+            except RangesNotSupportedError as e:
+                job.log('warning', f"{e}. Usando una sola conexión...")
+                break # Cada rango volvería a traer el archivo entero
+            except Exception as e:
+                job.check_cancelled() # Al cancelar, la descarga por rangos falla: no reintentar
+                job.log('warning', f"Descarga por rangos interrumpida (intento {attempt+1}/{retries}): {e}")
+                if attempt < retries - 1: time.sleep(2 ** attempt) # Los rangos completados se conservan
+        else:
+            job.log('warning', "Fallo en la descarga paralela. Reintentando con una sola conexión...")
+
     for attempt in range(retries):
         try:
-            request = service.files().get_media(fileId=file_id)
-            with io.FileIO(dest_path, 'wb') as fh:
+            with drive_pool.client() as client, io.FileIO(dest_path, 'wb') as fh:
+                request = client.service.files().get_media(fileId=file_id)
                 downloader = MediaIoBaseDownload(fh, request, chunksize=1024*1024*5)
                 done = False
                 while not done:
                     status, done = downloader.next_chunk(num_retries=2)
+                    if status: job.update(status.progress(), f"{int(status.progress() * 100)}% (una conexión)")
             return
+        except JobCancelled:
+            raise
         except Exception as e:
-            st.error(f"Error al descargar archivo (intento {attempt+1}): {str(e)}")
+            job.log('error', f"Error al descargar archivo (intento {attempt+1}): {str(e)}")
             if attempt < retries - 1: time.sleep(5)
             else: raise
 
-def extract_zip(zip_path, extract_to_relative):
+def pick_csv_member(names):
+    # Un bundle precalculado (ageai/bundle.py) sustituye al CSV; si no, la misma elección que hace la carga
+    csv_member = find_csv_member(names, name_prefix='')
+    return bundle_members(names) or ([csv_member] if csv_member else [])
+
+def stream_archive(drive_pool, file_id, dest_path, job, on_complete=None, workers=DOWNLOAD_WORKERS, range_size=DOWNLOAD_RANGE_SIZE):
+    """Inicia la descarga por rangos en segundo plano y solo espera a que el CSV sea legible.
+
+    Devuelve el StreamingArchive, o None si Drive no informa el tamaño del archivo.
+    """
+    with drive_pool.client() as client:
+        metadata = get_file_metadata(client.service, file_id)
+    total_size = metadata.get('size')
+    if not total_size:
+        return None
+
+    def show_progress(done_bytes, total_bytes):
+        job.update(None, f"Descargando índice del ZIP y CSV... ({done_bytes / 1024**2:.0f} de {total_bytes / 1024**2:.0f} MB)")
+
+    stream = start_stream(DriveRangeFetcher(drive_pool, file_id), dest_path, total_size,
+                          download_identity(metadata), md5_checksum=metadata.get('md5Checksum'),
+                          csv_member=pick_csv_member, workers=workers, range_size=range_size,
+                          on_complete=on_complete)
+    try:
+        stream.wait_for_csv(progress=show_progress)
+    except Exception:
+        stream.cancel()
+        raise
+    return stream
+
+@st.cache_resource # Una sola instancia por proceso, compartida entre sesiones
+def get_dataset_cache():
+    if DATASET_CACHE_MAX_BYTES <= 0:
+        return None
+    return DatasetCache(DATASET_CACHE_DIR, DATASET_CACHE_MAX_BYTES)
+
+def extract_zip(zip_path, extract_to_relative, job, filename_columns):
     abs_extract_to = os.path.abspath(extract_to_relative)
     if os.path.exists(abs_extract_to):
         shutil.rmtree(abs_extract_to, ignore_errors=True)
     try:
         os.makedirs(abs_extract_to, exist_ok=True)
     except Exception as e_mkdir:
-        st.error(f"No se pudo crear dir de extracción '{abs_extract_to}': {e_mkdir}")
-        raise
+        raise JobError(f"No se pudo crear dir de extracción '{abs_extract_to}': {e_mkdir}") from e_mkdir
 
     try:
-        with ZipFile(zip_path, 'r') as zip_ref:
-            # Optional: Check zip structure if needed before extraction
-            # namelist = zip_ref.namelist()
-            # if not any(name.startswith('data/') for name in namelist if '/' in name):
-            #      st.warning("Advertencia: ZIP no parece tener carpeta 'data/' en la raíz.")
-            zip_ref.extractall(path=abs_extract_to)
-        # st.success(f"Archivos extraídos en: {abs_extract_to}") # Menos verbose
-    except Exception as e:
-        st.error(f"Error al extraer ZIP a '{abs_extract_to}': {str(e)}")
+        with ZipStore(zip_path) as store:
+            # Solo el CSV y las imágenes que sus filas referencian; el resto del ZIP se omite
+            members = manifest_members(store, filename_columns, transform=to_actual_image_filename, extra_prefixes=(BUNDLE_DIR,))
+            if members is None:
+                members = list(store.members.values()) # Sin nombres de imagen en el CSV: extraer todo
+            def show_progress(done, total):
+                job.update(done / total, f"{done}/{total} archivos")
+            extract_members(store, members, abs_extract_to, workers=EXTRACT_WORKERS, progress=show_progress)
+    except JobCancelled:
         raise
+    except Exception as e:
+        raise JobError(f"Error al extraer ZIP a '{abs_extract_to}': {str(e)}") from e
+
+def to_actual_image_filename(filename):
+    # Las imágenes .png del CSV se guardan como .jpg en el ZIP
+    return filename.rpartition('.')[0] + '.jpg' if isinstance(filename, str) and filename.lower().endswith('.png') else filename
 
 @st.cache_data() # Función simple, cachear es opcional pero inofensivo
 def extract_folder_id(url):
@@ -207,7 +329,20 @@ def extract_folder_id(url):
     return match.group(1) if match else None
 
 @st.cache_data() # Cachear la lectura de imágenes de una carpeta
-def read_images_from_folder_cached(abs_folder_path):
+def read_images_from_folder_cached(abs_folder_path, zip_path=None, zip_mtime=None):
+    # Con zip_path, abs_folder_path es una carpeta dentro del ZIP y los valores son ZipMember
+    # en lugar de rutas. zip_mtime solo sirve para que la caché dependa de la versión del ZIP.
+    if zip_path:
+        try:
+            stream = active_stream(zip_path)
+            # Mientras el ZIP se descarga se listan todos los miembros; los pendientes muestran un aviso
+            images = (stream.handles(abs_folder_path, (".jpg", ".jpeg")) if stream
+                      else open_store(zip_path).files_in_folder(abs_folder_path, extensions=(".jpg", ".jpeg")))
+        except Exception as e:
+            print(f"Error (read_images): Leyendo {zip_path}:{abs_folder_path}: {e}")
+            return {}
+        return {filename: images[filename] for filename in sorted(images, key=natural_sort_key)}
+
     images = {}
     if not (os.path.exists(abs_folder_path) and os.path.isdir(abs_folder_path)):
         # st.warning(f"Carpeta de imágenes no existe: {abs_folder_path}") # Evitar st.write
@@ -234,43 +369,6 @@ def toggle_fullscreen(image_name_original_df):
 def get_default(category_key):
     return st.session_state.get(f"multiselect_{category_key}", [])
 
-@st.cache_data()
-def get_unique_list_items(_df, column_name): # Pasar df para que la caché dependa de él
-    if column_name in _df.columns:
-        all_items = []
-        for item_list in _df[column_name].dropna():
-            items_to_add = []
-            if isinstance(item_list, list): items_to_add = item_list
-            elif isinstance(item_list, str):
-                try:
-                    evaluated_item = eval(item_list)
-                    if isinstance(evaluated_item, list): items_to_add = evaluated_item
-                    else: items_to_add = [str(item_list)]
-                except: items_to_add = [str(item_list)]
-            else: items_to_add = [str(item_list)]
-            all_items.extend(map(str, items_to_add))
-        return sorted(list(set(all_items)))
-    return []
-
-@st.cache_data()
-def get_unique_objects_with_counts(_df, column_name): # Pasar df para que la caché dependa de él
-    item_counts = {}
-    if column_name not in _df.columns: return {}
-    for entry in _df[column_name].dropna():
-        items_to_process = []
-        if isinstance(entry, list): items_to_process = entry
-        elif isinstance(entry, str):
-            try:
-                evaluated_entry = eval(entry)
-                if isinstance(evaluated_entry, list): items_to_process = evaluated_entry
-                # else: items_to_process = [entry] # Si se quieren contar strings no-lista
-            except: items_to_process = [entry] # Si se quieren contar strings no-lista
-        
-        for item in items_to_process:
-            item_str = str(item)
-            item_counts[item_str] = item_counts.get(item_str, 0) + 1
-    return dict(sorted(item_counts.items(), key=lambda item: item[1], reverse=True))
-
 # --- Fin Funciones Cacheadas ---
 
 st.markdown("<h1 style='text-align: center; color: white;'>AGEAI: Imágenes y Metadatos. v30 (Optimizado)</h1>", unsafe_allow_html=True)
@@ -689,14 +787,474 @@ if 'categories' not in st.session_state:
         "person_count": [], 
         "location": [],
     }
-    st.session_state.df_results_for_filters_options = pd.DataFrame() # Para que get_sorted_options tenga de dónde leer
+
+# --- CARGA EN SEGUNDO PLANO ---
+INGEST_STAGES = [
+    ('download', "Descarga"),
+    ('extract', "Extracción"),
+    ('images', "Índice de imágenes"),
+    ('csv', "Lectura del CSV"),
+    ('filters', "Opciones de filtro"),
+]
+# Columnas con listas guardadas como texto, p. ej. "['bastón', 'gafas']"
+OBJECT_LIST_COLUMNS = ["objects", "assistive_devices", "digital_devices"]
+# Actividades encontradas en los prompts durante la carga; se guardan y filtran como una columna de lista con este nombre
+ACTIVITY_FACET = "prompt_activities"
+
+@st.cache_resource # Un solo runner por proceso: varios usuarios pueden cargar datos en paralelo
+def get_job_runner():
+    return JobRunner(max_workers=INGEST_WORKERS)
+
+@st.cache_resource # Una sola caché de resultados por proceso, compartida entre sesiones
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_MAX_BYTES)
+
+def ingest_dataset(job, drive_pool, file_meta, original_fn_col, actual_fn_col, activities=()):
+    """Job en segundo plano: descarga y prepara un ZIP de Drive.
+
+    Se ejecuta en un hilo del JobRunner, así que informa a través de `job` y no llama a Streamlit.
+    Devuelve lo que el dashboard guarda en session_state.
+    """
+    file_id = file_meta['id']
+    temp_zip_path = os.path.abspath("temp_data.zip")
+    abs_temp_extract_path = os.path.abspath("extracted_data_content") # Relativa al script
+    serve_from_zip = IMAGE_STORE == 'zip'
+    archive_path = None # Ruta del ZIP cuando las imágenes se sirven sin extraer
+    stream = None
+
+    dataset_cache = get_dataset_cache()
+    dataset_key = cache_key(file_meta, variant='zip' if serve_from_zip else None) if dataset_cache else None
+    cached_path = dataset_cache.lookup(dataset_key) if dataset_key else None
+
+    try:
+        if cached_path:
+            # Mismo id y checksum que una carga anterior: se reutiliza la copia en caché
+            job.log('info', f"'{file_meta['name']}' no ha cambiado en Drive. Usando la copia en caché.")
+            job.skip('download', "copia en caché")
+            job.skip('extract', "copia en caché")
+            abs_temp_extract_path = cached_path
+        else:
+            with job.stage('download'):
+                parallel = PARALLEL_DOWNLOAD
+                if serve_from_zip and PARALLEL_DOWNLOAD and STREAM_ARCHIVE:
+                    # El dashboard se abre cuando llega el CSV. La entrada de caché se rellena en su sitio
+                    # y el hilo de descarga la marca como completa cuando el ZIP está verificado.
+                    stream_dest = temp_zip_path
+                    on_complete = None
+                    if dataset_key:
+                        stream_dest = os.path.join(dataset_cache.building_dir(dataset_key), ARCHIVE_NAME)
+                        manifest = {'file_id': file_id, 'name': file_meta['name']}
+                        on_complete = lambda _, key=dataset_key, cache=dataset_cache: cache.finalize(key, manifest)
+                    try:
+                        stream = stream_archive(drive_pool, file_id, stream_dest, job, on_complete=on_complete)
+                    except JobCancelled:
+                        raise
+                    except Exception as e:
+                        job.log('warning', f"Fallo en la descarga en streaming: {e}. Descargando el archivo completo...")
+                        parallel = not isinstance(e, RangesNotSupportedError) # Entonces, directamente una sola conexión
+                if stream is not None:
+                    archive_path = stream.dest_path
+                else:
+                    download_file_from_google_drive(drive_pool, file_id, temp_zip_path, job, parallel=parallel)
+
+            if stream is not None:
+                job.skip('extract', "las imágenes se leen del ZIP a medida que llegan")
+            elif dataset_key:
+                staging_path = dataset_cache.staging_dir(dataset_key)
+                if serve_from_zip:
+                    job.skip('extract', "las imágenes se leen del ZIP")
+                    shutil.move(temp_zip_path, os.path.join(staging_path, ARCHIVE_NAME))
+                else:
+                    with job.stage('extract'):
+                        extract_zip(temp_zip_path, staging_path, job, [original_fn_col, actual_fn_col])
+                abs_temp_extract_path = dataset_cache.commit(dataset_key, staging_path,
+                                                             {'file_id': file_id, 'name': file_meta['name']})
+            elif serve_from_zip:
+                job.skip('extract', "las imágenes se leen del ZIP")
+                archive_path = temp_zip_path
+            else:
+                with job.stage('extract'):
+                    extract_zip(temp_zip_path, abs_temp_extract_path, job, [original_fn_col, actual_fn_col])
+        if serve_from_zip and archive_path is None:
+            archive_path = os.path.join(abs_temp_extract_path, ARCHIVE_NAME)
+
+        # Los ZIP creados con `python -m ageai.bundle` traen el CSV ya leído, el índice de imágenes y las opciones de filtro
+        bundle = open_bundle(archive_path or abs_temp_extract_path)
+        if bundle is not None:
+            job.log('info', f"Usando el bundle precalculado ({bundle.rows} filas, creado {bundle.manifest['built']}).")
+
+        with job.stage('images'):
+            thumbnails = {}
+            if bundle is not None:
+                # El índice del bundle evita listar las carpetas; trae también las miniaturas de la cuadrícula
+                bundle_images, bundle_thumbnails = bundle.images()
+                data_folder_exists = True
+            elif archive_path:
+                # Dentro del ZIP las rutas son relativas a la raíz del archivo
+                archive_store = open_store(archive_path)
+                archive_mtime = os.path.getmtime(archive_path)
+                abs_data_folder_path = 'data'
+                data_folder_exists = bool(archive_store.listdir('data'))
+            else:
+                abs_data_folder_path = os.path.join(abs_temp_extract_path, 'data')
+                data_folder_exists = os.path.exists(abs_data_folder_path)
+            if not data_folder_exists:
+                raise JobError(f"Carpeta 'data/' no encontrada en '{abs_temp_extract_path}'. Verifique estructura del ZIP.")
+
+            # Cargar imágenes
+            image_folders = {}
+            for age_group_key, folder_name_in_zip in EXPECTED_GROUP_FOLDERS.items():
+                job.update(len(image_folders) / len(EXPECTED_GROUP_FOLDERS), folder_name_in_zip)
+                # Usar la función cacheada para leer imágenes
+                if bundle is not None:
+                    images = bundle_images.get(folder_name_in_zip)
+                    thumbnails[folder_name_in_zip] = bundle_thumbnails.get(folder_name_in_zip, {})
+                elif archive_path:
+                    images = read_images_from_folder_cached(f"data/{folder_name_in_zip}", archive_path, archive_mtime)
+                else:
+                    abs_current_img_folder_path = os.path.join(abs_data_folder_path, folder_name_in_zip)
+                    images = read_images_from_folder_cached(abs_current_img_folder_path)
+                if images:
+                    image_folders[folder_name_in_zip] = images
+            if not image_folders:
+                raise JobError("No se cargaron imágenes. Verifique estructura del ZIP y nombres de carpetas.")
+
+        # La entrada de caché depende del checksum del ZIP, así que lo que se guarda en ella nunca queda desfasado
+        cache_dir = (os.path.dirname(archive_path) if archive_path else abs_temp_extract_path) if dataset_key else None
+        with job.stage('csv'):
+            # Cargar y PROCESAR DataFrame
+            if bundle is not None:
+                df = bundle.dataframe()
+            else:
+                # El mismo miembro que la descarga en streaming trae primero (ver pick_csv_member)
+                csv_member = find_csv_member(archive_store if archive_path else abs_temp_extract_path, name_prefix='')
+                if csv_member is None:
+                    raise JobError(f"No se encontró CSV en '{abs_data_folder_path}'.")
+
+                if archive_path:
+                    csv_file_path = lambda: archive_store.open_member(csv_member)
+                else:
+                    csv_file_path = os.path.join(abs_temp_extract_path, csv_member)
+                # Con caché, el CSV ya leído se guarda como Arrow mapeado en memoria para la próxima carga
+                df, columnar_hit = read_csv_cached(csv_file_path, cache_dir and os.path.join(cache_dir, COLUMNAR_NAME))
+                if columnar_hit:
+                    job.log('info', "CSV leído de la caché columnar.")
+
+            # --- PROCESAMIENTO DEL DF (HACERLO AQUÍ UNA VEZ) ---
+            if original_fn_col in df.columns:
+                df[actual_fn_col] = df[original_fn_col].apply(to_actual_image_filename)
+            elif actual_fn_col not in df.columns: # Si no existe ni el original para crearla, ni ella misma
+                raise JobError(f"Columnas de nombre de archivo '{original_fn_col}' o '{actual_fn_col}' no encontradas.")
+
+            required_cols = [actual_fn_col, 'prompt', 'age_group', 'ID'] # 'filename' original ya no es crítico si actual existe
+            if original_fn_col in df.columns and original_fn_col not in required_cols:
+                required_cols.append(original_fn_col) # Si existe, mantenerla requerida para info
+
+            missing_cols = [col for col in required_cols if col not in df.columns]
+            if missing_cols:
+                raise JobError(f"Columnas obligatorias faltantes: {', '.join(missing_cols)}")
+
+            df.dropna(subset=[col for col in required_cols if col in df.columns], inplace=True) # Dropna solo de las que existen
+
+            # Columnas con pocos valores distintos pasan a 'category'; age_group se pasa a minúsculas una sola vez aquí
+            df, schema_report = optimize_dtypes(df, lowercase_columns=['age_group'])
+            job.log('info', f"Metadatos en memoria: {schema_report['before_bytes'] / 1024**2:.1f} MB -> {schema_report['after_bytes'] / 1024**2:.1f} MB "
+                            f"({len(schema_report['categorical'])} columnas categóricas).")
+
+        with job.stage('filters'):
+            # Poblar categorías para filtros (basado en el DF completo y procesado)
+            category_keys_to_populate = {
+                "gender": "gender",
+                "race": "race",
+                "emotion": "emotion",
+                #"personality": "personality",
+                "position": "position",
+                "person_count": "person_count",
+                "location": "location",
+            }
+            # Los recuentos del bundle solo valen si el dropna de arriba no quitó filas
+            facets = bundle.facets() if bundle is not None and len(df) == bundle.rows else None
+            categories = {}
+            for cat_key, df_col_name in category_keys_to_populate.items():
+                if facets is not None and df_col_name in facets:
+                    categories[cat_key] = sorted(facets[df_col_name])
+                else:
+                    # Usar el df completo para obtener todas las opciones únicas
+                    categories[cat_key] = sorted(str_value_counts(df[df_col_name].dropna())) if df_col_name in df.columns else []
+            categories['activities'] = list(activities)
+            # Las columnas de objetos se analizan una sola vez aquí; los filtros cuentan y buscan sobre sus arrays
+            list_columns = parse_list_columns(df, OBJECT_LIST_COLUMNS, bundle)
+            # Una sola pasada por los prompts para todas las actividades (antes, un str.contains por actividad):
+            # la matriz actividad x fila de la que salen los recuentos y el filtro de actividades
+            list_columns[ACTIVITY_FACET] = PhraseMatcher(activities).match(df['prompt'])
+            # Bitmaps de filas por valor de cada columna con pocos valores y por objeto: los filtros no recorren columnas
+            filter_index = FacetIndex.build(df, list_columns)
+            job.log('info', f"Índice de filtros: {len(filter_index.facets)} columnas, {filter_index.nbytes / 1024**2:.1f} MB.")
+            # Índices de trigramas del buscador: uno por columna en su primera búsqueda, guardado en la entrada de caché
+            search_index = SearchIndex(df, cache_dir)
+    except Exception:
+        # --- LIMPIEZA: el ZIP temporal (salvo si otra descarga lo está escribiendo) y la extracción fuera de la caché ---
+        if os.path.exists(temp_zip_path) and not active_stream(temp_zip_path) and archive_path != temp_zip_path:
+            try:
+                os.remove(temp_zip_path)
+            except OSError as e_clean_zip:
+                job.log('warning', f"No se pudo eliminar temp_zip_path: {e_clean_zip}")
+        if not dataset_key and os.path.exists(abs_temp_extract_path):
+            shutil.rmtree(abs_temp_extract_path, ignore_errors=True)
+        raise
+
+    job.log('success', "Datos cargados y procesados.")
+    if archive_path != temp_zip_path and os.path.exists(temp_zip_path): # Limpiar ZIP descargado si todo fue bien (salvo si sirve las imágenes)
+        try:
+            os.remove(temp_zip_path)
+        except OSError as e_clean_zip_success:
+            job.log('warning', f"No se pudo eliminar temp_zip_path (tras éxito): {e_clean_zip_success}")
+    return {
+        # Las sesiones que cargan la misma entrada de la caché comparten versión, y con ella cuentas y resultados; una carga sin caché tiene la suya
+        'dataset': Dataset.wrap(df, dataset_key), # El DF PROCESADO
+        'image_folders': image_folders,
+        'thumbnails': thumbnails,
+        'categories': categories,
+        'list_columns': list_columns,
+        'filter_index': filter_index,
+        'search_index': search_index,
+        'archive_path': archive_path,
+        'abs_temp_extract_path': abs_temp_extract_path,
+        'archive_stream': stream,
+    }
+
+def show_job_messages(job):
+    for level, text in job.messages:
+        getattr(st, level)(text)
+
+STAGE_ICONS = {'pending': "⏳", 'running': "▶️", 'done': "✅", 'skipped': "⏭️", 'failed': "❌"}
+
+@st.fragment(run_every=1)
+def show_ingest_job(job_id):
+    # Solo este bloque se reejecuta mientras trabaja el job; al terminar se recarga la página entera
+    job = get_job_runner().get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    stage = job.current_stage
+    st.progress(job.progress, text=f"Cargando '{job.description}'" + (f" — {stage.label}: {stage.detail}" if stage else "..."))
+    for stage in job.stages.values():
+        seconds = f" ({stage.seconds:.1f} s)" if stage.seconds is not None else ""
+        st.caption(f"{STAGE_ICONS.get(stage.status, '')} {stage.label}{seconds} {stage.detail}")
+    if st.button("Cancelar carga", key=f"cancel_{job.id}"):
+        job.cancel()
+    with st.expander("Mensajes", expanded=False):
+        show_job_messages(job)
+
+# --- FRAGMENTOS DEL ÁREA DE RESULTADOS ---
+# Cada uno se reejecuta solo al usar sus propios controles (página, imágenes por fila, Detalles...), sin volver
+# a aplicar los filtros ni dibujar el resto. Reciben las filas filtradas de la última ejecución completa.
+
+def set_images_per_page():
+    st.session_state.images_per_page_display = st.session_state.images_per_page_display_input
+    st.session_state.current_page = 1 # Resetear a la página 1 si cambia el total por página
+
+@st.fragment
+def show_results_table(filtered_rows):
+    if filtered_rows.empty:
+        st.info("La tabla está vacía con los filtros actuales.")
+        return
+    table_pages = -(-len(filtered_rows) // TABLE_PAGE_ROWS)
+    table_page = st.number_input(f"Página de la tabla (1-{table_pages}, {TABLE_PAGE_ROWS} filas cada una)", min_value=1,
+                                 max_value=table_pages, value=1, key="table_page") if table_pages > 1 else 1
+    AgGrid(filtered_rows.page((table_page - 1) * TABLE_PAGE_ROWS, table_page * TABLE_PAGE_ROWS),
+           height=300, fit_columns_on_grid_load=True, allow_unsafe_jscode=True, enable_enterprise_modules=False)
+    st.download_button("Descargar Tabla Filtrada (CSV)", filtered_rows_csv(filtered_rows), "filtered_data.csv", "text/csv")
+
+@st.fragment
+def show_image_viewer(filtered_rows, image_folders_dict, thumbnails_dict):
+    # La cuadrícula y la vista detallada se turnan en el mismo sitio: un solo fragmento, y Detalles/Cerrar solo lo reejecutan a él
+    if st.session_state.get('fullscreen_image') is None:
+        show_image_grid(filtered_rows, image_folders_dict, thumbnails_dict)
+    else:
+        show_fullscreen_image(filtered_rows, image_folders_dict)
+
+def show_image_grid(filtered_rows, image_folders_dict, thumbnails_dict):
+    if filtered_rows.empty:
+        st.info("No hay imágenes que coincidan con los filtros aplicados.")
+        return
+
+    # --- CONTROLES DE VISUALIZACIÓN DE IMÁGENES ---
+    vis_col1, vis_col2 = st.columns(2)
+    with vis_col1:
+        images_per_row = st.slider(
+            "Imágenes por fila en la cuadrícula", 
+            min_value=1, max_value=10, 
+            value=st.session_state.get("images_per_row_slider_val", 4), # Usar valor guardado o 4 por defecto
+            key="images_per_row_slider"
+        )
+        st.session_state.images_per_row_slider_val = images_per_row
+
+    with vis_col2:
+        # Permitir al usuario cambiar cuántas imágenes se muestran por página
+        # Usamos la clave 'images_per_page_display_input' para el widget
+        # y actualizamos 'images_per_page_display' en session_state antes de la reejecución
+        st.number_input(
+            "Imágenes por página", 
+            min_value=images_per_row, # Mínimo debe ser al menos las imágenes por fila
+            max_value=200, # Un límite superior razonable
+            value=st.session_state.get("images_per_page_display", 20), 
+            step=images_per_row, # Saltar en múltiplos de imágenes por fila tiene sentido
+            key="images_per_page_display_input",
+            on_change=set_images_per_page
+        )
+
+    # --- PAGINACIÓN ---
+    total_items = len(filtered_rows)
+    items_per_page = st.session_state.images_per_page_display
+    
+    total_pages = (total_items + items_per_page - 1) // items_per_page
+    if total_pages == 0: total_pages = 1 # Evitar división por cero si no hay items
+
+    st.session_state.current_page = st.number_input(
+        f"Página (1-{total_pages})", 
+        min_value=1, max_value=total_pages, 
+        value=min(st.session_state.current_page, total_pages), # Asegurar que no exceda total_pages
+        step=1,
+        key="image_page_selector"
+    )
+
+    start_idx = (st.session_state.current_page - 1) * items_per_page
+    end_idx = start_idx + items_per_page
+    paginated_df_view = filtered_rows.page(start_idx, end_idx) # Solo las filas de esta página
+    # --- FIN PAGINACIÓN ---
+    actual_fn_col = st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN
+    original_fn_col = st.session_state.ORIGINAL_FILENAME_COLUMN
+
+    for i in range(0, len(paginated_df_view), images_per_row):
+        row_data_for_display = paginated_df_view.iloc[i:i+images_per_row]
+        cols = st.columns(images_per_row) # Usar images_per_row que es fijo por página
+        for col_idx, (df_idx, row) in enumerate(row_data_for_display.iterrows()):
+            image_name_actual = row.get(actual_fn_col)
+            image_name_original_df = row.get(original_fn_col, image_name_actual) # Fallback
+            age_group_val = row.get('age_group')
+
+            if image_name_actual and age_group_val:
+                folder_name_in_zip = EXPECTED_GROUP_FOLDERS.get(str(age_group_val).lower())
+                image_data = image_ref = None
+                if folder_name_in_zip and folder_name_in_zip in image_folders_dict:
+                    # Miniatura si la hay; si no, la imagen (ruta en disco o bytes leídos del ZIP)
+                    image_ref = image_folders_dict[folder_name_in_zip].get(image_name_actual)
+                    image_data = image_source(thumbnails_dict.get(folder_name_in_zip, {}).get(image_name_actual))
+                    if image_data is None:
+                        image_data = image_source(image_ref)
+
+                if image_data is not None:
+                    try:
+                        cols[col_idx].image(image_data, caption=f"{image_name_original_df}\nID: {row.get('ID', 'N/A')}", use_column_width=True)
+                        # Usar df_idx para unicidad; se usa el nombre original para buscar en el DF
+                        cols[col_idx].button(f"Detalles", key=f"btn_detail_{df_idx}", on_click=toggle_fullscreen, args=(image_name_original_df,))
+                    except Exception as e:
+                        cols[col_idx].error(f"Error al cargar {image_name_actual}: {e}")
+                elif image_pending(image_ref):
+                    cols[col_idx].info(f"Descargando: {image_name_actual}")
+                elif image_error(image_ref) is not None:
+                    cols[col_idx].warning(f"La descarga falló antes de llegar {image_name_actual}: {image_error(image_ref)}")
+                else:
+                    cols[col_idx].warning(f"Img no hallada: {image_name_actual} (orig: {image_name_original_df})")
+            else:
+                cols[col_idx].caption(f"Faltan datos para imagen ID: {row.get('ID', 'N/A')}")
+        st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px;'>", unsafe_allow_html=True)
+
+def show_fullscreen_image(filtered_rows, image_folders_dict):
+    col1, col2 = st.columns([3, 2])
+    fullscreen_image_name_original_df = st.session_state.fullscreen_image # Este es el original del DF
+    actual_fn_col = st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN
+    original_fn_col = st.session_state.ORIGINAL_FILENAME_COLUMN
+
+    # Es mejor buscar en las filas filtradas porque son el contexto del usuario
+    fullscreen_row = filtered_rows.first(original_fn_col, fullscreen_image_name_original_df)
+    if fullscreen_row is None: # Si no está en el filtrado, buscar en el completo
+         df_results = filtered_rows.df
+         fullscreen_row_s = df_results[df_results[original_fn_col] == fullscreen_image_name_original_df]
+         fullscreen_row = fullscreen_row_s.iloc[0] if not fullscreen_row_s.empty else None
+
+    if fullscreen_row is not None:
+        age_group_val = fullscreen_row.get('age_group')
+        image_name_actual_for_fullscreen = fullscreen_row.get(actual_fn_col)
+        
+        folder_name_in_zip = EXPECTED_GROUP_FOLDERS.get(str(age_group_val).lower())
+        fullscreen_image_data = None
+
+        if folder_name_in_zip and folder_name_in_zip in image_folders_dict and image_name_actual_for_fullscreen:
+             fullscreen_image_data = image_source(image_folders_dict[folder_name_in_zip].get(image_name_actual_for_fullscreen))
+
+        with col1:
+            if fullscreen_image_data is not None:
+                st.image(fullscreen_image_data, caption=f"{fullscreen_image_name_original_df} (ID: {fullscreen_row.get('ID', 'N/A')})", use_column_width=True)
+            else:
+                st.error("No se pudo encontrar la imagen para pantalla completa.")
+        with col2:
+            st.subheader("Detalles de la Imagen")
+            # Convertir toda la fila a string para evitar errores con tipos no serializables en show_image_details
+            details_dict = {k: str(v) for k, v in fullscreen_row.to_dict().items()}
+            # show_image_details(details_dict) # Tu función original
+            for key, value in details_dict.items(): # Implementación directa
+                st.write(f"**{key}:** {value}")
+    else:
+        st.error("No se encontraron detalles para esta imagen.")
+
+    st.button("Cerrar Vista Detallada", key="close_fullscreen_btn", on_click=toggle_fullscreen, args=(fullscreen_image_name_original_df,))
+    st.markdown("<hr style='margin-top: 10px; margin-bottom: 10px;'>", unsafe_allow_html=True)
+
+@st.fragment
+def show_export_panel(filtered_rows, image_folders_dict, archive_stream=None):
+    # Descarga de Imágenes ZIP
+    if filtered_rows.empty:
+        st.info("No hay imágenes filtradas para descargar.")
+        return
+    if archive_stream is not None and not archive_stream.done.is_set():
+        # Un ZIP creado ahora omitiría las imágenes aún en descarga; la página se recarga al terminar
+        st.info("La descarga del ZIP estará disponible cuando terminen de descargarse todas las imágenes.")
+        return
+    # La creación del ZIP se cachea por la clave de las filas filtradas (versión del dataset y filtros)
+    # y por si las imágenes están completas: el ZIP tras una descarga fallida no se sirve después de otra completa
+    zip_buffer = create_downloadable_zip(filtered_rows, image_folders_dict, archive_stream is None or archive_stream.finished)
+    if zip_buffer.getbuffer().nbytes > 0:
+        st.download_button("Descargar Imágenes Filtradas (ZIP)", zip_buffer, "filtered_images.zip", "application/zip")
 
 # --- BLOQUE DE CARGA DE DATOS ---
 if not st.session_state.data_loaded:
-    service = get_drive_service()
-    if service is None:
+    drive_pool = get_drive_pool()
+    if drive_pool is None:
         st.error("No se pudo conectar con Google Drive.")
         st.stop()
+    with st.sidebar.expander("Conexiones a Google Drive"):
+        st.json(drive_pool.stats()) # Compartidas por todas las sesiones; 'waits' cuenta las esperas por conexión libre
+
+    ingest_job = get_job_runner().get(st.session_state.get('ingest_job_id'))
+    if ingest_job is not None and ingest_job.status == JOB_DONE:
+        # Copiar el resultado del job a esta sesión y pasar al dashboard
+        result = ingest_job.result
+        st.session_state.dataset = result['dataset']
+        st.session_state.df_results = result['dataset'].df
+        st.session_state.image_folders = result['image_folders']
+        st.session_state.thumbnails = result['thumbnails']
+        st.session_state.categories.update(result['categories'])
+        st.session_state.list_columns = result['list_columns']
+        st.session_state.filter_index = result['filter_index']
+        st.session_state.search_index = result['search_index']
+        st.session_state.archive_path = result['archive_path']
+        st.session_state.abs_temp_extract_path = result['abs_temp_extract_path']
+        st.session_state.archive_stream = result['archive_stream']
+        st.session_state.ingest_timings = ingest_job.timings()
+        st.session_state.ingest_job_id = None
+        st.session_state.data_loaded = True
+        st.rerun()
+    elif ingest_job is not None and ingest_job.finished:
+        if ingest_job.status == JOB_CANCELLED:
+            st.info(f"Se canceló la carga de '{ingest_job.description}'.")
+        else:
+            st.error(f"Fallo al cargar '{ingest_job.description}': {ingest_job.error}")
+        with st.expander("Mensajes", expanded=ingest_job.status != JOB_CANCELLED):
+            show_job_messages(ingest_job)
+        ingest_job = None # Permitir otra carga
+    elif ingest_job is not None:
+        show_ingest_job(ingest_job.id)
 
     # ... (lógica de selección de archivo de Drive sin cambios) ...
     folder_url = st.text_input("Ingrese el enlace de la carpeta de Google Drive:", value=st.session_state.get("gdrive_folder_url", ""))
@@ -708,7 +1266,7 @@ if not st.session_state.data_loaded:
         st.stop()
     
     try:
-        files = list_files_in_folder(service, folder_id)
+        files = list_files_in_folder(drive_pool, folder_id)
     except HttpError as e:
         st.error(f"Error crítico al listar archivos de Google Drive: {e}")
         st.stop()
@@ -717,7 +1275,7 @@ if not st.session_state.data_loaded:
         st.error("No se encontraron archivos en la carpeta de Google Drive.")
         st.stop()
 
-    file_options = {item['name']: item['id'] for item in files if item['name'].endswith('.zip')}
+    file_options = {item['path']: item for item in files if item['name'].endswith('.zip')}
     if not file_options:
         st.error("No se encontraron archivos .zip en la carpeta de Google Drive.")
         st.stop()
@@ -728,183 +1286,13 @@ if not st.session_state.data_loaded:
         st.session_state.selected_zip_index = list(file_options.keys()).index(selected_file_name)
 
 
-    if selected_file_name and st.button("Confirmar selección y Cargar Datos"):
-        with st.spinner("Descargando y procesando archivo ZIP..."):
-            file_id = file_options[selected_file_name]
-            temp_zip_path = "temp_data.zip"
-            temp_extract_path = "extracted_data_content" # Relativa al script
-            abs_temp_extract_path = os.path.abspath(temp_extract_path)
-            st.session_state.abs_temp_extract_path = abs_temp_extract_path # Guardar para referencia
-
-            try:
-                download_file_from_google_drive(service, file_id, temp_zip_path)
-                extract_zip(temp_zip_path, temp_extract_path)
-            except Exception as e:
-                st.error(f"Fallo en descarga o extracción: {e}")
-                # --- INICIO LIMPIEZA Y STOP ---
-                if os.path.exists(temp_zip_path):
-                    try:
-                        os.remove(temp_zip_path)
-                    except Exception as e_clean_zip:
-                        st.warning(f"No se pudo eliminar temp_zip_path: {e_clean_zip}")
-                abs_temp_extract_path = st.session_state.get("abs_temp_extract_path") # Recuperar si ya se guardó
-                if abs_temp_extract_path and os.path.exists(abs_temp_extract_path):
-                    try:
-                        shutil.rmtree(abs_temp_extract_path, ignore_errors=True) # Usar la absoluta aquí
-                    except Exception as e_clean_extract:
-                        st.warning(f"No se pudo eliminar abs_temp_extract_path: {e_clean_extract}")
-                st.stop()
-
-            abs_data_folder_path = os.path.join(abs_temp_extract_path, 'data')
-            if not os.path.exists(abs_data_folder_path):
-                st.error(f"Carpeta 'data/' no encontrada en '{abs_temp_extract_path}'. Verifique estructura del ZIP.")
-                # --- INICIO LIMPIEZA Y STOP ---
-                if os.path.exists(temp_zip_path):
-                    try:
-                        os.remove(temp_zip_path)
-                    except Exception as e_clean_zip:
-                        st.warning(f"No se pudo eliminar temp_zip_path: {e_clean_zip}")
-                # abs_temp_extract_path ya está definida y es la carpeta base extraída
-                if os.path.exists(abs_temp_extract_path):
-                    try:
-                        shutil.rmtree(abs_temp_extract_path, ignore_errors=True)
-                    except Exception as e_clean_extract:
-                        st.warning(f"No se pudo eliminar abs_temp_extract_path: {e_clean_extract}")
-                # --- FIN LIMPIEZA Y STOP ---
-                st.stop()
-
-            # Cargar imágenes
-            st.session_state.image_folders = {}
-            loaded_any_images = False
-            for age_group_key, folder_name_in_zip in EXPECTED_GROUP_FOLDERS.items():
-                abs_current_img_folder_path = os.path.join(abs_data_folder_path, folder_name_in_zip)
-                # Usar la función cacheada para leer imágenes
-                images = read_images_from_folder_cached(abs_current_img_folder_path)
-                if images:
-                    st.session_state.image_folders[folder_name_in_zip] = images
-                    loaded_any_images = True
-            
-            if not loaded_any_images:
-                st.error("No se cargaron imágenes. Verifique estructura del ZIP y nombres de carpetas.")
-                # --- INICIO LIMPIEZA Y STOP ---
-                if os.path.exists(temp_zip_path):
-                    try:
-                        os.remove(temp_zip_path)
-                    except Exception as e_clean_zip:
-                        st.warning(f"No se pudo eliminar temp_zip_path: {e_clean_zip}")
-                if os.path.exists(abs_temp_extract_path):
-                    try:
-                        shutil.rmtree(abs_temp_extract_path, ignore_errors=True)
-                    except Exception as e_clean_extract:
-                        st.warning(f"No se pudo eliminar abs_temp_extract_path: {e_clean_extract}")
-                # --- FIN LIMPIEZA Y STOP ---
-                st.stop()
-
-            # Cargar y PROCESAR DataFrame
-            csv_files = [f for f in os.listdir(abs_data_folder_path) if f.endswith('.csv')]
-            if not csv_files:
-                st.error(f"No se encontró CSV en '{abs_data_folder_path}'.")
-                # --- INICIO LIMPIEZA Y STOP ---
-                if os.path.exists(temp_zip_path):
-                    try:
-                        os.remove(temp_zip_path)
-                    except Exception as e_clean_zip:
-                        st.warning(f"No se pudo eliminar temp_zip_path: {e_clean_zip}")
-                if os.path.exists(abs_temp_extract_path):
-                    try:
-                        shutil.rmtree(abs_temp_extract_path, ignore_errors=True)
-                    except Exception as e_clean_extract:
-                        st.warning(f"No se pudo eliminar abs_temp_extract_path: {e_clean_extract}")
-                # --- FIN LIMPIEZA Y STOP ---
-                st.stop()
-
-            csv_file_path = os.path.join(abs_data_folder_path, csv_files[0])
-            try:
-                df = pd.read_csv(csv_file_path)
-
-                # --- PROCESAMIENTO DEL DF (HACERLO AQUÍ UNA VEZ) ---
-                original_fn_col = st.session_state.ORIGINAL_FILENAME_COLUMN
-                actual_fn_col = st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN
-
-                if original_fn_col in df.columns:
-                    df[actual_fn_col] = df[original_fn_col].apply(
-                        lambda x: x.rpartition('.')[0] + '.jpg' if isinstance(x, str) and x.lower().endswith('.png') else x
-                    )
-                elif actual_fn_col not in df.columns: # Si no existe ni el original para crearla, ni ella misma
-                    st.error(f"Columnas de nombre de archivo '{original_fn_col}' o '{actual_fn_col}' no encontradas.")
-                    raise ValueError("Faltan columnas de nombre de archivo")
-
-                required_cols = [actual_fn_col, 'prompt', 'age_group', 'ID'] # 'filename' original ya no es crítico si actual existe
-                if original_fn_col in df.columns and original_fn_col not in required_cols:
-                    required_cols.append(original_fn_col) # Si existe, mantenerla requerida para info
-
-                missing_cols = [col for col in required_cols if col not in df.columns]
-                if missing_cols:
-                    st.error(f"Columnas obligatorias faltantes: {', '.join(missing_cols)}")
-                    raise ValueError("Faltan columnas obligatorias")
-                
-                df.dropna(subset=[col for col in required_cols if col in df.columns], inplace=True) # Dropna solo de las que existen
-                
-                if 'age_group' in df.columns:
-                    df['age_group'] = df['age_group'].astype(str).str.lower()
-                
-                st.session_state.df_results = df # Guardar el DF PROCESADO
-                st.session_state.df_results_for_filters_options = df.copy() # Copia para opciones de filtro
-
-                # Poblar categorías para filtros (basado en el DF completo y procesado)
-                category_keys_to_populate = {
-                    "gender": "gender", 
-                    "race": "race", 
-                    "emotion": "emotion",
-                    #"personality": "personality", 
-                    "position": "position",
-                    "person_count": "person_count", 
-                    "location": "location",
-                }
-                for cat_key, df_col_name in category_keys_to_populate.items():
-                    if df_col_name in df.columns:
-                        # Usar el df completo para obtener todas las opciones únicas
-                        st.session_state.categories[cat_key] = get_unique_list_items(df, df_col_name)
-                        #if cat_key == 'personality' and st.session_state.categories[cat_key]:
-                        #    st.session_state.categories[cat_key] = [p.lower() for p in st.session_state.categories[cat_key]]
-                            # La columna del DF ya se modificará si es necesario en el filtrado, o se asume que ya está lower.
-                    else:
-                        st.session_state.categories[cat_key] = []
-                
-                st.session_state.categories['activities'] = [] # Sin opciones predefinidas por ahora
-
-                st.session_state.data_loaded = True
-                st.success("Datos cargados y procesados.")
-                if os.path.exists(temp_zip_path): # Limpiar ZIP descargado si todo fue bien
-                    try:
-                        os.remove(temp_zip_path)
-                    except Exception as e_clean_zip_success:
-                        st.warning(f"No se pudo eliminar temp_zip_path (tras éxito): {e_clean_zip_success}")
-                st.rerun()
-
-            except Exception as e_df:
-                st.error(f"Error procesando DataFrame o cargando datos: {e_df}")
-                # --- INICIO LIMPIEZA Y STOP ---
-                if os.path.exists(temp_zip_path):
-                    try:
-                        os.remove(temp_zip_path)
-                    except Exception as e_clean_zip:
-                        st.warning(f"No se pudo eliminar temp_zip_path: {e_clean_zip}")
-                # abs_temp_extract_path debería estar definida si la extracción ocurrió
-                if 'abs_temp_extract_path' in st.session_state and os.path.exists(st.session_state.abs_temp_extract_path):
-                    try:
-                        shutil.rmtree(st.session_state.abs_temp_extract_path, ignore_errors=True)
-                    except Exception as e_clean_extract:
-                        st.warning(f"No se pudo eliminar abs_temp_extract_path: {e_clean_extract}")
-                elif 'abs_temp_extract_path' not in st.session_state: # Si falló antes de guardarlo
-                    local_abs_extract_path = os.path.abspath("extracted_data_content") # Reconstruir localmente
-                    if os.path.exists(local_abs_extract_path):
-                        try:
-                            shutil.rmtree(local_abs_extract_path, ignore_errors=True)
-                        except Exception as e_clean_extract_local:
-                            st.warning(f"No se pudo eliminar (local) abs_temp_extract_path: {e_clean_extract_local}")
-                # --- FIN LIMPIEZA Y STOP ---
-                st.stop()
+    # La carga se ejecuta como job en segundo plano; la página lo consulta arriba y sigue respondiendo
+    if ingest_job is None and selected_file_name and st.button("Confirmar selección y Cargar Datos"):
+        ingest_job = get_job_runner().submit(ingest_dataset, INGEST_STAGES, drive_pool, file_options[selected_file_name],
+                                             st.session_state.ORIGINAL_FILENAME_COLUMN, st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN,
+                                             st.session_state.categories['activities'], description=selected_file_name)
+        st.session_state.ingest_job_id = ingest_job.id
+        st.rerun()
 
 
 # --- FIN BLOQUE DE CARGA DE DATOS ---
@@ -912,10 +1300,30 @@ if not st.session_state.data_loaded:
 else: # --- INICIO BLOQUE DASHBOARD (DATOS CARGADOS) ---
     df_results = st.session_state.df_results # Este es el DF ya procesado
     image_folders_dict = st.session_state.image_folders
+    thumbnails_dict = st.session_state.get('thumbnails') or {} # Solo los bundles traen miniaturas
 
     # Definir nombres de columna para usar en este bloque
     actual_fn_col = st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN
     original_fn_col = st.session_state.ORIGINAL_FILENAME_COLUMN
+
+    if st.session_state.get('ingest_timings'):
+        with st.sidebar.expander("Tiempos de la última carga"):
+            st.json({stage: f"{seconds:.2f} s" for stage, seconds in st.session_state.ingest_timings.items()})
+
+    archive_stream = st.session_state.get('archive_stream')
+    if archive_stream is not None and not archive_stream.done.is_set():
+        @st.fragment(run_every=2)
+        def show_stream_status():
+            # Solo este bloque se reejecuta mientras llega el ZIP; al terminar se recarga la página entera
+            if archive_stream.done.is_set():
+                st.rerun()
+            total = archive_stream.total_size
+            st.progress(archive_stream.downloaded_bytes / total,
+                        text=f"Descargando imágenes en segundo plano: {archive_stream.downloaded_bytes / 1024**2:.0f} de {total / 1024**2:.0f} MB "
+                             f"({archive_stream.available_count} archivos listos). Las imágenes pendientes muestran un aviso.")
+        show_stream_status()
+    elif archive_stream is not None and archive_stream.error is not None:
+        st.error(f"Fallo en la descarga en segundo plano: {archive_stream.error}. Las imágenes que no llegaron faltarán; recargue la página y vuelva a cargar el archivo para reanudar.")
     
     st.sidebar.header("Filtrar imágenes")
 
@@ -930,24 +1338,21 @@ else: # --- INICIO BLOQUE DASHBOARD (DATOS CARGADOS) ---
         st.session_state.current_page = 1 
         # st.rerun() # Selectbox ya causa rerun
 
-    filtered_df = df_results.copy()
+    # Los filtros por faceta solo estrechan una selección en bitmap sobre df_results; las filas se toman una vez, al final
+    selection = st.session_state.filter_index.select()
     if group_filter != "Todos":
-        filtered_df = filtered_df[filtered_df['age_group'].astype(str).str.lower() == group_filter.lower()]
+        selection.add('age_group', [group_filter.lower()]) # age_group ya está en minúsculas desde la carga
+
+    # Cada multiselect cuenta sus opciones sobre las filas que dejan los *demás* filtros: primero se leen todos los
+    # filtros del session_state y los widgets se dibujan después, en marcadores que conservan el orden de la barra lateral
+    multiselects = [] # (marcador, título, clave del widget, columna de la faceta, opciones, cuentas fijas si no tiene faceta)
 
     # Age Range Filter
     if 'age' in df_results.columns:
-        age_ranges = sorted(df_results['age'].astype(str).unique().tolist())
-        selected_age_ranges_display = st.sidebar.multiselect(
-            "Seleccionar Age Range",
-            get_sorted_options(st.session_state.df_results_for_filters_options, 'age', age_ranges),
-            default=get_default("age_range"), key="multiselect_age_range"
-        )
-        if st.session_state.get("multiselect_age_range", []) != selected_age_ranges_display: # Reset page
-             st.session_state.current_page = 1
-        # st.session_state.multiselect_age_range = selected_age_ranges_display # Ya lo hace el widget
-        selected_age_ranges = [age.split(" (")[0] for age in selected_age_ranges_display]
-        if selected_age_ranges:
-            filtered_df = filtered_df[filtered_df['age'].astype(str).isin(selected_age_ranges)]
+        age_ranges = sorted(str_value_counts(df_results['age']))
+        multiselects.append((st.sidebar.empty(), "Seleccionar Age Range", "multiselect_age_range", 'age',
+                             get_sorted_options(st.session_state.dataset, 'age', age_ranges), None))
+        selection.add('age', get_default("age_range"))
 
 
     if st.sidebar.button("Resetear Filtros"):
@@ -959,65 +1364,37 @@ else: # --- INICIO BLOQUE DASHBOARD (DATOS CARGADOS) ---
         st.rerun()
 
     # Dynamic category filters
+    list_columns = st.session_state.get('list_columns') or {}
     for category_key, options in st.session_state.categories.items():
         if not options and category_key != 'activities': continue
         filter_title = f"Seleccionar {category_key.replace('_', ' ').title()}"
+        selected_values = get_default(category_key)
         
-        current_selection = get_default(category_key)
-        selected_display = st.sidebar.multiselect(
-            filter_title,
-            get_sorted_options(st.session_state.df_results_for_filters_options, category_key, options),
-            default=current_selection, key=f"multiselect_{category_key}"
-        )
-        if current_selection != selected_display: # Reset page
-            st.session_state.current_page = 1
-
-        selected_values = [opt.split(" (")[0] for opt in selected_display]
-        if selected_values:
-            if category_key == "activities":
-                pattern = '|'.join(map(re.escape, selected_values))
-                filtered_df = filtered_df[filtered_df['prompt'].str.contains(pattern, case=False, na=False)]
-            else: # Otros filtros categóricos
-                df_column_name = category_key # Asumiendo mapeo directo
-                if df_results[df_column_name].apply(lambda x: isinstance(x, list)).any():
-                    filtered_df = filtered_df[filtered_df[df_column_name].apply(
-                        lambda L: isinstance(L, list) and any(item in selected_values for item in L))]
-                else: # Asegurar que la comparación se haga con la columna pre-procesada (ej. lowercased personality)
-                    # Si 'personality' se hizo lowercase en el df_results original, la comparación ya es correcta
-                    if category_key == 'personality': # Ejemplo: si la columna original no se modificó
-                         filtered_df = filtered_df[filtered_df[df_column_name].astype(str).str.lower().isin([v.lower() for v in selected_values])]
-                    else:
-                         filtered_df = filtered_df[filtered_df[df_column_name].astype(str).isin(selected_values)]
+        if category_key == 'activities' and ACTIVITY_FACET in list_columns: # Contadas en la carga, de una pasada por los prompts
+            activity_counts = list_columns[ACTIVITY_FACET].counts()
+            multiselects.append((st.sidebar.empty(), filter_title, f"multiselect_{category_key}", ACTIVITY_FACET,
+                                 sort_options({option: activity_counts.get(option, 0) for option in options}), None))
+            selection.add(ACTIVITY_FACET, selected_values) # Prompts con alguna de las actividades (sin distinguir mayúsculas)
+        else: # Otros filtros categóricos
+            df_column_name = category_key # Asumiendo mapeo directo
+            option_values = get_sorted_options(st.session_state.dataset, category_key, options)
+            if df_column_name in df_results.columns:
+                multiselects.append((st.sidebar.empty(), filter_title, f"multiselect_{category_key}", df_column_name, option_values, None))
+            else: # Columna ausente: sin faceta ni cuentas
+                multiselects.append((st.sidebar.empty(), filter_title, f"multiselect_{category_key}", None, option_values,
+                                     count_observations(st.session_state.dataset, category_key, option_values)))
+            if selected_values and df_column_name in df_results.columns: # Por el índice; personality sin distinguir mayúsculas
+                selection.add(df_column_name, selected_values, case=category_key != 'personality')
 
 
     # Object filters
     object_columns_map = {"objects": "Objetos", "assistive_devices": "Dispositivos de Asistencia", "digital_devices": "Dispositivos Digitales"}
     for col_name, display_name in object_columns_map.items():
-        if col_name in df_results.columns:
-            unique_items_with_counts = get_unique_objects_with_counts(st.session_state.df_results_for_filters_options, col_name)
-            
-            current_selection = get_default(col_name)
-            selected_items_display = st.sidebar.multiselect(
-                f"Seleccionar {display_name}",
-                [f"{obj} ({count})" for obj, count in unique_items_with_counts.items()],
-                default=current_selection, key=f"multiselect_{col_name}"
-            )
-            if current_selection != selected_items_display: # Reset page
-                st.session_state.current_page = 1
-
-            selected_items_values = [item.split(" (")[0] for item in selected_items_display]
-            if selected_items_values:
-                def check_item_presence(entry, items_to_find):
-                    if pd.isna(entry): return False
-                    current_list = []
-                    if isinstance(entry, list): current_list = entry
-                    elif isinstance(entry, str):
-                        try:
-                            evaluated = eval(entry)
-                            if isinstance(evaluated, list): current_list = evaluated
-                        except: pass
-                    return any(str(item_to_find) in map(str, current_list) for item_to_find in items_to_find)
-                filtered_df = filtered_df[filtered_df[col_name].apply(lambda x: check_item_presence(x, selected_items_values))]
+        if col_name in list_columns:
+            list_column = list_columns[col_name] # Analizada en la carga, una fila por fila de df_results
+            multiselects.append((st.sidebar.empty(), f"Seleccionar {display_name}", f"multiselect_{col_name}", col_name,
+                                 list(list_column.counts()), None)) # De más a menos frecuente
+            selection.add(col_name, get_default(col_name)) # Filas cuya lista contiene alguno de los elementos elegidos
 
     # Buscador General
     st.sidebar.header("Buscador General")
@@ -1037,13 +1414,33 @@ else: # --- INICIO BLOQUE DASHBOARD (DATOS CARGADOS) ---
 
     if st.session_state.search_term:
         term = st.session_state.search_term
-        if selected_column_search == 'Todas las Columnas':
-            mask = filtered_df.apply(lambda row: row.astype(str).str.contains(term, case=False, na=False).any(), axis=1)
-            filtered_df = filtered_df[mask]
-        else:
-            filtered_df = filtered_df[filtered_df[selected_column_search].astype(str).str.contains(term, case=False, na=False)]
+        def search_mask(rows, column=selected_column_search, term=term): # Solo se evalúa si el estado de filtros no está en caché
+            if column == 'Todas las Columnas':
+                # Los índices de todas las columnas, combinados (antes, un apply que creaba una Series por fila)
+                with st.spinner("Preparando el índice de búsqueda..."): # Solo tarda la primera vez por conjunto de datos
+                    return st.session_state.search_index.contains_any(term, rows=rows)
+            return st.session_state.search_index.contains(column, term, rows) # Por el índice de trigramas de la columna
+        # Se evalúa después de los filtros del índice, solo sobre las filas que estos dejan
+        selection.add_mask(search_mask, key=('search', selected_column_search, term), cost=TEXT_COST, takes_rows=True)
+
+    # Un estado de filtros ya visto, en esta sesión u otra del mismo dataset, no se vuelve a evaluar
+    result_cache = get_result_cache()
+    facet_counts = result_cache.facet_counts(st.session_state.dataset.version, selection,
+                                             [column for _, _, _, column, _, _ in multiselects if column is not None])
+    for placeholder, title, key, column, options, fixed_counts in multiselects:
+        counts = facet_counts[column] if column is not None else fixed_counts
+        # Las opciones son los propios valores, así la selección se conserva aunque cambien sus cuentas
+        current_selection = st.session_state.get(key, [])
+        if placeholder.multiselect(title, options, default=current_selection, key=key,
+                                   format_func=lambda option, counts=counts: f"{option} ({counts.get(option, 0)})") != current_selection:
+            st.session_state.current_page = 1 # Reset page
+    # Solo posiciones en df_results; cada parte de la página extrae únicamente las filas y columnas que muestra
+    filtered_rows = FilteredRows(df_results, result_cache.positions(st.session_state.dataset.version, selection),
+                                 st.session_state.dataset.version, selection.key)
+    with st.sidebar.expander("Caché de resultados de filtros"):
+        st.json(result_cache.stats())
     
-    st.session_state.filtered_df_count = len(filtered_df) # Guardar para paginación
+    st.session_state.filtered_df_count = len(filtered_rows) # Guardar para paginación
 
     # --- Display Area ---
     st.markdown("---")
@@ -1051,166 +1448,10 @@ else: # --- INICIO BLOQUE DASHBOARD (DATOS CARGADOS) ---
 
     # ... (Display applied filters summary - sin cambios, pero podría quitarse si es muy largo) ...
     
-    if not filtered_df.empty:
-        gb = AgGrid(filtered_df, height=300, fit_columns_on_grid_load=True, allow_unsafe_jscode=True, enable_enterprise_modules=False)
-        csv = filtered_df.to_csv(index=False).encode('utf-8')
-        st.download_button("Descargar Tabla Filtrada (CSV)", csv, "filtered_data.csv", "text/csv")
-    else:
-        st.info("La tabla está vacía con los filtros actuales.")
-
+    show_results_table(filtered_rows)
 
     st.markdown("---")
     st.subheader("Visualización de Imágenes")
+    show_image_viewer(filtered_rows, image_folders_dict, thumbnails_dict)
 
-    if 'fullscreen_image' not in st.session_state: st.session_state.fullscreen_image = None
-
-    if st.session_state.fullscreen_image is None:
-        if not filtered_df.empty:
-
-            # --- CONTROLES DE VISUALIZACIÓN DE IMÁGENES ---
-            vis_col1, vis_col2 = st.columns(2)
-            with vis_col1:
-                images_per_row = st.slider(
-                    "Imágenes por fila en la cuadrícula", 
-                    min_value=1, max_value=10, 
-                    value=st.session_state.get("images_per_row_slider_val", 4), # Usar valor guardado o 4 por defecto
-                    key="images_per_row_slider"
-                )
-                if st.session_state.get("images_per_row_slider_val") != images_per_row:
-                    st.session_state.images_per_row_slider_val = images_per_row
-                    # No es necesario st.rerun() aquí, el slider lo causa si el valor cambia.
-                    # El cambio en el número de columnas se reflejará en el siguiente ciclo.
-
-            with vis_col2:
-                # Permitir al usuario cambiar cuántas imágenes se muestran por página
-                # Usamos la clave 'images_per_page_display_input' para el widget
-                # y actualizamos 'images_per_page_display' en session_state
-                current_images_per_page = st.session_state.get("images_per_page_display", 20)
-                new_images_per_page = st.number_input(
-                    "Imágenes por página", 
-                    min_value=images_per_row, # Mínimo debe ser al menos las imágenes por fila
-                    max_value=200, # Un límite superior razonable
-                    value=current_images_per_page, 
-                    step=images_per_row, # Saltar en múltiplos de imágenes por fila tiene sentido
-                    key="images_per_page_display_input" 
-                )
-                if new_images_per_page != current_images_per_page:
-                    st.session_state.images_per_page_display = new_images_per_page
-                    st.session_state.current_page = 1 # Resetear a la página 1 si cambia el total por página
-                    st.rerun() # Forzar rerun para que la paginación se recalcule            
-            
-            # --- PAGINACIÓN ---
-            total_items = st.session_state.filtered_df_count
-            items_per_page = st.session_state.images_per_page_display
-            
-            total_pages = (total_items + items_per_page - 1) // items_per_page
-            if total_pages == 0: total_pages = 1 # Evitar división por cero si no hay items
-
-            # El selector de página ahora va después de definir items_per_page
-            # y puede estar junto a los otros controles de visualización o donde prefieras.
-            # Aquí lo pongo debajo para mantener el flujo.
-            st.session_state.current_page = st.number_input(
-                f"Página (1-{total_pages})", 
-                min_value=1, max_value=total_pages, 
-                value=min(st.session_state.current_page, total_pages), # Asegurar que no exceda total_pages
-                step=1,
-                key="image_page_selector"
-            )
-            
-            # page_col1, page_col2 = st.columns([0.7, 0.3])
-            # with page_col1:
-            #      images_per_row = st.slider("Imágenes por fila", min_value=1, max_value=10, value=st.session_state.get("images_per_row_slider_val", 4), key="images_per_row_slider")
-            #      st.session_state.images_per_row_slider_val = images_per_row
-            # with page_col2:
-            #      st.session_state.current_page = st.number_input(f"Página (1-{total_pages})", 
-            #                                                       min_value=1, max_value=total_pages, 
-            #                                                       value=st.session_state.current_page, step=1,
-            #                                                       key="image_page_selector")
-
-            start_idx = (st.session_state.current_page - 1) * items_per_page
-            end_idx = start_idx + items_per_page
-            paginated_df_view = filtered_df.iloc[start_idx:end_idx]
-            # --- FIN PAGINACIÓN ---
-            actual_fn_col = st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN
-            original_fn_col = st.session_state.ORIGINAL_FILENAME_COLUMN
-
-            for i in range(0, len(paginated_df_view), images_per_row):
-                row_data_for_display = paginated_df_view.iloc[i:i+images_per_row]
-                cols = st.columns(images_per_row) # Usar images_per_row que es fijo por página
-                for col_idx, (df_idx, row) in enumerate(row_data_for_display.iterrows()):
-                    image_name_actual = row.get(actual_fn_col)
-                    image_name_original_df = row.get(original_fn_col, image_name_actual) # Fallback
-                    age_group_val = row.get('age_group')
-
-                    if image_name_actual and age_group_val:
-                        folder_name_in_zip = EXPECTED_GROUP_FOLDERS.get(str(age_group_val).lower())
-                        image_path_on_disk = None
-                        if folder_name_in_zip and folder_name_in_zip in image_folders_dict:
-                            image_path_on_disk = image_folders_dict[folder_name_in_zip].get(image_name_actual)
-
-                        if image_path_on_disk and os.path.exists(image_path_on_disk): # os.path.exists es rápido para local
-                            try:
-                                cols[col_idx].image(image_path_on_disk, caption=f"{image_name_original_df}\nID: {row.get('ID', 'N/A')}", use_column_width=True)
-                                if cols[col_idx].button(f"Detalles", key=f"btn_detail_{df_idx}"): # Usar df_idx para unicidad
-                                    toggle_fullscreen(image_name_original_df) # Se usa el original para buscar en DF
-                                    st.rerun()
-                            except Exception as e:
-                                cols[col_idx].error(f"Error al cargar {image_name_actual}: {e}")
-                        else:
-                            cols[col_idx].warning(f"Img no hallada: {image_name_actual} (orig: {image_name_original_df})")
-                    else:
-                        cols[col_idx].caption(f"Faltan datos para imagen ID: {row.get('ID', 'N/A')}")
-                st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px;'>", unsafe_allow_html=True)
-        else:
-            st.info("No hay imágenes que coincidan con los filtros aplicados.")
-    else: # Fullscreen mode
-        col1, col2 = st.columns([3, 2])
-        fullscreen_image_name_original_df = st.session_state.fullscreen_image # Este es el original del DF
-
-        # Buscar en el DataFrame filtrado actual, o en el completo si es necesario
-        # Es mejor buscar en el filtered_df porque es el contexto del usuario
-        fullscreen_row_s = filtered_df[filtered_df[original_fn_col] == fullscreen_image_name_original_df]
-        if fullscreen_row_s.empty: # Si no está en el filtrado, buscar en el completo
-             fullscreen_row_s = df_results[df_results[original_fn_col] == fullscreen_image_name_original_df]
-
-        if not fullscreen_row_s.empty:
-            fullscreen_row = fullscreen_row_s.iloc[0]
-            age_group_val = fullscreen_row.get('age_group')
-            image_name_actual_for_fullscreen = fullscreen_row.get(actual_fn_col)
-            
-            folder_name_in_zip = EXPECTED_GROUP_FOLDERS.get(str(age_group_val).lower())
-            fullscreen_image_path_on_disk = None
-
-            if folder_name_in_zip and folder_name_in_zip in image_folders_dict and image_name_actual_for_fullscreen:
-                 fullscreen_image_path_on_disk = image_folders_dict[folder_name_in_zip].get(image_name_actual_for_fullscreen)
-
-            with col1:
-                if fullscreen_image_path_on_disk and os.path.exists(fullscreen_image_path_on_disk):
-                    st.image(fullscreen_image_path_on_disk, caption=f"{fullscreen_image_name_original_df} (ID: {fullscreen_row.get('ID', 'N/A')})", use_column_width=True)
-                else:
-                    st.error("No se pudo encontrar la imagen para pantalla completa.")
-            with col2:
-                st.subheader("Detalles de la Imagen")
-                # Convertir toda la fila a string para evitar errores con tipos no serializables en show_image_details
-                details_dict = {k: str(v) for k, v in fullscreen_row.to_dict().items()}
-                # show_image_details(details_dict) # Tu función original
-                for key, value in details_dict.items(): # Implementación directa
-                    st.write(f"**{key}:** {value}")
-        else:
-            st.error("No se encontraron detalles para esta imagen.")
-
-        if st.button("Cerrar Vista Detallada", key="close_fullscreen_btn"):
-            st.session_state.fullscreen_image = None
-            st.rerun()
-        st.markdown("<hr style='margin-top: 10px; margin-bottom: 10px;'>", unsafe_allow_html=True)
-
-    # Descarga de Imágenes ZIP
-    if not filtered_df.empty:
-        df_for_zip = filtered_df.drop_duplicates(subset=[st.session_state.ACTUAL_IMAGE_FILENAME_COLUMN, 'age_group'], keep='first')
-        # La creación del ZIP se cachea, por lo que filtered_df y image_folders_dict deben ser argumentos
-        # para que la caché se invalide si cambian.
-        zip_buffer = create_downloadable_zip(filtered_df, image_folders_dict)
-        if zip_buffer.getbuffer().nbytes > 0:
-            st.download_button("Descargar Imágenes Filtradas (ZIP)", zip_buffer, "filtered_images.zip", "application/zip")
-    elif st.session_state.data_loaded:
-        st.info("No hay imágenes filtradas para descargar.")
+    show_export_panel(filtered_rows, image_folders_dict, archive_stream)
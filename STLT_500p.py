@@ -14,11 +14,28 @@ from st_aggrid import AgGrid
 # Removed cache_data decorator for get_drive_service as it's often better not to cache resources like service objects directly
 # from streamlit import cache_data # Removed this import as cache_data is used specifically below
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 # from google_auth_httplib2 import Request # Seems unused, commented out
 from googleapiclient.errors import HttpError
 
+from ageai.bundle import BUNDLE_DIR, bundle_members, open_bundle
+from ageai.columnar import COLUMNAR_NAME, read_csv_cached
+from ageai.dataset import Dataset
+from ageai.dataset_cache import ARCHIVE_NAME, DatasetCache, cache_key
+from ageai.drive import DriveClientPool, DriveRangeFetcher, download_identity, get_file_metadata, list_folder
+from ageai.facet_index import TEXT_COST, FacetIndex
+from ageai.filtered_rows import FilteredRows
+from ageai.jobs import CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, JobCancelled, JobError, JobRunner
+from ageai.list_columns import parse_list_columns
+from ageai.phrase_matcher import PhraseMatcher
+from ageai.schema import optimize_dtypes, str_value_counts
+from ageai.ranged_download import RangesNotSupportedError, download_ranges, resumable_download
+from ageai.result_cache import ResultCache
+from ageai.streaming import active_stream, start_stream
+from ageai.text_search import SearchIndex
+from ageai.zip_store import (IMAGE_EXTENSIONS, ZipStore, add_image_to_zip, extract_members, find_csv_member, image_error, image_pending,
+                             image_source, manifest_members, open_store)
+
 # from googleapiclient.http import HttpRequest # Seems unused, commented out
 # from googleapiclient.http import build_http # Seems unused, commented out
 
@@ -27,9 +44,49 @@ from googleapiclient.errors import HttpError
 
 st.set_page_config(layout="wide")
 
+# --- Download Settings ---
+# The ZIP is fetched as concurrent byte ranges unless AGEAI_PARALLEL_DOWNLOAD=0
+PARALLEL_DOWNLOAD = os.getenv('AGEAI_PARALLEL_DOWNLOAD', '1') != '0'
+DOWNLOAD_WORKERS = int(os.getenv('AGEAI_DOWNLOAD_WORKERS', '8'))
+DOWNLOAD_RANGE_SIZE = int(os.getenv('AGEAI_DOWNLOAD_RANGE_MB', '16')) * 1024 * 1024
+# Keep completed ranges in '<zip>.part.json' so retries and restarts only fetch what is missing
+RESUMABLE_DOWNLOAD = os.getenv('AGEAI_RESUMABLE_DOWNLOAD', '1') != '0'
+
+# --- Drive Client Settings ---
+# Drive connections shared by all sessions (listing, metadata and download workers); extra callers wait
+DRIVE_POOL_SIZE = int(os.getenv('AGEAI_DRIVE_POOL_SIZE', '16'))
+
+# --- Drive Listing Settings ---
+# Folder listings are cached for AGEAI_LISTING_TTL seconds; AGEAI_LIST_RECURSIVE=1 also lists subfolders
+LISTING_TTL = int(os.getenv('AGEAI_LISTING_TTL', '60'))
+LIST_RECURSIVE = os.getenv('AGEAI_LIST_RECURSIVE', '0') == '1'
+
+# --- Dataset Cache Settings ---
+# Extracted datasets are kept per Drive file id + checksum; AGEAI_CACHE_MAX_GB=0 disables the cache
+DATASET_CACHE_DIR = os.getenv('AGEAI_CACHE_DIR', './dataset_cache')
+DATASET_CACHE_MAX_BYTES = int(float(os.getenv('AGEAI_CACHE_MAX_GB', '20')) * 1024**3)
+
+# --- Image Store Settings ---
+# 'zip' serves images straight from the downloaded archive; 'extract' unpacks it to disk first
+IMAGE_STORE = os.getenv('AGEAI_IMAGE_STORE', 'zip')
+EXTRACT_WORKERS = int(os.getenv('AGEAI_EXTRACT_WORKERS', '8'))
+# In 'zip' mode, open the dashboard as soon as the CSV has arrived and let images fill in as they download
+STREAM_ARCHIVE = os.getenv('AGEAI_STREAM_ARCHIVE', '1') != '0'
+
+# --- Ingest Settings ---
+# Datasets load in background jobs; at most AGEAI_INGEST_WORKERS run at once across all sessions
+INGEST_WORKERS = int(os.getenv('AGEAI_INGEST_WORKERS', '4'))
+
+# --- Filter Result Settings ---
+# Rows of recent filter states, shared by the sessions viewing the same dataset; AGEAI_RESULT_CACHE_MB=0 disables it
+RESULT_CACHE_MAX_BYTES = int(float(os.getenv('AGEAI_RESULT_CACHE_MB', '256')) * 1024**2)
+# The table shows the filtered rows a page at a time; only that page is gathered from the loaded frame
+TABLE_PAGE_ROWS = 1000
+
 # --- Session State Initialization ---
 if 'data_loaded' not in st.session_state:
     st.session_state.data_loaded = False
+    st.session_state.dataset = None
     st.session_state.df_results = None
     st.session_state.all_images = None # Changed from images1/images2
     st.session_state.group_filter = "Todos"
@@ -57,44 +114,39 @@ if 'data_loaded' not in st.session_state:
         }
 
 # --- Caching Functions ---
-@st.cache_data()
-def count_observations(df, category, options):
-    if df is None or category not in df.columns and category not in ['activities', 'prompt']:
+# Cached functions over the metadata take its Dataset handle and key on the version token, not on the frame's contents
+DATASET_HASH_FUNCS = {Dataset: lambda dataset: dataset.version}
+
+@st.cache_data(hash_funcs=DATASET_HASH_FUNCS)
+def count_observations(dataset, category, options):
+    # Categorical columns only: activities and object lists are counted by their facets at load
+    df = dataset.df if dataset is not None else None
+    if df is None or category not in df.columns:
          return {option: 0 for option in options}
+    # One pass (on the category codes when the column is categorical)
+    counts = str_value_counts(df[category])
+    return {option: counts.get(str(option), 0) for option in options}
 
-    if category in ['activities']:
-        # Count occurrences within the 'prompt' string for activities
-        return {option: df['prompt'].astype(str).str.contains(option, case=False, na=False).sum() for option in options}
-    elif category == 'prompt':
-         # Generic prompt search (if needed, though usually handled by text search)
-        return {option: df[category].astype(str).str.contains(option, case=False, na=False).sum() for option in options}
-    elif category in ["objects", "objects_assist_devices", "objects_digi_devices"]:
-         # Handle list-like columns stored as strings
-         counts = {option: 0 for option in options}
-         for option in options:
-             # Safely check for the string representation of the option within the column
-             # This handles cases like "['item1', 'item2']" containing "'item1'"
-             counts[option] = df[category].astype(str).str.contains(f"'{option}'", regex=False, na=False).sum()
-         return counts
-    else:
-         # Standard categorical counting
-        return {option: df[df[category].astype(str) == str(option)].shape[0] for option in options}
-
-@st.cache_data()
-def get_sorted_options(df, category, options):
-    if df is None:
-        return [f"{option} (0)" for option in options]
-
+@st.cache_data(hash_funcs=DATASET_HASH_FUNCS)
+def get_sorted_options(dataset, category, options):
     # Ensure options are strings for consistent processing
     str_options = [str(opt) for opt in options]
+    if dataset is None:
+        return str_options
 
-    counts = count_observations(df, category, str_options)
-    # Handle potential missing counts if an option wasn't found
-    options_with_count = sorted([(option, counts.get(option, 0)) for option in str_options], key=lambda x: x[1], reverse=True)
-    return [f"{option} ({count})" for option, count in options_with_count]
+    counts = count_observations(dataset, category, str_options)
+    return sort_options(str_options, counts)
 
-@st.cache_data(max_entries=1)
-def create_downloadable_zip(_filtered_df, _all_images):
+def sort_options(options, counts):
+    # Most frequent first; options missing from counts have none
+    return sorted(options, key=lambda option: counts.get(option, 0), reverse=True)
+
+@st.cache_data(max_entries=1, hash_funcs={FilteredRows: lambda rows: rows.key}) # Like the ZIP: one CSV per filter state
+def filtered_rows_csv(filtered_rows):
+    return filtered_rows.to_csv() # Written a chunk of rows at a time
+
+@st.cache_data(max_entries=1, hash_funcs={FilteredRows: lambda rows: rows.key}) # One ZIP per filter state and image set
+def create_downloadable_zip(filtered_rows, _all_images, images_complete=True):
     zip_buffer = io.BytesIO()
     try:
         with ZipFile(zip_buffer, 'w') as zip_file:
@@ -103,7 +155,7 @@ def create_downloadable_zip(_filtered_df, _all_images):
                  st.error("Image dictionary is not available.")
                  return zip_buffer # Return empty buffer
 
-            for _, row in _filtered_df.iterrows():
+            for _, row in filtered_rows.columns(['filename_jpg', 'age_group', 'ID']).iterrows(): # Only the columns used here
                 image_name = row.get('filename_jpg')
                 age_group = row.get('age_group') # Get the age group from the DataFrame
 
@@ -115,14 +167,12 @@ def create_downloadable_zip(_filtered_df, _all_images):
                     continue
 
                 if isinstance(image_name, str) and isinstance(age_group, str):
-                    image_path = _all_images.get(image_name) # Look up in the combined dictionary
-
-                    if image_path and os.path.exists(image_path):
-                        # Use the age_group from the DataFrame as the folder name in the ZIP
-                        folder_name_in_zip = age_group
-                        zip_file.write(image_path, os.path.join(folder_name_in_zip, image_name))
-                    else:
-                        st.warning(f"Image file not found or path invalid for: {image_name} (Expected at: {image_path})")
+                    image_ref = _all_images.get(image_name) # Look up in the combined dictionary
+
+                    # Use the age_group from the DataFrame as the folder name in the ZIP
+                    folder_name_in_zip = age_group
+                    if not add_image_to_zip(zip_file, image_ref, os.path.join(folder_name_in_zip, image_name)):
+                        st.warning(f"Image file not found or path invalid for: {image_name} (Expected at: {getattr(image_ref, 'name', image_ref)})")
                 else:
                     st.warning(f"Invalid type for image_name or age_group for image: {image_name}")
 
@@ -134,39 +184,42 @@ def create_downloadable_zip(_filtered_df, _all_images):
     return zip_buffer
 
 # --- Google Drive Functions ---
-@st.cache_resource # Cache the service object
-def get_drive_service():
-    try:
-        encoded_sa = os.getenv('GOOGLE_SERVICE_ACCOUNT')
-        if not encoded_sa:
-            # Try loading from Streamlit secrets if env var is not set
-            if 'google_service_account_encoded' in st.secrets:
-                 encoded_sa = st.secrets['google_service_account_encoded']
-            else:
-                raise ValueError("Google Service Account credentials not found in environment variables (GOOGLE_SERVICE_ACCOUNT) or Streamlit secrets (google_service_account_encoded)")
+@st.cache_resource # Cache the credentials; the Drive client pool builds its connections from them
+def get_drive_credentials():
+    encoded_sa = os.getenv('GOOGLE_SERVICE_ACCOUNT')
+    if not encoded_sa:
+        # Try loading from Streamlit secrets if env var is not set
+        if 'google_service_account_encoded' in st.secrets:
+             encoded_sa = st.secrets['google_service_account_encoded']
+        else:
+            raise ValueError("Google Service Account credentials not found in environment variables (GOOGLE_SERVICE_ACCOUNT) or Streamlit secrets (google_service_account_encoded)")
 
-        sa_json = base64.b64decode(encoded_sa).decode('utf-8')
-        sa_dict = json.loads(sa_json)
+    sa_json = base64.b64decode(encoded_sa).decode('utf-8')
+    sa_dict = json.loads(sa_json)
 
-        credentials = service_account.Credentials.from_service_account_info(
-            sa_dict,
-            scopes=['https://www.googleapis.com/auth/drive.readonly']
-        )
+    return service_account.Credentials.from_service_account_info(
+        sa_dict,
+        scopes=['https://www.googleapis.com/auth/drive.readonly']
+    )
 
-        service = build('drive', 'v3', credentials=credentials)
-        return service
+@st.cache_resource # One pool per server process; each request checks out its own connection
+def get_drive_pool():
+    try:
+        drive_pool = DriveClientPool(get_drive_credentials(), size=DRIVE_POOL_SIZE)
+        with drive_pool.client():
+            pass # Build the first client now so credential problems surface here
+        return drive_pool
     except Exception as e:
         st.error(f"Error initializing Google Drive service: {str(e)}")
         return None
 
-def list_files_in_folder(service, folder_id, retries=3):
+@st.cache_data(ttl=LISTING_TTL, show_spinner=False) # Reruns reuse the listing; _drive_pool is not hashed
+def list_files_in_folder(_drive_pool, folder_id, recursive=LIST_RECURSIVE, retries=3):
     for attempt in range(retries):
         try:
-            results = service.files().list(
-                q=f"'{folder_id}' in parents and trashed=false", # Exclude trashed files
-                fields="files(id, name)"
-            ).execute()
-            return results.get('files', [])
+            # Follows nextPageToken; files in subfolders get a 'path' like 'sub/archive.zip'
+            with _drive_pool.client() as client:
+                return list_folder(client.service, folder_id, recursive=recursive)
         except HttpError as error:
             st.error(f"Error listing files (Attempt {attempt+1}/{retries}): {error}")
             if error.resp.status in [403, 500, 503] and attempt < retries - 1:
@@ -183,68 +236,146 @@ def list_files_in_folder(service, folder_id, retries=3):
 #         super().__init__(*args, **kwargs)
 #         self.timeout = 120
 
-def download_file_from_google_drive(service, file_id, dest_path, retries=3):
+def download_file_parallel(drive_pool, file_id, dest_path, job, workers=DOWNLOAD_WORKERS, range_size=DOWNLOAD_RANGE_SIZE,
+                           resumable=RESUMABLE_DOWNLOAD):
+    """Download the file as concurrent byte ranges. Returns False if Drive reports no size."""
+    with drive_pool.client() as client:
+        metadata = get_file_metadata(client.service, file_id)
+    total_size = metadata.get('size')
+    if not total_size:
+        return False
+
+    def show_progress(done_bytes, total_bytes):
+        job.update(done_bytes / total_bytes, f"{done_bytes / 1024**2:.0f} of {total_bytes / 1024**2:.0f} MB, {workers} connections")
+
+    fetcher = DriveRangeFetcher(drive_pool, file_id)
+    if resumable:
+        # Verifies the finished file against Drive's md5Checksum before renaming it into place
+        resumable_download(fetcher, dest_path, total_size, download_identity(metadata),
+                           md5_checksum=metadata.get('md5Checksum'), workers=workers,
+                           range_size=range_size, progress=show_progress, cancel_event=job.cancel_event)
+    else:
+        download_ranges(fetcher, dest_path, total_size, workers=workers, range_size=range_size, progress=show_progress,
+                        cancel_event=job.cancel_event)
+    job.check_cancelled() # A cancelled download returns early with ranges missing
+    return True
+
+def download_file_from_google_drive(drive_pool, file_id, dest_path, job, retries=3, parallel=PARALLEL_DOWNLOAD):
+    if parallel:
+        for attempt in range(retries):
+            try:
+                if download_file_parallel(drive_pool, file_id, dest_path, job):
+                    return True
+                break # No size reported by Drive, use the single stream below
+            except JobCancelled:
+                raise
+            except RangesNotSupportedError as e:
+                job.log('warning', f"{e}. Using a single stream...")
+                break # Every range would fetch the whole file again
+            except Exception as e:
+                job.check_cancelled() # Cancelling stops the ranged download with an error; do not retry
+                job.log('warning', f"Ranged download interrupted (Attempt {attempt+1}/{retries}): {e}")
+                if attempt < retries - 1:
+                    time.sleep(2 ** attempt) # Completed ranges are kept; the next attempt resumes
+        else:
+            job.log('warning', "Ranged download failed. Falling back to a single stream...")
+
     for attempt in range(retries):
         try:
-            request = service.files().get_media(fileId=file_id)
             # Use 'wb' for binary write mode
-            with io.FileIO(dest_path, 'wb') as fh:
+            with drive_pool.client() as client, io.FileIO(dest_path, 'wb') as fh:
+                request = client.service.files().get_media(fileId=file_id)
                 downloader = MediaIoBaseDownload(fh, request, chunksize=1024*1024*5) # 5MB chunk size
-                progress_bar = st.progress(0)
-                status_text = st.empty()
                 done = False
                 while not done:
                     try:
                         status, done = downloader.next_chunk(num_retries=2) # Add retries within next_chunk
                         if status:
-                            progress = int(status.progress() * 100)
-                            progress_bar.progress(progress)
-                            status_text.text(f"Downloading... {progress}%")
+                            job.update(status.progress(), f"{int(status.progress() * 100)}% (single stream)")
                     except HttpError as e:
                          # Handle chunk download errors specifically
-                         st.warning(f"Error during chunk download (Attempt {attempt+1}): {e}. Retrying...")
+                         job.log('warning', f"Error during chunk download (Attempt {attempt+1}): {e}. Retrying...")
                          time.sleep(2) # Wait before retrying the chunk
                          # Continue the inner loop to retry the chunk
-                    except Exception as inner_e:
-                        st.error(f"Unexpected error during chunk download: {inner_e}")
-                        raise inner_e # Reraise unexpected errors
-            progress_bar.empty() # Remove progress bar on completion
-            status_text.success(f"File downloaded successfully to {dest_path}")
             return True # Indicate success
+        except JobCancelled:
+            raise
         except HttpError as error:
-            st.error(f"Error downloading file (Attempt {attempt+1}/{retries}): {error}")
+            job.log('error', f"Error downloading file (Attempt {attempt+1}/{retries}): {error}")
             if error.resp.status in [403, 500, 503] and attempt < retries - 1:
                  time.sleep(2 ** attempt) # Exponential backoff
             else:
-                 st.error(f"Failed to download file after {retries} attempts.")
                  return False # Indicate failure
         except Exception as e:
-            st.error(f"An unexpected error occurred during download (Attempt {attempt+1}): {str(e)}")
+            job.log('error', f"An unexpected error occurred during download (Attempt {attempt+1}): {str(e)}")
             if attempt < retries - 1:
                 time.sleep(2 ** attempt)
             else:
-                st.error(f"Failed to download file due to unexpected error: {e}")
                 return False # Indicate failure
     return False # Indicate failure if all retries fail
 
-def extract_zip(zip_path, extract_to):
+def pick_csv_member(names):
+    # A precomputed bundle (ageai/bundle.py) replaces the CSV; otherwise find_and_read_csv's own choice
+    csv_member = find_csv_member(names)
+    return bundle_members(names) or ([csv_member] if csv_member else [])
+
+def stream_archive(drive_pool, file_id, dest_path, job, on_complete=None, workers=DOWNLOAD_WORKERS, range_size=DOWNLOAD_RANGE_SIZE):
+    """Start a background ranged download of the ZIP and wait only until its CSV is readable.
+
+    Returns the StreamingArchive, or None if Drive reports no size for the file.
+    """
+    with drive_pool.client() as client:
+        metadata = get_file_metadata(client.service, file_id)
+    total_size = metadata.get('size')
+    if not total_size:
+        return None
+
+    def show_progress(done_bytes, total_bytes):
+        job.update(None, f"Fetching the archive index and CSV... ({done_bytes / 1024**2:.0f} of {total_bytes / 1024**2:.0f} MB so far)")
+
+    stream = start_stream(DriveRangeFetcher(drive_pool, file_id), dest_path, total_size,
+                          download_identity(metadata), md5_checksum=metadata.get('md5Checksum'),
+                          csv_member=pick_csv_member, workers=workers, range_size=range_size,
+                          on_complete=on_complete)
+    try:
+        stream.wait_for_csv(progress=show_progress)
+    except Exception:
+        stream.cancel()
+        raise
+    return stream
+
+@st.cache_resource # One cache object per server process, shared by all sessions
+def get_dataset_cache():
+    if DATASET_CACHE_MAX_BYTES <= 0:
+        return None
+    return DatasetCache(DATASET_CACHE_DIR, DATASET_CACHE_MAX_BYTES)
+
+def extract_zip(zip_path, extract_to, job):
     # Ensure the extraction directory exists and is empty
     if os.path.exists(extract_to):
         shutil.rmtree(extract_to)
     os.makedirs(extract_to, exist_ok=True)
 
     try:
-        with ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        st.write(f"Extracted contents in '{extract_to}':")
-        # List only top-level items for brevity
-        st.write([item for item in os.listdir(extract_to)])
+        with ZipStore(zip_path) as store:
+            # Only the CSV and the images its rows reference; orphans and other files are skipped
+            members = manifest_members(store, ['filename_jpg', 'filename'], extra_prefixes=(BUNDLE_DIR,))
+            if members is None:
+                job.log('warning', "Could not read image names from the CSV. Extracting the whole archive.")
+                members = list(store.members.values())
+            else:
+                job.log('info', f"Extracting {len(members)} referenced files ({len(store.members) - len(members)} unreferenced files skipped).")
+            def show_progress(done, total):
+                job.update(done / total, f"{done}/{total} files")
+            extract_members(store, members, extract_to, workers=EXTRACT_WORKERS, progress=show_progress)
         return True
+    except JobCancelled:
+        raise
     except FileNotFoundError:
-        st.error(f"Error extracting ZIP: File not found at {zip_path}")
+        job.log('error', f"Error extracting ZIP: File not found at {zip_path}")
         return False
     except Exception as e:
-        st.error(f"Error extracting ZIP file '{zip_path}': {str(e)}")
+        job.log('error', f"Error extracting ZIP file '{zip_path}': {str(e)}")
         return False
 
 @st.cache_data()
@@ -281,53 +412,70 @@ def show_image_details(image_data):
 
 # Keep persist="disk" if caching large amounts of image data is beneficial and fits disk limits
 @st.cache_data(persist="disk")
-def read_images_from_folder(folder_path):
+def read_images_from_folder(folder_path, zip_path=None, zip_mtime=None):
+    # With zip_path, folder_path is a folder inside the archive and the values are ZipMember
+    # handles instead of file paths. zip_mtime only keys the cache to the archive version.
+    if zip_path:
+        stream = active_stream(zip_path)
+        # While the archive is still streaming in, list every member; pending ones show a placeholder
+        images = stream.handles(folder_path, IMAGE_EXTENSIONS) if stream else open_store(zip_path).files_in_folder(folder_path)
+        return {filename: images[filename] for filename in sorted(images, key=natural_sort_key)}
+
+    # Runs inside the ingest job: errors propagate (and are not cached) instead of calling st.error
     images = {}
     if not os.path.isdir(folder_path):
-        st.warning(f"Image folder not found: {folder_path}")
         return images
-    try:
-        # Use natural sort key for filenames
-        filenames = sorted(os.listdir(folder_path), key=natural_sort_key)
-        for filename in filenames:
-            # Make check case-insensitive
-            if filename.lower().endswith((".jpg", ".jpeg", ".png", ".webp")): # Added more formats
-                image_path = os.path.join(folder_path, filename)
-                if os.path.isfile(image_path):
-                    images[filename] = image_path # Store filename as key, full path as value
-    except Exception as e:
-        st.error(f"Error reading images from {folder_path}: {e}")
+    # Use natural sort key for filenames
+    filenames = sorted(os.listdir(folder_path), key=natural_sort_key)
+    for filename in filenames:
+        # Make check case-insensitive
+        if filename.lower().endswith((".jpg", ".jpeg", ".png", ".webp")): # Added more formats
+            image_path = os.path.join(folder_path, filename)
+            if os.path.isfile(image_path):
+                images[filename] = image_path # Store filename as key, full path as value
     return images
 
 def natural_sort_key(s):
     # Handles filenames with numbers for sorting (e.g., img1.jpg, img10.jpg)
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'([0-9]+)', s)]
 
+def list_category_folders(extract_path, zip_path=None):
+    """Return the 'data' folder and its subfolders, or (data folder, None) if it is missing."""
+    if zip_path:
+        store = open_store(zip_path)
+        return 'data', (store.subfolders('data') if store.listdir('data') else None)
+    data_folder_path = os.path.join(extract_path, 'data')
+    if not os.path.isdir(data_folder_path):
+        return data_folder_path, None
+    return data_folder_path, [d for d in os.listdir(data_folder_path) if os.path.isdir(os.path.join(data_folder_path, d))]
+
 # Removed caching here as it might read outdated CSV if ZIP is re-uploaded with same name
 # @st.cache_data(persist="disk")
-def find_and_read_csv(extract_path):
-    data_folder = os.path.join(extract_path, 'data')
-    if not os.path.isdir(data_folder):
-        st.error(f"'data' directory not found within extracted files at {extract_path}")
-        return None
-
-    csv_files = [f for f in os.listdir(data_folder) if f.startswith('df_') and f.endswith('.csv')]
-    if not csv_files:
-        st.error(f"No CSV file starting with 'df_' found in the 'data' directory.")
-        return None
+def find_and_read_csv(extract_path, job, zip_path=None, columnar_path=None):
+    if zip_path:
+        # Read the CSV member straight from the archive instead of an extracted copy
+        store = open_store(zip_path)
+        if not store.listdir('data'):
+            raise JobError(f"'data' directory not found within the ZIP file at {zip_path}")
+        # The member a streamed download fetched first (see pick_csv_member)
+        csv_member = find_csv_member(store)
+        csv_source = lambda name: store.open_member(name)
+    else:
+        if not os.path.isdir(os.path.join(extract_path, 'data')):
+            raise JobError(f"'data' directory not found within extracted files at {extract_path}")
+        csv_member = find_csv_member(extract_path)
+        csv_source = lambda name: os.path.join(extract_path, name)
 
-    if len(csv_files) > 1:
-        st.warning(f"Multiple CSV files found ({', '.join(csv_files)}). Using the first one: {csv_files[0]}")
+    if csv_member is None:
+        raise JobError(f"No CSV file found in the 'data' directory.")
 
-    csv_file_path = os.path.join(data_folder, csv_files[0])
     try:
-        df = pd.read_csv(csv_file_path)
-        st.success(f"Successfully loaded DataFrame from {csv_files[0]}.")
-        return df
+        # With a cache entry, the parsed CSV is kept as a memory-mapped Arrow file for the next load
+        df, columnar_hit = read_csv_cached(lambda: csv_source(csv_member), columnar_path)
     except Exception as e:
-        st.error(f"Error reading CSV file {csv_files[0]}: {e}")
-        return None
-
+        raise JobError(f"Error reading CSV file {csv_member}: {e}") from e
+    job.log('success', f"Successfully loaded DataFrame from {csv_member}" + (" (columnar cache)." if columnar_hit else "."))
+    return df
 
 def toggle_fullscreen(image_name):
     if st.session_state.get('fullscreen_image') == image_name:
@@ -340,99 +488,358 @@ def get_default(key):
     return st.session_state.get(key, [])
 
 
-# Keep caching for potentially expensive unique value extraction
-@st.cache_data(persist="disk")
-def get_unique_list_items(df_results, category):
-    unique_items = set()
-    if df_results is not None and category in df_results.columns:
-        # Drop NA values before processing
-        items_series = df_results[category].dropna()
-
-        for item in items_series:
-            # Handle items that might be strings representing lists or actual lists
-            processed_item = None
-            if isinstance(item, str):
+# --- Background Ingest ---
+INGEST_STAGES = [
+    ('download', "Download"),
+    ('extract', "Extract"),
+    ('csv', "Read CSV"),
+    ('images', "Index images"),
+    ('filters', "Build filter options"),
+]
+# Columns holding stringified lists such as "['cane', 'glasses']"
+OBJECT_LIST_COLUMNS = ["objects", "objects_assist_devices", "objects_digi_devices"]
+# Activities found in the prompts at load time, kept and filtered like a list column under this name
+ACTIVITY_FACET = "prompt_activities"
+
+@st.cache_resource # One runner per server process, so several users can load datasets in parallel
+def get_job_runner():
+    return JobRunner(max_workers=INGEST_WORKERS)
+
+@st.cache_resource # One result cache per server process, shared by all sessions
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_MAX_BYTES)
+
+def ingest_dataset(job, drive_pool, file_meta, activities=()):
+    """Background job: download and prepare one ZIP from Drive.
+
+    Runs on a JobRunner thread, so it reports through `job` instead of calling Streamlit.
+    Returns what the dashboard keeps in session state.
+    """
+    file_id = file_meta['id']
+    file_name = file_meta['name']
+    temp_zip_path = os.path.abspath(f"./temp_{file_name}") # Use unique temp name
+    temp_extract_path = "./extracted_data"
+
+    serve_from_zip = IMAGE_STORE == 'zip'
+    archive_path = None # Set when images are served straight from the ZIP
+    stream = None
+
+    dataset_cache = get_dataset_cache()
+    dataset_key = cache_key(file_meta, variant='zip' if serve_from_zip else None) if dataset_cache else None
+    cached_path = dataset_cache.lookup(dataset_key) if dataset_key else None
+
+    if cached_path:
+        # Same file id and checksum as a previous load: reuse the cached copy
+        job.log('success', f"'{file_name}' is unchanged on Drive. Using the cached copy.")
+        job.skip('download', "cached copy")
+        job.skip('extract', "cached copy")
+        temp_extract_path = cached_path
+        if serve_from_zip:
+            archive_path = os.path.join(cached_path, ARCHIVE_NAME)
+    else:
+        with job.stage('download'):
+            parallel = PARALLEL_DOWNLOAD
+            if serve_from_zip and PARALLEL_DOWNLOAD and STREAM_ARCHIVE:
+                # The dashboard opens once the CSV is in. A cache entry is filled in place and
+                # marked complete by the download thread once the archive is verified.
+                stream_dest = temp_zip_path
+                on_complete = None
+                if dataset_key:
+                    stream_dest = os.path.join(dataset_cache.building_dir(dataset_key), ARCHIVE_NAME)
+                    manifest = {'file_id': file_id, 'name': file_name}
+                    on_complete = lambda _, key=dataset_key, cache=dataset_cache: cache.finalize(key, manifest)
                 try:
-                    # Try evaluating string as a list/dict
-                    evaluated = eval(item)
-                    if isinstance(evaluated, list):
-                         processed_item = tuple(sorted([str(i) for i in evaluated])) # Convert list elements to string and sort
-                    elif isinstance(evaluated, dict):
-                         processed_item = tuple(sorted(evaluated.items())) # Convert dict to tuple of sorted items
-                    else:
-                         processed_item = str(item) # Treat as a simple string if eval doesn't yield list/dict
-                except:
-                     processed_item = str(item) # Treat as simple string if eval fails
-            elif isinstance(item, list):
-                 processed_item = tuple(sorted([str(i) for i in item]))
-            elif isinstance(item, dict):
-                 processed_item = tuple(sorted(item.items()))
+                    stream = stream_archive(drive_pool, file_id, stream_dest, job, on_complete=on_complete)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    job.log('warning', f"Streaming download failed: {e}. Downloading the whole file instead...")
+                    parallel = not isinstance(e, RangesNotSupportedError) # Then a single stream straight away
+
+            if stream is not None:
+                archive_path = stream.dest_path
             else:
-                 processed_item = str(item) # Ensure hashable type
-
-            if processed_item is not None:
-                unique_items.add(processed_item)
-
-        # Convert back from tuples if necessary for display/options (optional, depends on need)
-        # For now, return the hashable versions found
-        # Sort simple strings, leave tuples as they are
-        final_list = sorted([item for item in unique_items if isinstance(item, str)]) + \
-                     sorted([item for item in unique_items if not isinstance(item, str)])
-
-        # If the original category was intended to be simple strings (like gender, race), convert tuples back if needed
-        # This part might need adjustment based on how list-like columns are actually used
-        # For now, we assume the goal is just to get the unique *values* regardless of original structure complexity
-        # Let's try converting everything back to a simple string representation for the options list
-        return sorted([str(item) for item in unique_items])
-
-    return []
+                # Clean up previous temp files/dirs if they exist (unless a stream is still writing them)
+                if os.path.exists(temp_zip_path) and not active_stream(temp_zip_path): os.remove(temp_zip_path)
+                if dataset_key:
+                    temp_extract_path = dataset_cache.staging_dir(dataset_key)
+                elif os.path.exists(temp_extract_path) and not serve_from_zip:
+                    shutil.rmtree(temp_extract_path)
+                if not download_file_from_google_drive(drive_pool, file_id, temp_zip_path, job, parallel=parallel):
+                    raise JobError("Failed to download the ZIP file from Google Drive.")
+
+        if stream is not None:
+            job.skip('extract', "images are read from the archive as it streams in")
+        elif serve_from_zip:
+            # No extraction: the archive itself backs the image store
+            job.skip('extract', "images are read from the archive")
+            archive_path = temp_zip_path
+            if dataset_key:
+                shutil.move(temp_zip_path, os.path.join(temp_extract_path, ARCHIVE_NAME))
+        else:
+            with job.stage('extract'):
+                if not extract_zip(temp_zip_path, temp_extract_path, job):
+                    raise JobError("Failed to extract the ZIP file.")
+        if stream is None and dataset_key:
+            temp_extract_path = dataset_cache.commit(dataset_key, temp_extract_path, {'file_id': file_id, 'name': file_name})
+            if serve_from_zip:
+                archive_path = os.path.join(temp_extract_path, ARCHIVE_NAME)
+
+    # Archives built with `python -m ageai.bundle` carry the parsed CSV, image index and filter options
+    bundle = open_bundle(archive_path or temp_extract_path)
+    if bundle is not None:
+        job.log('info', f"Using the precomputed bundle ({bundle.rows} rows, built {bundle.manifest['built']}).")
+
+    # Cache entries are keyed by the archive's checksum, so what is derived and kept in them can never be stale
+    cache_dir = (os.path.dirname(archive_path) if archive_path else temp_extract_path) if dataset_key else None
+    with job.stage('csv'):
+        if bundle is not None:
+            df_results = bundle.dataframe()
+        else:
+            df_results = find_and_read_csv(temp_extract_path, job, zip_path=archive_path,
+                                           columnar_path=cache_dir and os.path.join(cache_dir, COLUMNAR_NAME))
+
+        # --- Crucial Column Checks ---
+        required_columns = ['ID', 'filename_jpg', 'prompt', 'age_group']
+        # Allow 'filename' as an alias for 'filename_jpg'
+        if 'filename' in df_results.columns and 'filename_jpg' not in df_results.columns:
+            df_results = df_results.rename(columns={'filename': 'filename_jpg'})
+            job.log('info', "Renamed 'filename' column to 'filename_jpg'.")
+
+        missing_columns = [col for col in required_columns if col not in df_results.columns]
+        if missing_columns:
+            raise JobError(f"CSV file is missing required columns: {', '.join(missing_columns)}. Please ensure the CSV inside the ZIP is correctly formatted.")
+
+        # Drop rows with missing essential values
+        initial_rows = len(df_results)
+        df_results = df_results.dropna(subset=required_columns)
+        dropped_rows = initial_rows - len(df_results)
+        if dropped_rows > 0:
+            job.log('warning', f"Dropped {dropped_rows} rows due to missing values in essential columns ({', '.join(required_columns)}).")
+
+        # Low-cardinality columns become categoricals and personality_short is lowercased, once, here
+        df_results, schema_report = optimize_dtypes(df_results, lowercase_columns=['personality_short'])
+        job.log('info', f"Metadata in memory: {schema_report['before_bytes'] / 1024**2:.1f} MB -> {schema_report['after_bytes'] / 1024**2:.1f} MB "
+                        f"({len(schema_report['categorical'])} categorical columns).")
+
+    # Load Images Dynamically
+    with job.stage('images'):
+        thumbnails = {}
+        if bundle is not None:
+            # The bundle's image index replaces listing the folders; grid thumbnails come with it
+            data_folder_path = 'data'
+            bundle_images, bundle_thumbnails = bundle.images()
+            potential_folders = list(bundle_images)
+            for folder_thumbnails in bundle_thumbnails.values():
+                thumbnails.update(folder_thumbnails)
+        else:
+            data_folder_path, potential_folders = list_category_folders(temp_extract_path, archive_path)
+            if potential_folders is None:
+                raise JobError("'data' directory not found within the extracted ZIP file.")
+        archive_mtime = os.path.getmtime(archive_path) if archive_path else None
+        all_loaded_images = {}
+        job.log('info', f"Found category folders in {data_folder_path}: {', '.join(potential_folders)}")
+
+        # Read images from each detected subfolder
+        for folder_index, folder_name in enumerate(potential_folders):
+            folder_path = f"{data_folder_path}/{folder_name}" if archive_path or bundle is not None else os.path.join(data_folder_path, folder_name)
+            job.update(folder_index / len(potential_folders), f"Reading images from: {folder_path}")
+            try:
+                if bundle is not None:
+                    images_in_folder = bundle_images[folder_name]
+                else:
+                    images_in_folder = read_images_from_folder(folder_path, archive_path, archive_mtime)
+            except Exception as e:
+                job.log('error', f"Error reading images from {folder_path}: {e}")
+                images_in_folder = {}
+            if images_in_folder:
+                # Check for duplicate filenames across folders
+                duplicates = set(images_in_folder.keys()) & set(all_loaded_images.keys())
+                if duplicates:
+                    job.log('warning', f"Duplicate filenames found across folders: {', '.join(duplicates)}. Using images from the last processed folder ('{folder_name}') for these duplicates.")
+                all_loaded_images.update(images_in_folder)
+            else:
+                job.log('warning', f"No images found or error reading from '{folder_name}'.")
+        job.log('success', f"Total images loaded from all folders: {len(all_loaded_images)}")
+
+    # Update dynamic categories based on loaded DataFrame
+    with job.stage('filters'):
+        # The bundle's value counts hold only while no rows were dropped above
+        facets = bundle.facets() if bundle is not None and len(df_results) == bundle.rows else None
+        # List-like object columns are parsed once here; the filters count and match on their arrays
+        list_columns = parse_list_columns(df_results, OBJECT_LIST_COLUMNS, bundle)
+        # One scan of the prompts for all activities: the activity x row matrix the activities filter counts and selects on
+        list_columns[ACTIVITY_FACET] = PhraseMatcher(activities).match(df_results['prompt'])
+        # Row bitmaps per value of every low-cardinality column and per object, so filters need no column scans
+        filter_index = FacetIndex.build(df_results, list_columns)
+        job.log('info', f"Filter index: {len(filter_index.facets)} columns, {filter_index.nbytes / 1024**2:.1f} MB.")
+        # Trigram indexes for the search box, built per column on its first search and kept in the cache entry
+        search_index = SearchIndex(df_results, cache_dir)
+        categories = {}
+        dynamic_categories = ["shot", "position_short"] + OBJECT_LIST_COLUMNS # Add others if needed
+        for category in dynamic_categories:
+            if category in list_columns:
+                categories[category] = list_columns[category].vocabulary
+            elif facets is not None and category in facets:
+                categories[category] = sorted(facets[category])
+            elif category in df_results.columns:
+                categories[category] = sorted(str_value_counts(df_results[category].dropna()))
+            else:
+                categories[category] = [] # Ensure it's an empty list if column not found
+                job.log('warning', f"Column '{category}' not found in CSV, filter options will be empty.")
+
+    # Clean up temporary files AFTER successful load (unless the ZIP itself serves the images)
+    if archive_path != temp_zip_path and os.path.exists(temp_zip_path): os.remove(temp_zip_path)
+    # Sessions loading the same cache entry share one version, so cached counts and filter results too; an uncached load gets its own
+    return {'dataset': Dataset.wrap(df_results, dataset_key), 'all_images': all_loaded_images, 'thumbnails': thumbnails,
+            'categories': categories, 'list_columns': list_columns, 'filter_index': filter_index,
+            'search_index': search_index, 'archive_stream': stream}
+
+def show_job_messages(job):
+    for level, text in job.messages:
+        getattr(st, level)(text)
+
+STAGE_ICONS = {'pending': "⏳", 'running': "▶️", 'done': "✅", 'skipped': "⏭️", 'failed': "❌"}
+
+@st.fragment(run_every=1)
+def show_ingest_job(job_id):
+    # Only this block reruns while the job works; the whole page reruns once it has finished
+    job = get_job_runner().get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    stage = job.current_stage
+    st.progress(job.progress, text=f"Loading '{job.description}'" + (f" — {stage.label}: {stage.detail}" if stage else "..."))
+    for stage in job.stages.values():
+        seconds = f" ({stage.seconds:.1f}s)" if stage.seconds is not None else ""
+        st.caption(f"{STAGE_ICONS.get(stage.status, '')} {stage.label}{seconds} {stage.detail}")
+    if st.button("Cancel loading", key=f"cancel_{job.id}"):
+        job.cancel()
+    with st.expander("Messages", expanded=False):
+        show_job_messages(job)
+
+# --- Result Fragments ---
+# Each reruns on its own when its controls are used (table page, Zoom, Close), without applying the
+# filters again or redrawing the rest of the page. They get the filtered rows of the last full run.
+
+@st.fragment
+def show_results_table(filtered_rows):
+    table_pages = max(1, -(-len(filtered_rows) // TABLE_PAGE_ROWS))
+    table_page = st.number_input(f"Table page (1-{table_pages}, {TABLE_PAGE_ROWS} rows each)", min_value=1, max_value=table_pages,
+                                 value=1, key="table_page") if table_pages > 1 else 1
+    AgGrid(filtered_rows.page((table_page - 1) * TABLE_PAGE_ROWS, table_page * TABLE_PAGE_ROWS),
+           height=400, width='100%', fit_columns_on_grid_load=True, enable_enterprise_modules=False) # Adjusted height
 
+    # --- Download Filtered CSV ---
+    if not filtered_rows.empty:
+        st.download_button(
+            label="Download Filtered Data as CSV",
+            data=filtered_rows_csv(filtered_rows), # Built once per filter state
+            file_name="filtered_ageai_data.csv",
+            mime="text/csv",
+            key="download_csv_button"
+        )
+    else:
+        st.info("No data matches the current filters to download.")
 
-# Keep caching for potentially expensive unique value extraction
-@st.cache_data()
-def get_unique_objects(df, column_name):
-    unique_objects = {}
-    if df is None or column_name not in df.columns:
-        return {}
-
-    for objects_list_str in df[column_name].dropna():
-        items_to_add = []
-        if isinstance(objects_list_str, str):
-            try:
-                # Use json.loads for safer evaluation of list-like strings
-                objects = json.loads(objects_list_str.replace("'", "\"")) # Replace single quotes for valid JSON
-                if isinstance(objects, list):
-                    items_to_add = objects
+@st.fragment
+def show_image_viewer(filtered_rows, all_images, thumbnails):
+    # The grid and the fullscreen view take turns in one place: one fragment, and Zoom/Close rerun only it
+    if st.session_state.fullscreen_image is None:
+        show_image_grid(filtered_rows, all_images, thumbnails)
+    else:
+        show_fullscreen_image(filtered_rows, all_images)
+
+def show_image_grid(filtered_rows, all_images, thumbnails):
+    if filtered_rows.empty:
+        st.info("No images match the current filters.")
+        return
+    images_per_row = 4
+    # Gather the filtered rows one grid row at a time for display
+    for row_data in filtered_rows.chunks(images_per_row):
+        cols = st.columns(images_per_row)
+        for col_idx, (_, row) in enumerate(row_data.iterrows()):
+            image_name = row['filename_jpg']
+            # Grid-sized thumbnail when there is one, else the image itself (file path or bytes read from the ZIP)
+            image_data = image_source(thumbnails.get(image_name))
+            if image_data is None:
+                image_data = image_source(all_images.get(image_name))
+
+            with cols[col_idx]:
+                if image_data is not None:
+                    try:
+                        st.image(image_data, caption=f"{image_name}\n(Group: {row.get('age_group', 'N/A')})", use_column_width=True)
+                        # The callback switches to fullscreen before the fragment reruns
+                        st.button(f"Zoom 🔍", key=f"btn_zoom_{image_name}_{row.name}", on_click=toggle_fullscreen, args=(image_name,))
+                    except Exception as img_e:
+                        st.error(f"Error loading {image_name}: {str(img_e)}")
+                elif image_pending(all_images.get(image_name)):
+                    st.info(f"Still downloading:\n{image_name}")
+                elif image_error(all_images.get(image_name)) is not None:
+                    st.warning(f"Download failed before this image arrived:\n{image_name}\n{image_error(all_images.get(image_name))}")
                 else:
-                     # If it's not a list after parsing, treat the original string as a single item (optional)
-                     # items_to_add = [objects_list_str]
-                     pass # Or ignore if only lists are expected
-            except json.JSONDecodeError:
-                 # If JSON parsing fails, treat as a single comma-separated string or single item
-                 # This is a fallback, ideally the data is consistently formatted
-                 items_to_add = [s.strip() for s in objects_list_str.split(',') if s.strip()]
-            except Exception:
-                # Fallback for other eval-like errors if json fails
-                try:
-                    objects = eval(objects_list_str)
-                    if isinstance(objects, list):
-                         items_to_add = objects
-                except:
-                    # If all parsing fails, treat the original string as one item
-                    items_to_add = [objects_list_str]
-
-        elif isinstance(objects_list_str, list): # Handle actual lists
-             items_to_add = objects_list_str
-
-        # Count the items
-        for item in items_to_add:
-             item_str = str(item).strip() # Ensure string and remove whitespace
-             if item_str: # Avoid counting empty strings
-                 unique_objects[item_str] = unique_objects.get(item_str, 0) + 1
-
-    # Sort by count descending
-    sorted_objects = dict(sorted(unique_objects.items(), key=lambda item: item[1], reverse=True))
-    return sorted_objects
+                    st.warning(f"Image not found:\n{image_name}")
+        st.markdown("---") # Separator between rows
+
+def show_fullscreen_image(filtered_rows, all_images):
+    fullscreen_image_name = st.session_state.fullscreen_image
+    fullscreen_image_data = image_source(all_images.get(fullscreen_image_name))
+
+    if fullscreen_image_data is not None:
+        st.header(f"Viewing: {fullscreen_image_name}")
+        col1, col2 = st.columns([3, 2]) # Image on left, details on right
+        with col1:
+             st.image(fullscreen_image_data, caption=fullscreen_image_name, use_column_width=True)
+
+        with col2:
+             st.subheader("Image Details")
+             # Find the corresponding row in the *original* or *filtered* DataFrame
+             # Using the filtered rows ensures we only show details for images matching current filters
+             fullscreen_row = filtered_rows.first('filename_jpg', fullscreen_image_name)
+             if fullscreen_row is not None:
+                 # Convert row to dict for the display function
+                 show_image_details(fullscreen_row.to_dict())
+             else:
+                  # Fallback to search in original df if somehow not in filtered (shouldn't happen with correct logic)
+                  df_results = filtered_rows.df
+                  original_row = df_results[df_results['filename_jpg'] == fullscreen_image_name]
+                  if not original_row.empty:
+                      st.warning("Displaying details from original data (image might not match all current filters).")
+                      show_image_details(original_row.iloc[0].to_dict())
+                  else:
+                      st.warning("Details not found for this image.")
+
+        # The callback goes back to the grid before the fragment reruns
+        st.button("Close Fullscreen", key="close_fullscreen", on_click=toggle_fullscreen, args=(fullscreen_image_name,))
+    else:
+         st.error(f"Fullscreen image '{fullscreen_image_name}' not found. Closing.")
+         st.session_state.fullscreen_image = None
+         time.sleep(2)
+         st.rerun()
+
+@st.fragment
+def show_export_panel(filtered_rows, all_images, archive_stream=None):
+    if filtered_rows.empty:
+        st.info("No images match the current filters to download.")
+        return
+    if archive_stream is not None and not archive_stream.done.is_set():
+        # A ZIP built now would lack the images still downloading; the page reruns once the stream ends
+        st.info("The ZIP download is available once all images have finished downloading.")
+        return
+    st.info("Preparing ZIP file for download... This may take a moment for many images.")
+    # Pass the current filtered rows and the master image dictionary; a failed stream's ZIP is cached apart
+    zip_buffer = create_downloadable_zip(filtered_rows, all_images, archive_stream is None or archive_stream.finished)
+
+    if zip_buffer.getbuffer().nbytes > 0:
+        st.download_button(
+            label="Download Filtered Images as ZIP",
+            data=zip_buffer,
+            file_name="filtered_ageai_images.zip",
+            mime="application/zip",
+            key="download_zip_button"
+        )
+    else:
+        # Error message already shown in create_downloadable_zip if it failed
+        st.warning("Could not create ZIP file, possibly due to missing image files or other errors.")
 
 # --- Main App Logic ---
 
@@ -498,16 +905,44 @@ st.markdown(" ")
 # --- Part 1: Data Loading ---
 if not st.session_state.data_loaded:
     st.header("1. Load Data from Google Drive")
-    service = get_drive_service()
+    drive_pool = get_drive_pool()
 
-    if service is None:
+    if drive_pool is None:
         st.error("Failed to connect to Google Drive. Please check credentials and permissions.")
         st.stop()
     else:
         # Subtle connection success message
-        conn_msg = st.success("Connected to Google Drive.")
-        time.sleep(2)
-        conn_msg.empty()
+        st.caption("Connected to Google Drive.")
+        with st.sidebar.expander("Drive connection pool"):
+            st.json(drive_pool.stats()) # Shared by all sessions; 'waits' counts callers that found every connection busy
+
+    ingest_job = get_job_runner().get(st.session_state.get('ingest_job_id'))
+    if ingest_job is not None and ingest_job.status == JOB_DONE:
+        # Copy the job's result into this session and switch to the dashboard
+        result = ingest_job.result
+        st.session_state.dataset = result['dataset']
+        st.session_state.df_results = result['dataset'].df
+        st.session_state.all_images = result['all_images']
+        st.session_state.thumbnails = result['thumbnails']
+        st.session_state.categories.update(result['categories'])
+        st.session_state.list_columns = result['list_columns']
+        st.session_state.filter_index = result['filter_index']
+        st.session_state.search_index = result['search_index']
+        st.session_state.archive_stream = result['archive_stream']
+        st.session_state.ingest_timings = ingest_job.timings()
+        st.session_state.ingest_job_id = None
+        st.session_state.data_loaded = True
+        st.rerun()
+    elif ingest_job is not None and ingest_job.finished:
+        if ingest_job.status == JOB_CANCELLED:
+            st.info(f"Loading '{ingest_job.description}' was cancelled.")
+        else:
+            st.error(f"Loading '{ingest_job.description}' failed: {ingest_job.error}")
+        with st.expander("Messages", expanded=ingest_job.status != JOB_CANCELLED):
+            show_job_messages(ingest_job)
+        ingest_job = None # Allow another load
+    elif ingest_job is not None:
+        show_ingest_job(ingest_job.id)
 
     folder_url = st.text_input(
         "Enter Google Drive Folder URL:",
@@ -521,14 +956,14 @@ if not st.session_state.data_loaded:
         st.info(f"Extracted Folder ID: {folder_id}")
         try:
             with st.spinner("Listing files in Google Drive folder..."):
-                files = list_files_in_folder(service, folder_id)
+                files = list_files_in_folder(drive_pool, folder_id)
 
             if not files:
                 st.error("No files found in the specified Google Drive folder. Check the URL and folder contents.")
                 st.stop()
 
             # Filter for .zip files only
-            file_options = {item['name']: item['id'] for item in files if item['name'].lower().endswith('.zip')}
+            file_options = {item['path']: item for item in files if item['name'].lower().endswith('.zip')}
 
             if not file_options:
                  st.warning("No ZIP files found in the Google Drive folder.")
@@ -536,110 +971,15 @@ if not st.session_state.data_loaded:
 
             selected_file_name = st.selectbox("Select the ZIP file to load:", list(file_options.keys()))
 
-            if selected_file_name and st.button("Load Selected ZIP File"):
-                file_id = file_options[selected_file_name]
-                temp_zip_path = f"./temp_{selected_file_name}" # Use unique temp name
-                temp_extract_path = "./extracted_data"
-
-                # Clean up previous temp files/dirs if they exist
-                if os.path.exists(temp_zip_path): os.remove(temp_zip_path)
-                if os.path.exists(temp_extract_path): shutil.rmtree(temp_extract_path)
-
-                st.info(f"Downloading '{selected_file_name}'...")
-                download_success = download_file_from_google_drive(service, file_id, temp_zip_path)
-
-                if download_success:
-                    st.info(f"Extracting '{selected_file_name}'...")
-                    extract_success = extract_zip(temp_zip_path, temp_extract_path)
-
-                    if extract_success:
-                        # Load DataFrame
-                        st.session_state.df_results = find_and_read_csv(temp_extract_path)
-
-                        if st.session_state.df_results is not None:
-                             # --- Crucial Column Checks ---
-                            required_columns = ['ID', 'filename_jpg', 'prompt', 'age_group']
-                             # Allow 'filename' as an alias for 'filename_jpg'
-                            if 'filename' in st.session_state.df_results.columns and 'filename_jpg' not in st.session_state.df_results.columns:
-                                st.session_state.df_results = st.session_state.df_results.rename(columns={'filename': 'filename_jpg'})
-                                st.info("Renamed 'filename' column to 'filename_jpg'.")
-
-                            missing_columns = [col for col in required_columns if col not in st.session_state.df_results.columns]
-                            if missing_columns:
-                                st.error(f"CSV file is missing required columns: {', '.join(missing_columns)}. Please ensure the CSV inside the ZIP is correctly formatted.")
-                                st.stop() # Stop execution if essential columns are missing
-
-                            # Drop rows with missing essential values
-                            initial_rows = len(st.session_state.df_results)
-                            st.session_state.df_results = st.session_state.df_results.dropna(subset=required_columns)
-                            dropped_rows = initial_rows - len(st.session_state.df_results)
-                            if dropped_rows > 0:
-                                st.warning(f"Dropped {dropped_rows} rows due to missing values in essential columns ({', '.join(required_columns)}).")
-
-                            st.write("DataFrame Columns:", st.session_state.df_results.columns.tolist())
-
-                            # Load Images Dynamically
-                            data_folder_path = os.path.join(temp_extract_path, 'data')
-                            all_loaded_images = {}
-                            if os.path.isdir(data_folder_path):
-                                st.write("Looking for category subfolders in:", data_folder_path)
-                                potential_folders = [d for d in os.listdir(data_folder_path) if os.path.isdir(os.path.join(data_folder_path, d))]
-                                st.write("Found potential category folders:", potential_folders)
-
-                                # Read images from each detected subfolder
-                                for folder_name in potential_folders:
-                                     folder_path = os.path.join(data_folder_path, folder_name)
-                                     st.write(f"Reading images from: {folder_path}")
-                                     images_in_folder = read_images_from_folder(folder_path)
-                                     if images_in_folder:
-                                         st.write(f"Found {len(images_in_folder)} images in '{folder_name}'.")
-                                         # Check for duplicate filenames across folders
-                                         duplicates = set(images_in_folder.keys()) & set(all_loaded_images.keys())
-                                         if duplicates:
-                                             st.warning(f"Duplicate filenames found across folders: {', '.join(duplicates)}. Using images from the last processed folder ('{folder_name}') for these duplicates.")
-                                         all_loaded_images.update(images_in_folder)
-                                     else:
-                                          st.warning(f"No images found or error reading from '{folder_name}'.")
-
-                                st.session_state.all_images = all_loaded_images
-                                st.success(f"Total images loaded from all folders: {len(st.session_state.all_images)}")
-
-                                # Update dynamic categories based on loaded DataFrame
-                                st.info("Updating filter options based on loaded data...")
-                                dynamic_categories = ["shot", "position_short", "objects", "objects_assist_devices", "objects_digi_devices"] # Add others if needed
-                                for category in dynamic_categories:
-                                     if category in st.session_state.df_results.columns:
-                                         st.session_state.categories[category] = get_unique_list_items(st.session_state.df_results, category)
-                                     else:
-                                         st.session_state.categories[category] = [] # Ensure it's an empty list if column not found
-                                         st.warning(f"Column '{category}' not found in CSV, filter options will be empty.")
-
-                                # Standardize personality_short to lowercase
-                                if 'personality_short' in st.session_state.df_results.columns:
-                                    st.session_state.df_results['personality_short'] = st.session_state.df_results['personality_short'].astype(str).str.lower()
-
-                                st.session_state.data_loaded = True
-                                st.success("Data loaded successfully!")
-                                # Clean up temporary files AFTER successful load
-                                if os.path.exists(temp_zip_path): os.remove(temp_zip_path)
-                                # Keep extracted data for image paths until session ends or new data loaded
-                                # If memory/disk is a concern, you might copy images to a more permanent temp location managed by Streamlit
-                                st.info("App will now reload with the data.")
-                                time.sleep(2)
-                                st.rerun()
-                            else:
-                                st.error("'data' directory not found within the extracted ZIP file.")
-                        else:
-                            st.error("Failed to load DataFrame from the CSV file.")
-                    else:
-                        st.error("Failed to extract the ZIP file.")
-                else:
-                    st.error("Failed to download the ZIP file from Google Drive.")
-
-                # Optional: Clean up extracted folder if loading failed mid-way
-                # if not st.session_state.data_loaded and os.path.exists(temp_extract_path):
-                #     shutil.rmtree(temp_extract_path, ignore_errors=True)
+            # Loading runs as a background job; the page polls it above and stays responsive
+            if ingest_job is None and selected_file_name and st.button("Load Selected ZIP File"):
+                ingest_job = get_job_runner().submit(ingest_dataset, INGEST_STAGES, drive_pool, file_options[selected_file_name],
+                                                     st.session_state.categories['activities'], description=selected_file_name)
+                st.session_state.ingest_job_id = ingest_job.id
+                st.rerun()
 
+        except HttpError as e:
+            st.error(f"Error accessing Google Drive: {e}")
 
     else:
         if folder_url: # Only show warning if URL is entered but ID extraction failed
@@ -649,8 +989,27 @@ if not st.session_state.data_loaded:
 # --- Part 2: Dashboard (Displayed only after data is loaded) ---
 else:
     st.header("2. Explore Images and Metadata")
+    if st.session_state.get('ingest_timings'):
+        with st.sidebar.expander("Last load timings"):
+            st.json({stage: f"{seconds:.2f}s" for stage, seconds in st.session_state.ingest_timings.items()})
+
+    archive_stream = st.session_state.get('archive_stream')
+    if archive_stream is not None and not archive_stream.done.is_set():
+        @st.fragment(run_every=2)
+        def show_stream_status():
+            # Only this block reruns while the archive streams in; the whole page reruns once it is done
+            if archive_stream.done.is_set():
+                st.rerun()
+            total = archive_stream.total_size
+            st.progress(archive_stream.downloaded_bytes / total,
+                        text=f"Downloading images in the background: {archive_stream.downloaded_bytes / 1024**2:.0f} of {total / 1024**2:.0f} MB "
+                             f"({archive_stream.available_count} files ready). Images still downloading show a placeholder.")
+        show_stream_status()
+    elif archive_stream is not None and archive_stream.error is not None:
+        st.error(f"Background download failed: {archive_stream.error}. Images that did not arrive will be missing; reload the page and load the file again to resume.")
     df_results = st.session_state.df_results
     all_images = st.session_state.all_images # Use the single image dictionary
+    thumbnails = st.session_state.get('thumbnails') or {} # Only bundles have them
     categories = st.session_state.categories
 
     if df_results is None or all_images is None:
@@ -683,11 +1042,12 @@ else:
 
 
     # --- Apply Filters ---
-    filtered_df = df_results.copy()
+    # Facet filters narrow a bitmap selection over df_results; the rows are taken once, after the last of them
+    selection = st.session_state.filter_index.select()
 
     # Apply Group Filter
     if group_filter != "Todos":
-        filtered_df = filtered_df[filtered_df['age_group'] == group_filter]
+        selection.add('age_group', [group_filter])
 
     # Apply other filters...
 
@@ -702,19 +1062,16 @@ else:
                 st.session_state[key] = []
         st.rerun() # Rerun to apply the reset
 
+    # Each multiselect counts its options among the rows the *other* filters leave, so every filter is read from
+    # the session state first; the widgets are drawn into placeholders, in sidebar order, once the counts are known
+    multiselects = [] # (placeholder, label, widget key, column, options)
+
     # Age Range Filter (If column exists)
     if 'age_range' in df_results.columns:
-        age_ranges = sorted(df_results['age_range'].astype(str).unique().tolist())
-        selected_age_ranges_display = st.sidebar.multiselect(
-            "Select Age Range",
-            get_sorted_options(df_results, 'age_range', age_ranges), # Use original df for counts
-            default=get_default("multiselect_age_ranges"), # Get from session state
-            key="multiselect_age_ranges" # Use consistent key
-        )
-        # Extract actual values from "Option (count)" format
-        selected_age_ranges = [re.match(r"^(.*?)\s*\(\d+\)$", age).group(1) for age in selected_age_ranges_display]
-        if selected_age_ranges:
-            filtered_df = filtered_df[filtered_df['age_range'].isin(selected_age_ranges)]
+        age_ranges = sorted(str_value_counts(df_results['age_range']))
+        multiselects.append((st.sidebar.empty(), "Select Age Range", "multiselect_age_ranges", 'age_range',
+                             get_sorted_options(st.session_state.dataset, 'age_range', age_ranges))) # Most frequent first
+        selection.add('age_range', get_default("multiselect_age_ranges")) # Get from session state
     else:
         st.sidebar.text("Age Range filter unavailable.")
 
@@ -728,34 +1085,19 @@ else:
              #st.sidebar.warning(f"Column '{category}' not found, filter skipped.") # Optional warning
              continue # Skip if column doesn't exist in loaded data
 
-        selected_display = st.sidebar.multiselect(
-            f"Select {category.replace('_', ' ').title()}",
-            get_sorted_options(df_results, category, options), # Get options based on original DF
-            default=get_default(f"multiselect_{category}"), # Get from session state
-            key=f"multiselect_{category}" # Use consistent key
-        )
-        # Extract actual option values
-        selected_options = [re.match(r"^(.*?)\s*\(\d+\)$", opt).group(1) for opt in selected_display]
-
-        if selected_options:
-            # Ensure comparison works even if column has mixed types (integers, strings)
-            # Convert column to string for robust comparison
-            filtered_df = filtered_df[filtered_df[category].astype(str).isin([str(opt) for opt in selected_options])]
+        multiselects.append((st.sidebar.empty(), f"Select {category.replace('_', ' ').title()}", f"multiselect_{category}", category,
+                             get_sorted_options(st.session_state.dataset, category, options)))
+        # Compared as strings, so mixed-type columns (integers, strings) still match
+        selection.add(category, get_default(f"multiselect_{category}"))
 
 
     # Activities Filter (searching within 'prompt')
-    if 'activities' in categories and categories['activities']: # Check if activities defined
-        selected_activities_display = st.sidebar.multiselect(
-            f"Select Activities (searches Prompt)",
-            get_sorted_options(df_results, 'activities', categories['activities']), # Use original df
-            default=get_default("multiselect_activities"),
-            key=f"multiselect_activities"
-        )
-        selected_activities_options = [re.match(r"^(.*?)\s*\(\d+\)$", opt).group(1) for opt in selected_activities_display]
-        if selected_activities_options:
-            # Apply filter using case-insensitive search within the 'prompt' column
-            pattern = '|'.join([re.escape(act) for act in selected_activities_options]) # Create OR pattern
-            filtered_df = filtered_df[filtered_df['prompt'].astype(str).str.contains(pattern, case=False, na=False, regex=True)]
+    list_columns = st.session_state.get('list_columns') or {}
+    if 'activities' in categories and categories['activities'] and ACTIVITY_FACET in list_columns: # Check if activities defined
+        multiselects.append((st.sidebar.empty(), "Select Activities (searches Prompt)", "multiselect_activities", ACTIVITY_FACET,
+                             sort_options(categories['activities'], list_columns[ACTIVITY_FACET].counts()))) # Prompts matched at load
+        # Prompts containing *any* of the selected activities (case-insensitive)
+        selection.add(ACTIVITY_FACET, get_default("multiselect_activities"))
 
     # Object List Filters
     object_filters = {
@@ -765,23 +1107,11 @@ else:
     }
 
     for col_name, (label, key) in object_filters.items():
-        if col_name in df_results.columns:
-            unique_obj_counts = get_unique_objects(df_results, col_name) # Calculate based on original df
-            obj_options = [f"{obj} ({count})" for obj, count in unique_obj_counts.items()]
-
-            selected_obj_display = st.sidebar.multiselect(
-                f"Select {label}",
-                obj_options,
-                default=get_default(key),
-                key=key
-            )
-            selected_obj_options = [re.match(r"^(.*?)\s*\(\d+\)$", opt).group(1) for opt in selected_obj_display]
-
-            if selected_obj_options:
-                 # Filter rows where the column (treated as a string) contains *any* of the selected objects
-                 # This handles list-like strings: "['obj1', 'obj2']"
-                 pattern = '|'.join([re.escape(f"'{obj}'") for obj in selected_obj_options]) # Look for 'obj' including quotes
-                 filtered_df = filtered_df[filtered_df[col_name].astype(str).str.contains(pattern, case=False, na=False, regex=True)]
+        if col_name in list_columns:
+            list_column = list_columns[col_name] # Parsed at load, one row per row of df_results
+            multiselects.append((st.sidebar.empty(), f"Select {label}", key, col_name, list(list_column.counts()))) # Most frequent first
+            # Keep rows whose list holds *any* of the selected objects (case-insensitive)
+            selection.add(col_name, get_default(key), case=False)
         else:
              st.sidebar.text(f"{label} filter unavailable.")
 
@@ -808,27 +1138,29 @@ else:
     st.session_state.search_term = search_term_input # Update session state
 
     if search_term_input:
-        # Apply case-insensitive search to the selected column converted to string
-        filtered_df = filtered_df[filtered_df[selected_column].astype(str).str.contains(search_term_input, case=False, na=False)]
+        # Case-insensitive search in the selected column, narrowed down by its trigram index. It runs after
+        # the index filters, on the rows they leave
+        selection.add_mask(lambda rows: st.session_state.search_index.contains(selected_column, search_term_input, rows),
+                           key=('search', selected_column, search_term_input), cost=TEXT_COST, takes_rows=True)
+
+    # A filter state seen before, in this session or another on the same dataset, is not evaluated again
+    result_cache = get_result_cache()
+    facet_counts = result_cache.facet_counts(st.session_state.dataset.version, selection,
+                                             [column for _, _, _, column, _ in multiselects])
+    for placeholder, label, key, column, options in multiselects:
+        # Options stay the values themselves, so a selection survives its counts changing
+        placeholder.multiselect(label, options, default=get_default(key), key=key,
+                                format_func=lambda option, counts=facet_counts[column]: f"{option} ({counts.get(option, 0)})")
+    # Positions into df_results only; each part of the page below gathers just the rows and columns it shows
+    filtered_rows = FilteredRows(df_results, result_cache.positions(st.session_state.dataset.version, selection),
+                                 st.session_state.dataset.version, selection.key)
+    with st.sidebar.expander("Filter result cache"):
+        st.json(result_cache.stats())
 
     # --- Display Filtered DataFrame ---
     st.subheader("Filtered Data Table")
-    st.write(f"Showing {len(filtered_df)} out of {len(df_results)} total entries.")
-    AgGrid(filtered_df, height=400, width='100%', fit_columns_on_grid_load=True, enable_enterprise_modules=False) # Adjusted height
-
-    # --- Download Filtered CSV ---
-    if not filtered_df.empty:
-        csv_buffer = io.StringIO()
-        filtered_df.to_csv(csv_buffer, index=False)
-        st.download_button(
-            label="Download Filtered Data as CSV",
-            data=csv_buffer.getvalue(),
-            file_name="filtered_ageai_data.csv",
-            mime="text/csv",
-            key="download_csv_button"
-        )
-    else:
-        st.info("No data matches the current filters to download.")
+    st.write(f"Showing {len(filtered_rows)} out of {len(df_results)} total entries.")
+    show_results_table(filtered_rows)
 
 
     st.divider()
@@ -839,20 +1171,18 @@ else:
     if group_filter != "Todos":
         applied_filters_list.append(f"Group: {group_filter}")
     if 'age_range' in df_results.columns and st.session_state.get("multiselect_age_ranges"):
-         applied_filters_list.append(f"Age Range: {', '.join([re.match(r'^(.*?)\s*\(\d+\)$', age).group(1) for age in st.session_state.multiselect_age_ranges])}")
+         applied_filters_list.append(f"Age Range: {', '.join(st.session_state.multiselect_age_ranges)}")
 
     # Check other category filters
     for category in categories.keys():
         session_key = f"multiselect_{category}"
         if st.session_state.get(session_key):
-             selected_vals = [re.match(r"^(.*?)\s*\(\d+\)$", opt).group(1) for opt in st.session_state[session_key]]
-             applied_filters_list.append(f"{category.replace('_', ' ').title()}: {', '.join(selected_vals)}")
+             applied_filters_list.append(f"{category.replace('_', ' ').title()}: {', '.join(st.session_state[session_key])}")
 
      # Check object filters
     for col_name, (label, key) in object_filters.items():
         if st.session_state.get(key):
-             selected_vals = [re.match(r"^(.*?)\s*\(\d+\)$", opt).group(1) for opt in st.session_state[key]]
-             applied_filters_list.append(f"{label}: {', '.join(selected_vals)}")
+             applied_filters_list.append(f"{label}: {', '.join(st.session_state[key])}")
 
     if st.session_state.search_term:
         applied_filters_list.append(f"Search '{st.session_state.search_term}' in '{selected_column}'")
@@ -867,93 +1197,14 @@ else:
 
     # --- Display Images ---
     st.subheader("Filtered Images")
-    st.write(f"Displaying {len(filtered_df)} filtered images.")
+    st.write(f"Displaying {len(filtered_rows)} filtered images.")
 
-    if st.session_state.fullscreen_image is None:
-        if not filtered_df.empty:
-            images_per_row = 4
-            # Iterate through the filtered DataFrame for display
-            for i in range(0, len(filtered_df), images_per_row):
-                row_data = filtered_df.iloc[i:min(i + images_per_row, len(filtered_df))]
-                cols = st.columns(images_per_row)
-                for col_idx, (_, row) in enumerate(row_data.iterrows()):
-                    image_name = row['filename_jpg']
-                    # Use the unified image dictionary
-                    image_path = all_images.get(image_name)
-
-                    with cols[col_idx]:
-                        if image_path and os.path.exists(image_path):
-                            try:
-                                st.image(image_path, caption=f"{image_name}\n(Group: {row.get('age_group', 'N/A')})", use_column_width=True)
-                                if st.button(f"Zoom 🔍", key=f"btn_zoom_{image_name}_{row.name}"):
-                                    toggle_fullscreen(image_name)
-                                    st.rerun() # Rerun to show fullscreen or go back
-                            except Exception as img_e:
-                                st.error(f"Error loading {image_name}: {str(img_e)}")
-                        else:
-                            st.warning(f"Image not found:\n{image_name}")
-                st.markdown("---") # Separator between rows
-        else:
-             st.info("No images match the current filters.")
-
-    # --- Fullscreen Image Display ---
-    else:
-        fullscreen_image_name = st.session_state.fullscreen_image
-        fullscreen_image_path = all_images.get(fullscreen_image_name)
-
-        if fullscreen_image_path and os.path.exists(fullscreen_image_path):
-            st.header(f"Viewing: {fullscreen_image_name}")
-            col1, col2 = st.columns([3, 2]) # Image on left, details on right
-            with col1:
-                 st.image(fullscreen_image_path, caption=fullscreen_image_name, use_column_width=True)
-
-            with col2:
-                 st.subheader("Image Details")
-                 # Find the corresponding row in the *original* or *filtered* DataFrame
-                 # Using filtered_df ensures we only show details for images matching current filters
-                 fullscreen_row = filtered_df[filtered_df['filename_jpg'] == fullscreen_image_name]
-                 if not fullscreen_row.empty:
-                     # Convert row to dict for the display function
-                     show_image_details(fullscreen_row.iloc[0].to_dict())
-                 else:
-                      # Fallback to search in original df if somehow not in filtered (shouldn't happen with correct logic)
-                      original_row = df_results[df_results['filename_jpg'] == fullscreen_image_name]
-                      if not original_row.empty:
-                          st.warning("Displaying details from original data (image might not match all current filters).")
-                          show_image_details(original_row.iloc[0].to_dict())
-                      else:
-                          st.warning("Details not found for this image.")
-
-            if st.button("Close Fullscreen", key="close_fullscreen"):
-                st.session_state.fullscreen_image = None
-                st.rerun() # Rerun to go back to grid view
-        else:
-             st.error(f"Fullscreen image '{fullscreen_image_name}' not found. Closing.")
-             st.session_state.fullscreen_image = None
-             time.sleep(2)
-             st.rerun()
+    show_image_viewer(filtered_rows, all_images, thumbnails)
 
     # --- Download Filtered Images ZIP ---
     st.divider()
     st.subheader("Download Images")
-    if not filtered_df.empty:
-        st.info("Preparing ZIP file for download... This may take a moment for many images.")
-        # Pass the current filtered DataFrame and the master image dictionary
-        zip_buffer = create_downloadable_zip(filtered_df, all_images)
-
-        if zip_buffer.getbuffer().nbytes > 0:
-            st.download_button(
-                label="Download Filtered Images as ZIP",
-                data=zip_buffer,
-                file_name="filtered_ageai_images.zip",
-                mime="application/zip",
-                key="download_zip_button"
-            )
-        else:
-            # Error message already shown in create_downloadable_zip if it failed
-            st.warning("Could not create ZIP file, possibly due to missing image files or other errors.")
-    else:
-        st.info("No images match the current filters to download.")
+    show_export_panel(filtered_rows, all_images, archive_stream)
 
 
 # Note: The temporary extracted folder (`temp_extract_path`) is intentionally
@@ -962,3 +1213,5 @@ else:
 # Streamlit's execution model means the script reruns, but the file system state persists
 # until the app server stops or the cache/temp files are cleared manually or by the platform.
 # Deleting it would break image display on subsequent reruns unless images were copied elsewhere.
+# The same applies to the ZIP itself when AGEAI_IMAGE_STORE=zip: the ZipMember handles in
+# `st.session_state.all_images` read their bytes from the memory-mapped archive.
@@ -0,0 +1,6 @@
+"""Shared data-loading helpers for the AGEAI Streamlit dashboards.
+
+Both ``STLT_500p.py`` and ``STLIT_500p_GEM.py`` import from here. Nothing in
+this package calls Streamlit directly; progress is reported via callbacks so
+the same code can run inside a script run, a worker thread or a CLI.
+"""
@@ -0,0 +1,258 @@
+"""Precomputed dataset bundles, built once offline instead of on every load.
+
+    python -m ageai.bundle dataset.zip dataset_bundle.zip
+
+A bundle is the dataset ZIP itself with a ``bundle/`` folder added, so it is
+uploaded to Drive, downloaded, streamed and cached exactly like a plain
+archive. The folder holds what the dashboards would otherwise derive from the
+CSV and the image folders in every session:
+
+    bundle/manifest.json          format version, source CSV, row count, column roles
+    bundle/metadata.parquet       the CSV, parsed once
+    bundle/lists/<column>.npz     list-like columns as CSR arrays (offsets, codes, vocabulary)
+    bundle/facets.json            value counts of every filterable column
+    bundle/images.json            [folder, file name, member, thumbnail member or null] per image
+    bundle/thumbs/<folder>/<file>.jpg  grid-sized JPEG thumbnails
+
+An image that cannot be decoded gets no thumbnail (the manifest lists it)
+instead of failing the build. The filter index itself is not stored: the
+dashboards build ``FacetIndex`` from the parsed columns at load, which
+takes well under a second, and it covers the activity matches, which
+depend on the dashboard's list of activities.
+
+``open_bundle`` loads one from a downloaded archive or an extracted copy and
+returns None for archives without a bundle.
+"""
+import argparse
+import io
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+from ageai.list_columns import ListColumn, is_list_column
+from ageai.streaming import StreamedMember, active_stream
+from ageai.zip_store import IMAGE_EXTENSIONS, ZipStore, find_csv_member, open_store
+
+BUNDLE_VERSION = 2  # 2: an image may lack a thumbnail
+READABLE_VERSIONS = (1, 2)
+BUNDLE_DIR = 'bundle'
+MANIFEST_MEMBER = f'{BUNDLE_DIR}/manifest.json'
+METADATA_MEMBER = f'{BUNDLE_DIR}/metadata.parquet'
+FACETS_MEMBER = f'{BUNDLE_DIR}/facets.json'
+IMAGES_MEMBER = f'{BUNDLE_DIR}/images.json'
+LISTS_DIR = f'{BUNDLE_DIR}/lists'
+THUMBS_DIR = f'{BUNDLE_DIR}/thumbs'
+DEFAULT_THUMBNAIL_SIZE = 320  # longest side, in pixels
+DEFAULT_THUMBNAIL_QUALITY = 80
+DEFAULT_MAX_FACET_VALUES = 500  # columns with more distinct values are not offered as filters
+
+
+def column_facets(df, list_columns, max_values=DEFAULT_MAX_FACET_VALUES):
+    """``{column: {value: count}}`` for list columns and columns with at most ``max_values`` values."""
+    facets = {}
+    for column in df.columns:
+        if column in list_columns:
+            facets[column] = list_columns[column].counts()
+            continue
+        values = df[column].dropna().astype(str)
+        counts = values.value_counts()
+        if 0 < len(counts) <= max_values:
+            facets[column] = {value: int(count) for value, count in counts.items()}
+    return facets
+
+
+def make_thumbnail(data, size=DEFAULT_THUMBNAIL_SIZE, quality=DEFAULT_THUMBNAIL_QUALITY):
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def build_bundle(source_zip, dest_zip, thumbnail_size=DEFAULT_THUMBNAIL_SIZE, workers=8,
+                 max_facet_values=DEFAULT_MAX_FACET_VALUES, progress=None):
+    """Write ``dest_zip``: every member of ``source_zip`` plus a ``bundle/`` folder.
+
+    ``progress(step, done, total)`` is called from the calling thread. Returns
+    the manifest.
+    """
+    report = progress or (lambda step, done, total: None)
+    with ZipStore(source_zip) as store:
+        csv_member = find_csv_member(store)
+        if csv_member is None:
+            raise ValueError(f"No CSV found in data/ of {source_zip}")
+        report('csv', 0, 1)
+        df = pd.read_csv(store.open_member(csv_member))
+        report('csv', 1, 1)
+
+        list_columns = {}
+        columns = list(df.columns)
+        for index, column in enumerate(columns):
+            if is_list_column(df[column]):
+                list_columns[column] = ListColumn.from_series(df[column])
+            report('lists', index + 1, len(columns))
+        facets = column_facets(df, list_columns, max_facet_values)
+
+        images = []
+        for folder in store.subfolders('data'):
+            for file_name, member in store.files_in_folder(f'data/{folder}', IMAGE_EXTENSIONS).items():
+                # Named after the whole file name: a.png and a.jpg in one folder get a thumbnail each
+                images.append([folder, file_name, member.name, f'{THUMBS_DIR}/{folder}/{file_name}.jpg'])
+
+        manifest = {
+            'version': BUNDLE_VERSION,
+            'built': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'source_csv': csv_member,
+            'rows': len(df),
+            'columns': columns,
+            'list_columns': sorted(list_columns),
+            'facet_columns': sorted(facets),
+            'images': len(images),
+            'thumbnail_size': thumbnail_size,
+            'thumbnail_errors': [],  # [folder, file name, error] of the images left without a thumbnail
+        }
+
+        tmp_path = dest_zip + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', allowZip64=True) as out:
+            # Bundle members before the original ones; a streamed download fetches them first wherever they are
+            parquet = io.BytesIO()
+            df.to_parquet(parquet, index=False)
+            out.writestr(METADATA_MEMBER, parquet.getvalue(), zipfile.ZIP_STORED)
+            out.writestr(FACETS_MEMBER, json.dumps(facets), zipfile.ZIP_DEFLATED)
+            for column, values in list_columns.items():
+                out.writestr(f'{LISTS_DIR}/{column}.npz', values.to_bytes(), zipfile.ZIP_STORED)
+
+            def thumbnail(entry):
+                try:
+                    return make_thumbnail(store.read_member(entry[2]), thumbnail_size), None
+                except Exception as e:  # a corrupt or unsupported image: skip its thumbnail, not the build
+                    return None, f"{type(e).__name__}: {e}"
+
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="bundle-thumbs") as pool:
+                for done, (entry, (data, error)) in enumerate(zip(images, pool.map(thumbnail, images)), 1):
+                    if error is None:
+                        out.writestr(entry[3], data, zipfile.ZIP_STORED)
+                    else:
+                        manifest['thumbnail_errors'].append([entry[0], entry[1], error])
+                        entry[3] = None
+                    if done % 100 == 0 or done == len(images):
+                        report('thumbnails', done, len(images))
+            # Written once the thumbnails are known
+            out.writestr(IMAGES_MEMBER, json.dumps(images), zipfile.ZIP_DEFLATED)
+            out.writestr(MANIFEST_MEMBER, json.dumps(manifest, indent=1), zipfile.ZIP_DEFLATED)
+
+            # The original members stay, so dashboards without bundle support still read the archive
+            members = [info for info in store.infolist()
+                       if not info.is_dir() and not info.filename.startswith(BUNDLE_DIR + '/')]
+            for done, info in enumerate(members, 1):
+                copy = zipfile.ZipInfo(info.filename, info.date_time)
+                copy.external_attr = info.external_attr
+                out.writestr(copy, store.read_member(info.filename), info.compress_type)
+                if done % 500 == 0 or done == len(members):
+                    report('copy', done, len(members))
+        os.replace(tmp_path, dest_zip)
+    return manifest
+
+
+def bundle_members(names):
+    """Bundle members a streamed download should fetch before anything else; empty for plain archives."""
+    if MANIFEST_MEMBER not in names:
+        return []
+    return [name for name in names if name.startswith(BUNDLE_DIR + '/') and not name.startswith(THUMBS_DIR + '/')]
+
+
+class Bundle:
+    """A bundle read from an archive (``zip_path``) or an extracted copy of it (``root``)."""
+
+    def __init__(self, zip_path=None, root=None):
+        self.zip_path = zip_path
+        self.root = root
+        self.manifest = json.loads(self.read(MANIFEST_MEMBER))
+        if self.manifest.get('version') not in READABLE_VERSIONS:
+            raise ValueError(f"Unsupported bundle version {self.manifest.get('version')}")
+
+    def handle(self, member):
+        """Image handle for a member, as ``image_source`` expects it."""
+        if self.zip_path:
+            return StreamedMember(self.zip_path, member)
+        return os.path.join(self.root, *member.split('/'))
+
+    def read(self, member):
+        if self.zip_path:
+            return StreamedMember(self.zip_path, member).read()
+        with open(self.handle(member), 'rb') as fh:
+            return fh.read()
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    def dataframe(self):
+        return pd.read_parquet(io.BytesIO(self.read(METADATA_MEMBER)))
+
+    def facets(self):
+        return json.loads(self.read(FACETS_MEMBER))
+
+    def list_column(self, column):
+        if column not in self.manifest['list_columns']:
+            return None
+        return ListColumn.from_bytes(self.read(f'{LISTS_DIR}/{column}.npz'))
+
+    def images(self):
+        """``{folder: {file name: image handle}}`` and the same for the thumbnails."""
+        images, thumbnails = {}, {}
+        for folder, file_name, member, thumb_member in json.loads(self.read(IMAGES_MEMBER)):
+            images.setdefault(folder, {})[file_name] = self.handle(member)
+            if thumb_member is not None:
+                thumbnails.setdefault(folder, {})[file_name] = self.handle(thumb_member)
+        return images, thumbnails
+
+
+def open_bundle(path):
+    """``Bundle`` in an archive or extracted folder, or None if it has none."""
+    if not path:
+        return None
+    if os.path.isdir(path):
+        if not os.path.exists(os.path.join(path, *MANIFEST_MEMBER.split('/'))):
+            return None
+        return Bundle(root=path)
+    stream = active_stream(path)
+    names = stream.names if stream else open_store(path).namelist()
+    if MANIFEST_MEMBER not in names:
+        return None
+    return Bundle(zip_path=os.path.abspath(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help="dataset ZIP in the documented data/ layout")
+    parser.add_argument('dest', help="bundle ZIP to write")
+    parser.add_argument('--thumbnail-size', type=int, default=DEFAULT_THUMBNAIL_SIZE)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--max-facet-values', type=int, default=DEFAULT_MAX_FACET_VALUES)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    last_step = [None]
+
+    def show_progress(step, done, total):
+        if step != last_step[0] or done == total:
+            print(f"{step:<11} {done}/{total}", flush=True)
+            last_step[0] = step
+
+    manifest = build_bundle(args.source, args.dest, args.thumbnail_size, args.workers,
+                            args.max_facet_values, progress=show_progress)
+    print(f"{args.dest}: {manifest['rows']} rows, {manifest['images']} images, "
+          f"list columns {', '.join(manifest['list_columns']) or '-'} "
+          f"({time.perf_counter() - started:.1f}s)")
+    for folder, file_name, error in manifest['thumbnail_errors']:
+        print(f"no thumbnail for {folder}/{file_name}: {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Columnar copy of a dataset's metadata CSV, reloaded through a memory map.
+
+The first load of a dataset parses the CSV as before and writes the result
+next to the cached archive as an uncompressed Arrow IPC file, with
+low-cardinality string columns dictionary-encoded. Later loads map that file
+instead of parsing text, and every session reading the same dataset shares
+its pages through the OS page cache. Dictionary columns come back as pandas
+``category`` columns, the dtype ``ageai.schema.optimize_dtypes`` would give
+them, so their strings are never copied out one per row.
+"""
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+COLUMNAR_NAME = "metadata.arrow"
+DICTIONARY_MAX_RATIO = 0.5  # dictionary-encode string columns with at most this many distinct values per row
+
+
+def to_table(df, dictionary_max_ratio=DICTIONARY_MAX_RATIO):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for index, field in enumerate(table.schema):
+        if not pa.types.is_string(field.type) and not pa.types.is_large_string(field.type):
+            continue
+        column = table.column(index)
+        if len(column) and pc.count_distinct(column).as_py() <= dictionary_max_ratio * len(column):
+            table = table.set_column(index, field.name, pc.dictionary_encode(column))
+    return table
+
+
+def write_columnar(df, path, dictionary_max_ratio=DICTIONARY_MAX_RATIO):
+    """Write ``df`` to ``path`` atomically. Returns False if its columns have no Arrow type (mixed objects)."""
+    try:
+        table = to_table(df, dictionary_max_ratio)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return False
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    return True
+
+
+def read_columnar(path):
+    """DataFrame from a file written by ``write_columnar``: the values ``pd.read_csv`` gave, dictionary columns as ``category``."""
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    # split_blocks: no consolidation copy; numeric columns stay views of the mapped file where possible
+    df = table.to_pandas(split_blocks=True)
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_dictionary(field.type):
+            # Sorted categories, as astype('category') makes them; only the integer codes are remapped
+            categories = df[field.name].cat.categories
+            df[field.name] = df[field.name].cat.reorder_categories(categories.sort_values())
+        elif column.null_count and df[field.name].dtype == object:
+            # Arrow hands back missing strings as None; read_csv used NaN (astype(str) gives 'nan')
+            df[field.name] = df[field.name].where(df[field.name].notna(), np.nan)
+    return df
+
+
+def read_csv_cached(csv_source, columnar_path=None):
+    """``pd.read_csv(csv_source)``, served from ``columnar_path`` once that exists.
+
+    ``csv_source`` may be a callable returning the path or file object, so the
+    CSV is not even opened on a hit. Returns ``(df, hit)``.
+    """
+    if columnar_path and os.path.exists(columnar_path):
+        try:
+            return read_columnar(columnar_path), True
+        except (OSError, pa.ArrowInvalid):
+            pass  # Truncated or foreign file: rebuild it from the CSV
+    df = pd.read_csv(csv_source() if callable(csv_source) else csv_source)
+    if columnar_path:
+        try:
+            write_columnar(df, columnar_path)
+        except OSError:
+            pass  # Read-only cache: the CSV still loaded
+    return df, False
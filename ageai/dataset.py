@@ -0,0 +1,27 @@
+"""A loaded dataset's metadata frame under a version token.
+
+Cached computations over the metadata (option counts, filter results)
+took the DataFrame itself as an argument, so every lookup hashed the
+whole frame to find its key. ``Dataset`` pairs the frame with
+``version``, a token that changes whenever the content can: the dataset
+cache key (Drive file id plus checksum) for cached loads, a random token
+of its own otherwise. Caches key on the token, which costs nothing to
+hash and cannot go stale as long as the frame is not modified in place
+once wrapped; derive a new frame and wrap it instead.
+"""
+import uuid
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """``df`` and its version; equal and hashed by the version alone."""
+    df: pd.DataFrame = field(compare=False, repr=False)
+    version: str
+
+    @classmethod
+    def wrap(cls, df, version=None):
+        """``df`` under ``version``; without one it gets a token shared with no other load."""
+        return cls(df, version or uuid.uuid4().hex)
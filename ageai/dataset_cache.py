@@ -0,0 +1,179 @@
+"""Persistent, size-bounded cache of prepared datasets.
+
+Entries are directories under ``root`` named after the Drive file id plus its
+content version (``md5Checksum``, or ``modifiedTime`` when Drive has no
+checksum), so an unchanged archive is never downloaded or extracted twice and
+a changed one can never be served stale. Least recently used entries are
+evicted once the cache grows past ``max_bytes``; staging directories and
+entries built in place that have sat unfinished for ``STALE_BUILD_AGE`` are
+removed at the same time.
+"""
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+DEFAULT_CACHE_ROOT = "./dataset_cache"
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+COMPLETE_MARKER = ".complete"  # mtime doubles as the entry's last-used time
+MANIFEST_NAME = "manifest.json"
+ARCHIVE_NAME = "archive.zip"  # the raw archive, for entries served without extraction
+STALE_BUILD_AGE = 24 * 3600  # an unfinished build untouched for this long was abandoned
+
+
+def cache_key(file_meta, variant=None):
+    """Cache key for a Drive file dict, or None if Drive reported no version for it.
+
+    ``variant`` separates differently prepared copies of the same file (e.g.
+    the raw archive vs. its extracted contents).
+    """
+    version = file_meta.get('md5Checksum') or file_meta.get('modifiedTime')
+    if not file_meta.get('id') or not version:
+        return None
+    key = f"{file_meta['id']}-{version}" + (f"-{variant}" if variant else "")
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+
+
+def dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def last_modified(path):
+    """Newest modification time of ``path`` and everything under it."""
+    newest = os.path.getmtime(path)
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(dirpath, filename)))
+            except OSError:
+                pass
+    return newest
+
+
+class DatasetCache:
+    def __init__(self, root=DEFAULT_CACHE_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        """Return the entry directory for ``key`` and mark it as used, or None on a miss."""
+        if key is None:
+            return None
+        path = self.entry_path(key)
+        marker = os.path.join(path, COMPLETE_MARKER)
+        if not os.path.exists(marker):
+            return None
+        os.utime(marker)
+        return path
+
+    def staging_dir(self, key):
+        """A fresh directory to build an entry in; pass it to ``commit`` when done."""
+        path = os.path.join(self.root, f".staging-{key}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(path)
+        return path
+
+    def building_dir(self, key):
+        """The entry directory itself, for entries filled in place (see ``ageai.streaming``).
+
+        ``lookup`` ignores it until ``finalize`` marks it complete.
+        """
+        path = self.entry_path(key)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _write_manifest(self, key, path, manifest):
+        manifest = dict(manifest or {}, key=key, size_bytes=dir_size(path), created=time.time())
+        with open(os.path.join(path, MANIFEST_NAME), 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh)
+        open(os.path.join(path, COMPLETE_MARKER), 'w').close()
+
+    def finalize(self, key, manifest=None):
+        """Mark an entry built in place with ``building_dir`` as complete and evict to fit."""
+        path = self.entry_path(key)
+        self._write_manifest(key, path, manifest)
+        self.evict(keep={key})
+        return path
+
+    def commit(self, key, staging_path, manifest=None):
+        """Atomically publish ``staging_path`` as the entry for ``key`` and evict to fit."""
+        self._write_manifest(key, staging_path, manifest)
+
+        path = self.entry_path(key)
+        if os.path.exists(path):
+            # Another session finished the same dataset first, or an incomplete leftover
+            if os.path.exists(os.path.join(path, COMPLETE_MARKER)):
+                shutil.rmtree(staging_path, ignore_errors=True)
+                return self.lookup(key)
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(staging_path, path)
+        self.evict(keep={key})
+        return path
+
+    def _remove_stale_staging(self, max_age=STALE_BUILD_AGE):
+        # Left behind by runs that died mid-build: staging directories, and entries filled in place
+        # (building_dir) that never reached finalize. A download still running keeps writing to its entry.
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name.startswith('.staging-'):
+                    stale = time.time() - os.path.getmtime(path) > max_age
+                elif os.path.isdir(path) and not os.path.exists(os.path.join(path, COMPLETE_MARKER)):
+                    stale = time.time() - last_modified(path) > max_age
+                else:
+                    continue
+            except OSError:
+                continue  # removed meanwhile
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def discard(self, key):
+        shutil.rmtree(self.entry_path(key), ignore_errors=True)
+
+    def entries(self):
+        """Complete entries as dicts (manifest plus ``path`` and ``last_used``), most recent first."""
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            marker = os.path.join(path, COMPLETE_MARKER)
+            if name.startswith('.') or not os.path.exists(marker):
+                continue
+            try:
+                with open(os.path.join(path, MANIFEST_NAME), encoding='utf-8') as fh:
+                    manifest = json.load(fh)
+            except (OSError, ValueError):
+                manifest = {'key': name, 'size_bytes': dir_size(path)}
+            manifest.update(path=path, last_used=os.path.getmtime(marker))
+            found.append(manifest)
+        return sorted(found, key=lambda entry: entry['last_used'], reverse=True)
+
+    def total_bytes(self):
+        return sum(entry.get('size_bytes', 0) for entry in self.entries())
+
+    def evict(self, keep=()):
+        """Remove least recently used entries until the cache fits in ``max_bytes``."""
+        self._remove_stale_staging()
+        entries = self.entries()
+        total = sum(entry.get('size_bytes', 0) for entry in entries)
+        evicted = []
+        for entry in reversed(entries):
+            if total <= self.max_bytes:
+                break
+            if entry['key'] in keep:
+                continue
+            shutil.rmtree(entry['path'], ignore_errors=True)
+            total -= entry.get('size_bytes', 0)
+            evicted.append(entry['key'])
+        return evicted
@@ -0,0 +1,174 @@
+"""Google Drive helpers shared by the dashboards."""
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from ageai.ranged_download import RangesNotSupportedError
+
+DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+HTTP_TIMEOUT = 120
+DEFAULT_POOL_SIZE = 16
+FILE_FIELDS = "id, name, size, md5Checksum, modifiedTime"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+def get_file_metadata(service, file_id, fields=FILE_FIELDS):
+    """Return Drive metadata with ``size`` as an int (None for files without one, e.g. Google Docs)."""
+    metadata = service.files().get(fileId=file_id, fields=fields).execute()
+    if metadata.get('size') is not None:
+        metadata['size'] = int(metadata['size'])
+    return metadata
+
+
+def list_folder(service, folder_id, recursive=False, fields=FILE_FIELDS, page_size=1000):
+    """All non-trashed files in a Drive folder, following ``nextPageToken`` until the last page.
+
+    With ``recursive``, subfolders are walked too. Every file dict gets a
+    ``path`` relative to ``folder_id`` ('sub/archive.zip'); folders themselves
+    are not returned. ``size`` is converted to int as in ``get_file_metadata``.
+    """
+    found = []
+    pending = [(folder_id, '')]
+    while pending:
+        current_id, prefix = pending.pop(0)
+        page_token = None
+        while True:
+            response = service.files().list(
+                q=f"'{current_id}' in parents and trashed=false",
+                fields=f"nextPageToken, files({fields}, mimeType)",
+                pageSize=page_size,
+                pageToken=page_token,
+            ).execute()
+            for item in response.get('files', []):
+                if item.get('mimeType') == FOLDER_MIME_TYPE:
+                    if recursive:
+                        pending.append((item['id'], f"{prefix}{item['name']}/"))
+                    continue
+                if item.get('size') is not None:
+                    item['size'] = int(item['size'])
+                item['path'] = prefix + item['name']
+                found.append(item)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+    return found
+
+
+def download_identity(metadata):
+    """What a partial download must match to be resumed."""
+    return {key: metadata.get(key) for key in ('id', 'size', 'md5Checksum', 'modifiedTime')}
+
+
+def authorized_http(credentials, timeout=HTTP_TIMEOUT):
+    return AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))
+
+
+@dataclass
+class DriveClient:
+    """One pooled slot: an authorized keep-alive connection and a Drive service built on it."""
+    http: AuthorizedHttp
+    service: object
+
+
+class DriveClientPool:
+    """Bounded pool of Drive clients shared by every session of the server process.
+
+    httplib2 connections are not thread-safe, so a single cached service
+    object cannot serve concurrent sessions or download workers. ``client()``
+    checks out a slot for the exclusive use of the calling thread and returns
+    it afterwards; at most ``size`` slots exist, and callers beyond that wait.
+    Slots are created lazily and keep their connection alive between uses.
+    """
+
+    def __init__(self, credentials, size=DEFAULT_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        self.credentials = credentials
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._created = self._in_use = self._peak_in_use = 0
+        self._checkouts = self._waits = 0
+        self._wait_seconds = 0.0
+
+    def _create(self):
+        http = authorized_http(self.credentials, self.timeout)
+        return DriveClient(http, build('drive', 'v3', http=http, cache_discovery=False))
+
+    @contextmanager
+    def client(self):
+        started = time.monotonic()
+        waited = not self._slots.acquire(blocking=False)
+        if waited:
+            self._slots.acquire()
+        with self._lock:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_seconds += time.monotonic() - started
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            client = self._idle.pop() if self._idle else None
+        try:
+            if client is None:
+                client = self._create()
+                with self._lock:
+                    self._created += 1
+            yield client
+        except Exception:
+            client = None  # The connection may be mid-response; build a fresh one next time
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                if client is not None:
+                    self._idle.append(client)
+            self._slots.release()
+
+    def stats(self):
+        """Pool usage counters, for display in the dashboards."""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'peak_in_use': self._peak_in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_seconds': round(self._wait_seconds, 3),
+            }
+
+
+class DriveRangeFetcher:
+    """Fetch byte ranges of a Drive file, each request on a connection checked out of ``pool``.
+
+    A server that ignores ``Range`` sends the whole file for every range, so
+    the first 200 reply raises ``RangesNotSupportedError`` and so does every
+    call after it, without a request.
+    """
+
+    def __init__(self, pool, file_id):
+        self.pool = pool
+        self.url = DRIVE_MEDIA_URL.format(file_id=file_id)
+        self.ranges_supported = True
+
+    def __call__(self, start, end):
+        if not self.ranges_supported:
+            raise RangesNotSupportedError(f"{self.url} ignores Range requests")
+        with self.pool.client() as client:
+            resp, content = client.http.request(
+                self.url, 'GET', headers={'Range': f'bytes={start}-{end - 1}'}
+            )
+        if resp.status == 200:
+            self.ranges_supported = False
+            raise RangesNotSupportedError(f"{self.url} ignored the Range header and sent {len(content)} bytes")
+        if resp.status != 206:
+            raise HttpError(resp, content, uri=self.url)
+        return content
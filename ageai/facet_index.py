@@ -0,0 +1,371 @@
+"""Inverted index over the filterable metadata columns, built once at load time.
+
+For every indexed column each distinct value (and for list columns each
+item) gets the set of rows holding it, in roaring style: a packed bitmap
+(one bit per row) when the value is frequent, a sorted array of row
+positions when it is rare. A sidebar filter is then an OR of its values'
+sets, and the filters together an AND of packed bitmaps, instead of a scan
+of the column per filter per rerun. Values are matched as strings, like
+``isin_str``.
+
+Filters the index cannot answer (columns it does not hold, searches of the
+prompts) cost a pass over rows. A ``Selection`` plans its filters like a
+query: index lookups first, then the others from cheapest and most
+selective, each evaluated only on the rows the previous ones left.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from ageai.schema import MISSING_TEXT, is_categorical, isin_str, str_value_counts
+
+MAX_INDEXED_VALUES = 500  # columns with more distinct values (prompts, file names) are scanned instead
+DENSE_MIN_SHARE = 1 / 64  # values on at least this share of rows get a bitmap: at most twice an int32 row array, far faster to OR
+# Relative cost per row of evaluating a filter
+INDEX_COST = 0  # bitmaps OR'd from the index: whatever the rows, evaluated up front
+SCAN_COST = 1  # a vectorized pass over a column
+TEXT_COST = 4  # a text search over the column's distinct texts
+APPLY_COST = 50  # a Python call per row
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(bitmaps):
+    """Set bits in a packed bitmap, or in each row of a 2-D array of them."""
+    if not hasattr(np, 'bitwise_count'):  # numpy < 2: a byte lookup table
+        return POPCOUNT[bitmaps].sum(axis=-1, dtype=np.int64)
+    whole = bitmaps.shape[-1] // 8 * 8  # counted eight bytes at a time, the tail byte by byte
+    return np.bitwise_count(bitmaps[..., :whole].view(np.uint64)).sum(axis=-1, dtype=np.int64) + \
+        np.bitwise_count(bitmaps[..., whole:]).sum(axis=-1, dtype=np.int64)
+
+
+def str_codes(series):
+    """``(codes, values)`` of ``series`` as strings, the way ``isin_str`` compares it (missing cells as ``'nan'``)."""
+    if is_categorical(series):
+        category_codes, values = pd.factorize(series.cat.categories.astype(str))
+        values = list(values)
+        codes = series.cat.codes.to_numpy()
+        if (codes < 0).any():
+            if MISSING_TEXT not in values:
+                values.append(MISSING_TEXT)
+            category_codes = np.append(category_codes, values.index(MISSING_TEXT))  # code -1 picks the last entry
+        return category_codes[codes], values
+    codes, values = pd.factorize(series.astype(str))
+    return codes, list(values)
+
+
+class Facet:
+    """Rows of every value of one column: packed bitmaps for frequent values, row arrays for rare ones."""
+
+    def __init__(self, values, row_count, codes, rows):
+        """``codes[i]`` is the value of entry ``i`` and ``rows[i]`` its row; entries sorted by row."""
+        self.values = values
+        self.counts = np.bincount(codes, minlength=len(values))
+        dense = self.counts >= DENSE_MIN_SHARE * row_count
+        # One bitmap row per dense value, in code order; the dicts below hold views of these arrays
+        self.dense_codes = np.flatnonzero(dense)
+        self.dense_bitmaps = np.zeros((len(self.dense_codes), (row_count + 7) // 8), dtype=np.uint8)
+        if dense.any():
+            taken = dense[codes]
+            slots = np.cumsum(dense) - 1
+            np.bitwise_or.at(self.dense_bitmaps, (slots[codes[taken]], rows[taken] >> 3),
+                             (128 >> (rows[taken] & 7)).astype(np.uint8))
+        self.bitmaps = {int(code): bitmap for code, bitmap in zip(self.dense_codes, self.dense_bitmaps)}
+        sparse = ~dense[codes]
+        order = np.argsort(codes[sparse], kind='stable')
+        self.sparse_codes, self.sparse_rows = codes[sparse][order], rows[sparse][order].astype(np.int32)
+        bounds = np.searchsorted(self.sparse_codes, np.arange(len(values) + 1))
+        self.postings = {int(code): self.sparse_rows[bounds[code]:bounds[code + 1]]
+                         for code in np.flatnonzero(~dense & (self.counts > 0))}
+        self.nbytes = self.dense_bitmaps.nbytes + self.sparse_rows.nbytes
+
+    def codes_of(self, values, case=True):
+        if case:
+            wanted = {str(value) for value in values}
+            return [code for code, value in enumerate(self.values) if value in wanted]
+        wanted = {str(value).lower() for value in values}
+        return [code for code, value in enumerate(self.values) if value.lower() in wanted]
+
+    def estimate(self, values, case=True):
+        """Rows holding any of ``values``: exact for a column, an upper bound for a list column."""
+        return int(self.counts[self.codes_of(values, case)].sum())
+
+    def counts_within(self, bits, row_count):
+        """Rows of every value among the rows set in the packed bitmap ``bits`` (None: every row)."""
+        if bits is None:
+            return self.counts
+        counts = np.zeros(len(self.values), dtype=np.int64)
+        if len(self.dense_codes):  # AND each value's bitmap with the rows, then count the bits left
+            counts[self.dense_codes] = popcount(self.dense_bitmaps & bits)
+        if len(self.sparse_rows):
+            flags = np.unpackbits(bits, count=row_count).view(bool)
+            counts += np.bincount(self.sparse_codes[flags[self.sparse_rows]], minlength=len(self.values))
+        return counts
+
+    def union(self, values, row_count, case=True):
+        """Packed bitmap of the rows holding any of ``values``."""
+        bits = np.zeros((row_count + 7) // 8, dtype=np.uint8)
+        postings = []
+        for code in self.codes_of(values, case):
+            if code in self.bitmaps:
+                bits |= self.bitmaps[code]
+            elif code in self.postings:
+                postings.append(self.postings[code])
+        if postings:
+            flags = np.zeros(row_count, dtype=bool)
+            for rows in postings:
+                flags[rows] = True
+            bits |= np.packbits(flags)
+        return bits
+
+
+class FacetIndex:
+    """Facets of a DataFrame's low-cardinality and list columns; see ``select`` to combine them."""
+
+    def __init__(self, df, facets):
+        self.df = df  # for filters on columns that are not indexed
+        self.rows = len(df)
+        self.facets = facets
+
+    @classmethod
+    def build(cls, df, list_columns=None, max_values=MAX_INDEXED_VALUES):
+        """Index every column of ``df`` with at most ``max_values`` values, and the ``{name: ListColumn}`` given.
+
+        A list column replaces the ``df`` column of the same name; other names
+        (derived facets such as activities found in the prompts) are added.
+        """
+        list_columns = list_columns or {}
+        facets = {name: Facet(list_column.vocabulary, len(df), list_column.codes, list_column.row_ids)
+                  for name, list_column in list_columns.items()}
+        all_rows = np.arange(len(df), dtype=np.int64)
+        for column in df.columns:
+            if column in list_columns:
+                continue
+            try:
+                codes, values = str_codes(df[column])
+            except TypeError:
+                continue  # cells that cannot be compared as strings
+            if len(values) > max_values:
+                continue
+            present = codes >= 0
+            facets[column] = Facet(values, len(df), codes[present], all_rows[present])
+        return cls(df, facets)
+
+    @property
+    def nbytes(self):
+        return sum(facet.nbytes for facet in self.facets.values())
+
+    def __contains__(self, column):
+        return column in self.facets
+
+    def estimate(self, column, values, case=True):
+        """Rows expected to match ``values`` in ``column``; None when it is not indexed."""
+        if column in self.facets:
+            return min(self.facets[column].estimate(values, case), self.rows)
+        return None
+
+    def matching(self, column, values, case=True):
+        """Packed bitmap of the rows whose ``column`` is (or, for lists, holds) any of ``values``."""
+        if column in self.facets:
+            return self.facets[column].union(values, self.rows, case)
+        return np.packbits(isin_str(self.df[column], values, case).to_numpy(dtype=bool))
+
+    def value_counts(self, column, bits=None):
+        """``{str(value): rows}`` of ``column`` among the rows set in the packed bitmap ``bits`` (None: every row).
+
+        Values with no rows are left out, as in ``str_value_counts``.
+        """
+        if column in self.facets:
+            facet = self.facets[column]
+            counts = facet.counts_within(bits, self.rows)
+            return {value: int(count) for value, count in zip(facet.values, counts) if count}
+        series = self.df[column]
+        if bits is not None:
+            series = series.take(np.flatnonzero(np.unpackbits(bits, count=self.rows)))
+        return str_value_counts(series)
+
+    def select(self):
+        return Selection(self)
+
+
+def _and_all(bitmaps):
+    bits = None
+    for bitmap in bitmaps:
+        bits = bitmap if bits is None else bits & bitmap
+    return bits
+
+
+def _covers(domain, needed):
+    """Whether the rows set in ``domain`` include those in ``needed`` (None: every row)."""
+    if domain is None:
+        return True
+    return needed is not None and not (needed & ~domain).any()
+
+
+class Predicate:
+    """One filter of a ``Selection``: the rows it keeps and what finding them costs.
+
+    ``matching`` returns the filter's packed bitmap. With ``takes_rows`` it
+    is called with the positions of the rows still in play (None: every
+    row) and only has to be right at those; otherwise it takes no
+    arguments. ``cost`` is per row evaluated (``INDEX_COST`` and so on),
+    ``estimate`` the rows expected to pass, None when unknown.
+    """
+
+    def __init__(self, key, column, matching, cost, estimate=None, takes_rows=False):
+        self.key = key
+        self.column = column
+        self.matching = matching
+        self.cost = cost
+        self.estimate = estimate
+        self.takes_rows = takes_rows
+        self.bits = None  # once evaluated: right wherever ``domain`` is set, clear elsewhere
+        self.domain = None  # packed bitmap of the rows evaluated; None: every row
+
+    def evaluate(self, needed, row_count):
+        """Packed bitmap of the rows passing, right at least at the rows in ``needed`` (None: every row)."""
+        if self.bits is not None and _covers(self.domain, needed):
+            return self.bits
+        if needed is not None and self.bits is not None:
+            needed = needed | self.domain  # keep the rows already evaluated
+        if needed is not None and not needed.any():
+            self.bits = np.zeros((row_count + 7) // 8, dtype=np.uint8)  # no row in play: nothing to evaluate
+        elif self.takes_rows:
+            rows = None if needed is None else np.flatnonzero(np.unpackbits(needed, count=row_count))
+            self.bits = self.matching(rows) if needed is None else self.matching(rows) & needed
+        else:
+            self.bits, needed = self.matching(), None
+        self.domain = needed
+        return self.bits
+
+
+class Selection:
+    """Rows passing every filter added so far (AND across filters, OR within one).
+
+    Filters are recorded as they are added and evaluated on the first
+    ``count``, ``positions`` or ``facet_counts``, in the order ``plan``
+    gives: the index lookups, then each costlier filter only on the rows
+    the filters before it left. ``key`` names the set of filters, so a
+    result cache (``ageai.result_cache``) can answer a repeated one without
+    evaluating it.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.filters = []  # Predicate per filter, in the order added
+        self._bits = None
+
+    def _and(self, predicate):
+        self.filters.append(predicate)
+        self._bits = None
+        return self
+
+    def add(self, column, values, case=True):
+        """Keep rows whose ``column`` matches any of ``values``; a filter with no values is ignored."""
+        if not values:
+            return self
+        values = list(values)
+        key = ('values', column, tuple(sorted({str(value) if case else str(value).lower() for value in values})), case)
+        if column in self.index:
+            return self._and(Predicate(key, column, lambda: self.index.matching(column, values, case), INDEX_COST,
+                                       self.index.estimate(column, values, case)))
+
+        def matching(rows):  # a column the index does not hold: compare only the rows in play
+            series = self.index.df[column]
+            if rows is None:
+                return np.packbits(isin_str(series, values, case).to_numpy(dtype=bool))
+            flags = np.zeros(self.index.rows, dtype=bool)
+            flags[rows] = isin_str(series.take(rows), values, case).to_numpy(dtype=bool)
+            return np.packbits(flags)
+        return self._and(Predicate(key, column, matching, SCAN_COST, takes_rows=True))
+
+    def add_mask(self, mask, key=None, column=None, cost=SCAN_COST, takes_rows=False):
+        """Keep rows where the boolean array ``mask`` (one entry per row of the indexed frame) is True.
+
+        ``mask`` may also be a function returning the array, called only when
+        the selection is evaluated; with ``takes_rows`` it is passed the row
+        positions still in play (None: every row) and need only be right at
+        those. ``cost`` (per row, see ``INDEX_COST``) orders it among the
+        other filters. ``key`` names the filter in ``key``; a selection with an
+        unnamed mask has no key. ``column``, if the mask filters on one,
+        leaves it out of that column's ``facet_counts``.
+        """
+        if takes_rows:
+            matching = lambda rows: np.packbits(np.asarray(mask(rows), dtype=bool))
+        else:
+            matching = lambda: np.packbits(np.asarray(mask() if callable(mask) else mask, dtype=bool))
+        return self._and(Predicate(key and ('mask', key), column, matching, cost, takes_rows=takes_rows))
+
+    @property
+    def active(self):
+        return bool(self.filters)
+
+    def _key(self, keys):
+        if None in keys:
+            return None
+        return hashlib.sha1(repr(sorted(repr(key) for key in keys)).encode()).hexdigest()
+
+    @property
+    def key(self):
+        """Canonical hash of the filters, whatever the order they and their values were given in; None if one is unnamed."""
+        return self._key([predicate.key for predicate in self.filters])
+
+    def key_without(self, column):
+        """``key`` of the filters not on ``column``: what its ``facet_counts`` depend on."""
+        return self._key([predicate.key for predicate in self.filters if predicate.column != column])
+
+    def plan(self):
+        """The filters in evaluation order: cheapest per row first and, at the same cost, fewest rows expected."""
+        return sorted(self.filters, key=lambda predicate: (
+            predicate.cost, self.index.rows if predicate.estimate is None else predicate.estimate))
+
+    def _lookups(self):
+        return [predicate for predicate in self.filters if predicate.cost == INDEX_COST]
+
+    @property
+    def bits(self):
+        """Packed bitmap of the rows passing, or None when no filter was added."""
+        if self._bits is None and self.filters:
+            survivors = None
+            for predicate in self.plan():  # each filter evaluated only on the rows the ones before it left
+                bits = predicate.evaluate(survivors, self.index.rows)
+                survivors = bits if survivors is None else survivors & bits
+            self._bits = survivors
+        return self._bits
+
+    def count(self):
+        return self.index.rows if not self.filters else int(popcount(self.bits))
+
+    def positions(self):
+        """Row positions (for ``iloc``) of the rows passing, in order."""
+        if not self.filters:
+            return np.arange(self.index.rows)
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.index.rows))
+
+    def facet_counts(self, columns):
+        """``{column: {value: rows}}``, each column's values counted among the rows passing every *other* filter.
+
+        These are the counts of a faceted search: picking a value of a column
+        with no filter yet leaves as many rows as its count says, and the
+        values already picked in a column do not zero the counts of the rest.
+        A costlier filter is evaluated on the rows the index lookups on the
+        other columns leave, for any of ``columns``.
+        """
+        lookups = self._lookups()
+        for predicate in lookups:
+            predicate.evaluate(None, self.index.rows)
+        in_play = {column: _and_all(lookup.bits for lookup in lookups if lookup.column != column) for column in columns}
+        for predicate in self.plan():
+            if predicate.cost == INDEX_COST:
+                continue
+            needed = np.zeros((self.index.rows + 7) // 8, dtype=np.uint8)
+            for column, rows in in_play.items():
+                if column != predicate.column:
+                    if rows is None:
+                        needed = None
+                        break
+                    needed |= rows
+            predicate.evaluate(needed, self.index.rows)
+        return {column: self.index.value_counts(column, _and_all(
+                    predicate.bits for predicate in self.filters if predicate.column != column))
+                for column in columns}
@@ -0,0 +1,72 @@
+"""The rows a filter state selects, as positions into the loaded frame.
+
+Every rerun used to take all the rows passing the filters into a new
+DataFrame (``df_results.take(positions)``), a copy of every column of
+them, before the table, the image grid and the downloads each used a
+part of it. ``FilteredRows`` keeps only the positions, ascending, and the
+base frame they index, which is never modified. Column data is gathered
+for the rows a consumer actually uses: one page of the table or of the
+image grid, the few columns the ZIP export reads, the CSV export a
+bounded chunk at a time, a single row for the detail view.
+"""
+import hashlib
+import io
+
+import numpy as np
+
+CSV_CHUNK_ROWS = 50000
+
+
+class FilteredRows:
+    def __init__(self, df, positions, version, selection_key=None):
+        """``positions`` (ascending) into ``df``, the frame of dataset ``version``, chosen by the filters ``selection_key`` names."""
+        self.df = df
+        self.positions = np.asarray(positions)
+        self.version = version
+        self.selection_key = selection_key
+        self._key = None
+
+    @property
+    def key(self):
+        """Names these rows of this dataset: its version and the filters' key, else a digest of the positions."""
+        if self._key is None:
+            selection_key = self.selection_key or \
+                hashlib.sha1(np.ascontiguousarray(self.positions, dtype=np.int64).tobytes()).hexdigest()
+            self._key = f"{self.version}:{selection_key}"
+        return self._key
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def empty(self):
+        return len(self.positions) == 0
+
+    def page(self, start, stop):
+        """Rows ``start`` to ``stop`` (0-based, within the selection) as a DataFrame, index labels kept."""
+        return self.df.take(self.positions[start:stop])
+
+    def chunks(self, size):
+        """The selected rows as consecutive DataFrames of ``size`` rows."""
+        for start in range(0, len(self.positions), size):
+            yield self.page(start, start + size)
+
+    def columns(self, names):
+        """The selected rows of just the columns in ``names`` that ``df`` has."""
+        present = [self.df.columns.get_loc(name) for name in names if name in self.df.columns]
+        return self.df.iloc[self.positions, present]
+
+    def first(self, column, value):
+        """The first selected row (a Series) whose ``column`` equals ``value``, or None."""
+        matches = np.flatnonzero((self.df[column] == value).to_numpy(dtype=bool))  # over the base column, no gather
+        found = matches[np.isin(matches, self.positions, assume_unique=True)]
+        return self.df.iloc[found[0]] if len(found) else None
+
+    def to_csv(self, chunk_rows=CSV_CHUNK_ROWS):
+        """``to_csv(index=False)`` of the selected rows, written ``chunk_rows`` at a time."""
+        buffer = io.StringIO()
+        if self.empty:
+            self.df.iloc[:0].to_csv(buffer, index=False)
+        for number, chunk in enumerate(self.chunks(chunk_rows)):
+            chunk.to_csv(buffer, index=False, header=number == 0)
+        return buffer.getvalue()
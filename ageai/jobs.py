@@ -0,0 +1,178 @@
+"""Background jobs with staged progress, for work too slow to run inside a script run.
+
+A job function runs on a worker thread of a ``JobRunner`` and reports through
+the ``Job`` it receives: ``with job.stage(name)`` brackets each stage (timing
+it), ``job.update()`` sets the current stage's progress and is also where a
+cancellation request is honoured, and ``job.log()`` collects messages for the
+UI. Streamlit scripts keep only the job id in ``st.session_state`` and poll.
+Job functions must not call Streamlit themselves.
+"""
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+DEFAULT_MAX_JOBS = 4
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once ``cancel()`` was requested."""
+
+
+class JobError(Exception):
+    """An expected failure; its message is shown to the user as is."""
+
+
+@dataclass
+class Stage:
+    name: str
+    label: str
+    status: str = PENDING
+    progress: float = 0.0
+    detail: str = ''
+    started: float = None
+    finished: float = None
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+
+class Job:
+    def __init__(self, stages, description=''):
+        """``stages`` is a list of ``(name, label)`` pairs in the order they run."""
+        self.id = uuid.uuid4().hex[:12]
+        self.description = description
+        self.stages = {name: Stage(name, label) for name, label in stages}
+        self.status = PENDING
+        self.messages = []  # (level, text), level being 'info', 'success', 'warning' or 'error'
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created = time.time()
+        self.cancel_event = threading.Event()
+        self._current = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def current_stage(self):
+        return self._current
+
+    @property
+    def progress(self):
+        """Overall progress in [0, 1]; skipped stages do not count."""
+        counted = [stage for stage in self.stages.values() if stage.status != SKIPPED]
+        if not counted:
+            return 1.0
+        return sum(1.0 if stage.status == DONE else stage.progress for stage in counted) / len(counted)
+
+    def timings(self):
+        return {name: stage.seconds for name, stage in self.stages.items() if stage.seconds is not None}
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    @contextmanager
+    def stage(self, name):
+        self.check_cancelled()
+        stage = self._current = self.stages[name]
+        stage.status, stage.started = RUNNING, time.monotonic()
+        try:
+            yield stage
+        except BaseException:
+            stage.status = FAILED
+            raise
+        else:
+            stage.status, stage.progress = DONE, 1.0
+        finally:
+            stage.finished = time.monotonic()
+
+    def skip(self, name, detail=''):
+        stage = self.stages[name]
+        stage.status, stage.detail = SKIPPED, detail
+
+    def update(self, progress=None, detail=None):
+        """Report progress of the current stage; raises ``JobCancelled`` if cancellation was requested."""
+        stage = self._current
+        if stage is not None:
+            if progress is not None:
+                stage.progress = min(max(progress, 0.0), 1.0)
+            if detail is not None:
+                stage.detail = detail
+        self.check_cancelled()
+
+    def log(self, level, text):
+        self.messages.append((level, text))
+
+
+class JobRunner:
+    """Runs jobs on a bounded thread pool shared by all sessions; keeps the last ``keep`` of them."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_JOBS, keep=50):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.keep = keep
+
+    def submit(self, fn, stages, *args, description='', **kwargs):
+        """Queue ``fn(job, *args, **kwargs)``; its return value becomes ``job.result``."""
+        job = Job(stages, description)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            return
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except JobError as e:
+            job.error = str(e)
+            job.status = FAILED
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.traceback = traceback.format_exc()
+            job.status = FAILED
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda job: job.created)[:max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id) if job_id else None
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def active(self):
+        return [job for job in list(self._jobs.values()) if not job.finished]
@@ -0,0 +1,220 @@
+"""List-like metadata columns, parsed once into CSR arrays.
+
+Columns such as ``objects`` hold stringified Python lists
+(``"['cane', 'glasses']"``). ``ListColumn`` parses each distinct cell once at
+load time into three arrays: ``offsets`` (one entry per row plus one),
+``codes`` (item codes of every row, back to back) and ``vocabulary`` (the
+item strings). Option counts and the facet index (``ageai.facet_index``)
+then work on the integer arrays instead of re-parsing the strings on every
+rerun.
+"""
+import ast
+import io
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+
+CELL_SEPARATOR = '\x1e'  # joins the literal cells of a column into one string for a single regex pass
+# One list item: a single- or double-quoted string (backslash escapes allowed) or a bare token (numbers, names)
+ITEM_PATTERN = r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^,\[\]'"\s\x1e](?:[^,\[\]'"\x1e]*[^,\[\]'"\s\x1e])?"""
+TOKEN_RE = re.compile(rf"{ITEM_PATTERN}|{CELL_SEPARATOR}")
+# A whole cell in list-literal form: "[item, item, ...]", optional trailing comma, any spacing
+LIST_RE = re.compile(rf"\s*\[\s*(?:(?:{ITEM_PATTERN})\s*(?:,\s*(?:{ITEM_PATTERN})\s*)*,?\s*)?\]\s*")
+
+
+def _clean(item):
+    return item.strip().strip('\'"').strip()
+
+
+def _literal_items(value):
+    """Items of a cell outside the list-literal form: ``ast.literal_eval``, then a comma split."""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if not isinstance(value, str):
+        return []
+    try:
+        items = ast.literal_eval(value)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        items = value.strip().strip('[]').split(',')
+    return list(items) if isinstance(items, (list, tuple)) else [items]
+
+
+def _token_value(token):
+    """The text ``eval`` gives a quoted or bare list item: escapes resolved, ``1.50`` as ``1.5``."""
+    if token[0] in '\'"' and '\\' not in token:
+        return token[1:-1]
+    try:
+        return str(ast.literal_eval(token))
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return token  # Bare names: eval failed on these and the dashboards fell back to the text
+
+
+def _simple_items(cell):
+    """Item count of a cell written exactly as ``repr`` writes a list of plain strings, else None.
+
+    ``"['a', 'b']"`` qualifies when its only quotes are the items' own and
+    it has no backslashes or double quotes; its items are then what lies
+    between the ``"', '"`` separators.
+    """
+    if not (cell.startswith("['") and cell.endswith("']")) or '\\' in cell or '"' in cell:
+        return None
+    separators = cell.count("', '")
+    return separators + 1 if cell.count("'") == 2 * separators + 2 else None
+
+
+def explode_list_cells(cells):
+    """Items of every cell in ``cells`` as flat arrays ``(cell_of_item, items)``, in cell order.
+
+    Nothing is executed. Cells written as ``repr`` writes a list of strings
+    are split on their separators in one ``str.split`` over the joined
+    column. Other list literals (``"["b's"]"``, ``"[1, 2]"``, escapes, odd
+    spacing) are tokenised by one regular expression pass. Anything else
+    (nested lists, scalars, text that is not a literal) goes through
+    ``ast.literal_eval`` and then a comma split. Only distinct items are
+    unquoted and stripped of spaces and quotes; empty ones are dropped.
+    """
+    cells = list(cells)
+    simple_cells, simple_lengths, simple_text, tokenised, other = [], [], [], [], []
+    for position, cell in enumerate(cells):
+        if isinstance(cell, str):
+            if cell == '[]':
+                continue
+            length = _simple_items(cell)
+            if length is not None:
+                simple_cells.append(position)
+                simple_lengths.append(length)
+                simple_text.append(cell[2:-2])
+                continue
+            if CELL_SEPARATOR not in cell and LIST_RE.fullmatch(cell):
+                tokenised.append(position)
+                continue
+        other.append(position)
+
+    simple_items = "', '".join(simple_text).split("', '") if simple_text else []
+    tokens = np.array(TOKEN_RE.findall(CELL_SEPARATOR.join(cells[position] for position in tokenised)), dtype=object)
+    separators = tokens == CELL_SEPARATOR
+    token_codes, distinct_tokens = pd.factorize(tokens[~separators])
+    other_cells, other_items = [], []
+    for position in other:
+        items = _literal_items(cells[position])
+        other_cells.extend([position] * len(items))
+        other_items.extend(str(item) for item in items)
+
+    cell_of_item = np.concatenate([
+        np.repeat(np.array(simple_cells, dtype=np.int64), simple_lengths),
+        np.array(tokenised, dtype=np.int64)[np.cumsum(separators)[~separators]],
+        np.array(other_cells, dtype=np.int64),
+    ])
+    raw = np.concatenate([
+        np.array(simple_items, dtype=object),
+        np.array([_token_value(token) for token in distinct_tokens], dtype=object)[token_codes],
+        np.array(other_items, dtype=object),
+    ])
+    raw_codes, distinct_raw = pd.factorize(raw)
+    items = np.array([_clean(item) for item in distinct_raw], dtype=object)[raw_codes]
+    order = np.argsort(cell_of_item, kind='stable')
+    cell_of_item, items = cell_of_item[order], items[order]
+    kept = items != ''
+    return cell_of_item[kept], items[kept]
+
+
+def parse_list_cells(values):
+    """Items of every list-like cell in ``values``, as one list per cell (see ``explode_list_cells``)."""
+    values = list(values)
+    cell_of_item, items = explode_list_cells(values)
+    bounds = np.searchsorted(cell_of_item, np.arange(len(values) + 1))
+    return [items[start:end].tolist() for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def parse_list_cell(value):
+    """Items of one list-like cell (``"['a', 'b']"``) as stripped strings.
+
+    Cells that are not a valid literal fall back to a comma split, as the
+    dashboards' own parsing does.
+    """
+    return parse_list_cells([value])[0]
+
+
+def is_list_column(series):
+    values = series.dropna()
+    if values.empty or values.dtype not in (object, 'category'):
+        return False
+    text = values.astype(str).str.strip()
+    return bool((text.str.startswith('[') & text.str.endswith(']')).all())
+
+
+@dataclass
+class ListColumn:
+    """A list-like column in CSR form: row ``i`` holds ``vocabulary[codes[offsets[i]:offsets[i + 1]]]``."""
+    offsets: np.ndarray
+    codes: np.ndarray
+    vocabulary: list
+    _row_ids: np.ndarray = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_series(cls, series):
+        # Each distinct cell is parsed once; rows then gather their cell's items
+        try:
+            cell_ids, cells = pd.factorize(series, use_na_sentinel=True)
+        except TypeError:  # cells holding actual lists are unhashable
+            cell_ids, cells = np.arange(len(series)), list(series)
+        cell_of_item, items = explode_list_cells(cells)
+        # Sorted vocabulary; the item codes of each cell, back to back
+        cell_codes, vocabulary = pd.factorize(items, sort=True)
+        cell_offsets = np.searchsorted(cell_of_item, np.arange(len(cells) + 1))
+        return cls.from_cells(cell_ids, cell_offsets, cell_codes.astype(np.int32), list(vocabulary))
+
+    @classmethod
+    def from_cells(cls, cell_ids, cell_offsets, cell_codes, vocabulary):
+        """Rows from distinct cells: row ``i`` holds the codes of cell ``cell_ids[i]`` (-1: none).
+
+        Cell ``k`` holds ``cell_codes[cell_offsets[k]:cell_offsets[k + 1]]``.
+        """
+        # A trailing empty cell for missing values, which factorize codes as -1
+        cell_offsets = np.append(cell_offsets, cell_offsets[-1])
+        lengths = np.diff(cell_offsets)[cell_ids]
+        offsets = np.zeros(len(cell_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(cell_offsets[:-1][cell_ids] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return cls(offsets, cell_codes[positions], vocabulary)
+
+    @property
+    def rows(self):
+        return len(self.offsets) - 1
+
+    @property
+    def row_ids(self):
+        """Row of every entry in ``codes``, i.e. the exploded ``(row_id, item_code)`` table's first column."""
+        if self._row_ids is None:
+            self._row_ids = np.repeat(np.arange(self.rows, dtype=np.int64), np.diff(self.offsets))
+        return self._row_ids
+
+    def counts(self):
+        """``{item: occurrences}``, most frequent first."""
+        counts = np.bincount(self.codes, minlength=len(self.vocabulary))
+        order = np.argsort(-counts, kind='stable')
+        return {self.vocabulary[code]: int(counts[code]) for code in order if counts[code]}
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, offsets=self.offsets, codes=self.codes, vocabulary=np.array(self.vocabulary, dtype=str))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays['offsets'], arrays['codes'], arrays['vocabulary'].tolist())
+
+
+def parse_list_columns(df, columns, bundle=None):
+    """``{column: ListColumn}`` for the ``columns`` present in ``df``.
+
+    Columns the bundle already holds in CSR form are read from it, provided
+    ``df`` still has the bundle's rows.
+    """
+    stored = bundle.manifest['list_columns'] if bundle is not None and len(df) == bundle.rows else ()
+    return {column: bundle.list_column(column) if column in stored else ListColumn.from_series(df[column])
+            for column in columns if column in df.columns}
@@ -0,0 +1,75 @@
+"""Which of a fixed list of phrases occur in each of many texts, in one pass per text.
+
+The dashboards' activities filter looks for each activity in the prompt
+(``str.contains(activity, case=False)``): one full pass over every prompt
+per activity. ``PhraseMatcher`` compiles the whole vocabulary once into a
+single regular expression shaped like a trie (``taking a (?:bath|break(?:
+from studying)?|course)``), so each lowercased text is scanned once, at C
+speed, and at every position only the branches of the characters actually
+there are tried. The scan reports the longest phrase starting at each
+position; like the output links of an Aho-Corasick automaton, a table of
+which phrases contain which others then adds every shorter phrase inside
+it, so the result equals one ``str.contains`` per phrase.
+
+``match`` returns a ``ListColumn``: the phrase codes of each row, which is
+the activity-by-row match matrix in CSR form.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from ageai.list_columns import ListColumn
+
+
+def _trie(phrases):
+    root = {}
+    for phrase in phrases:
+        node = root
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True  # a phrase ends here
+    return root
+
+
+def _trie_pattern(node):
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    if '' in node:  # a phrase ends here but longer ones continue: greedy, so the longest is tried first
+        return f"(?:{body})?"
+    return body
+
+
+class PhraseMatcher:
+    def __init__(self, phrases):
+        """``phrases`` keep their order and spelling as the vocabulary; matching ignores case."""
+        self.vocabulary = [phrase for phrase in dict.fromkeys(phrases) if phrase]
+        keys = [phrase.lower() for phrase in self.vocabulary]
+        self.codes = {}
+        for code, key in enumerate(keys):
+            self.codes.setdefault(key, []).append(code)  # phrases differing only in case match together
+        # Every phrase found implies the phrases it contains
+        self.implied = {key: sorted({code for other in self.codes if other in key for code in self.codes[other]})
+                        for key in self.codes}
+        # Zero-width lookahead: a match at every position, overlapping ones included
+        self.regex = re.compile(f"(?=({_trie_pattern(_trie(self.codes))}))") if self.codes else None
+
+    def find(self, text):
+        """Codes of the phrases occurring in ``text``, ascending."""
+        if self.regex is None or not isinstance(text, str):
+            return []
+        found = set(self.regex.findall(text.lower()))
+        if len(found) == 1:
+            return self.implied[found.pop()]
+        return sorted({code for key in found for code in self.implied[key]})
+
+    def match(self, texts):
+        """``ListColumn`` of the phrases occurring in each of ``texts`` (missing texts match nothing)."""
+        cell_ids, cells = pd.factorize(pd.Series(texts, dtype=object), use_na_sentinel=True)
+        cell_codes = [self.find(cell) for cell in cells]
+        cell_offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum([len(codes) for codes in cell_codes], out=cell_offsets[1:])
+        codes = np.fromiter((code for codes in cell_codes for code in codes), dtype=np.int32, count=cell_offsets[-1])
+        return ListColumn.from_cells(cell_ids, cell_offsets, codes, self.vocabulary)
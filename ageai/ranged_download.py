@@ -0,0 +1,244 @@
+"""Parallel byte-range downloads into a preallocated file.
+
+The engine is transport-agnostic: callers pass ``fetch_range(start, end)``
+returning the bytes of the half-open interval ``[start, end)``. ``ageai.drive``
+provides a fetcher for Google Drive and ``benchmarks/local_drive.py`` one for
+a local HTTP stand-in.
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_WORKERS = 8
+DEFAULT_RANGE_SIZE = 16 * 1024 * 1024  # 16MB per request
+
+
+class RangeDownloadError(Exception):
+    """Raised when a byte range cannot be fetched after all retries."""
+
+
+class ChecksumMismatchError(RangeDownloadError):
+    """Raised when a finished download does not match the expected MD5."""
+
+
+class RangesNotSupportedError(RangeDownloadError):
+    """Raised by a fetcher whose server answered a range request with the whole file.
+
+    Never retried: every further range would download the whole file again.
+    Callers fall back to a single full-file download.
+    """
+
+
+def plan_ranges(total_size, range_size=DEFAULT_RANGE_SIZE):
+    """Split ``[0, total_size)`` into consecutive ``(start, end)`` ranges."""
+    if range_size <= 0:
+        raise ValueError("range_size must be positive")
+    return [(start, min(start + range_size, total_size)) for start in range(0, total_size, range_size)]
+
+
+def preallocate(path, size):
+    """Create (or resize) ``path`` to exactly ``size`` bytes without touching existing data."""
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    with open(path, mode) as fh:
+        fh.truncate(size)
+
+
+def write_at(path, offset, data):
+    with open(path, 'r+b') as fh:
+        fh.seek(offset)
+        fh.write(data)
+
+
+def fetch_with_retries(fetch_range, start, end, retries=3, backoff=1.0):
+    for attempt in range(retries):
+        try:
+            data = fetch_range(start, end)
+            if len(data) != end - start:
+                raise RangeDownloadError(f"Range {start}-{end - 1}: expected {end - start} bytes, got {len(data)}")
+            return data
+        except RangesNotSupportedError:
+            raise
+        except Exception as e:
+            if attempt == retries - 1:
+                raise RangeDownloadError(f"Range {start}-{end - 1} failed after {retries} attempts: {e}") from e
+            time.sleep(backoff * (2 ** attempt))
+
+
+def download_ranges(fetch_range, dest_path, total_size, ranges=None, workers=DEFAULT_WORKERS,
+                    range_size=DEFAULT_RANGE_SIZE, retries=3, progress=None, on_range_done=None,
+                    cancel_event=None):
+    """Download ``ranges`` of a ``total_size`` byte file concurrently into ``dest_path``.
+
+    Each range is written at its own offset of a preallocated file, so ranges
+    may complete in any order. ``progress(done_bytes, total_size)`` and
+    ``on_range_done((start, end))`` are always called from the calling thread,
+    which keeps them safe for Streamlit elements. Returns the list of ranges
+    that completed; raises ``RangeDownloadError`` if any range fails.
+    """
+    if ranges is None:
+        ranges = plan_ranges(total_size, range_size)
+    preallocate(dest_path, total_size)
+
+    done_bytes = total_size - sum(end - start for start, end in ranges)
+    if progress:
+        progress(done_bytes, total_size)
+
+    def work(rng):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        start, end = rng
+        write_at(dest_path, start, fetch_with_retries(fetch_range, start, end, retries))
+        return rng
+
+    completed, error = [], None
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ranged-dl") as pool:
+        futures = [pool.submit(work, rng) for rng in ranges]
+        try:
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                try:
+                    rng = future.result()
+                except Exception as e:
+                    # Stop queued ranges but keep reporting the ones already in flight
+                    if error is None:
+                        error = e
+                        for pending in futures:
+                            pending.cancel()
+                    continue
+                if rng is None:
+                    continue
+                completed.append(rng)
+                done_bytes += rng[1] - rng[0]
+                if on_range_done:
+                    on_range_done(rng)
+                if progress:
+                    progress(done_bytes, total_size)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    if error is not None:
+        raise error
+    return completed
+
+
+def md5_file(path, block_size=8 * 1024 * 1024):
+    digest = hashlib.md5()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class DownloadState:
+    """Completed byte ranges of a partial download, persisted as JSON next to it.
+
+    ``identity`` (file id, size, checksum) is stored with the ranges; a state
+    file written for a different identity is discarded on load, so a changed
+    Drive file is never stitched onto stale bytes.
+    """
+
+    def __init__(self, state_path, identity, completed=None):
+        self.state_path = state_path
+        self.identity = identity
+        self.completed = merge_intervals(completed or [])
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, state_path, identity):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError):
+            return cls(state_path, identity)
+        if saved.get('identity') != identity:
+            return cls(state_path, identity)
+        return cls(state_path, identity, saved.get('completed', []))
+
+    def covers(self, start, end):
+        """True if ``[start, end)`` lies entirely inside one completed interval."""
+        index = bisect.bisect_right([interval[0] for interval in self.completed], start) - 1
+        return index >= 0 and self.completed[index][1] >= end
+
+    @property
+    def completed_bytes(self):
+        return sum(end - start for start, end in self.completed)
+
+    def mark_done(self, rng):
+        with self._lock:
+            self.completed = merge_intervals(self.completed + [list(rng)])
+            self.save()
+
+    def save(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump({'identity': self.identity, 'completed': self.completed}, fh)
+        os.replace(tmp_path, self.state_path)
+
+    def missing_ranges(self, total_size, range_size=DEFAULT_RANGE_SIZE):
+        """Ranges of at most ``range_size`` bytes covering everything not yet completed."""
+        gaps, cursor = [], 0
+        for start, end in self.completed + [[total_size, total_size]]:
+            if start > cursor:
+                gaps.append((cursor, start))
+            cursor = max(cursor, end)
+        return [(start, min(start + range_size, gap_end))
+                for gap_start, gap_end in gaps
+                for start in range(gap_start, gap_end, range_size)]
+
+    def discard(self):
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.completed = []
+
+
+def resumable_download(fetch_range, dest_path, total_size, identity, md5_checksum=None,
+                       workers=DEFAULT_WORKERS, range_size=DEFAULT_RANGE_SIZE, retries=3,
+                       progress=None, on_range_done=None, cancel_event=None):
+    """Ranged download that survives retries and restarts.
+
+    Bytes land in ``dest_path + '.part'`` and completed ranges are recorded in
+    ``dest_path + '.part.json'``; a later call with the same ``identity`` only
+    requests the missing ranges. Once complete the file is verified against
+    ``md5_checksum`` (when given) and renamed to ``dest_path``.
+    """
+    part_path = dest_path + '.part'
+    state = DownloadState.load(part_path + '.json', identity)
+    if state.completed and (not os.path.exists(part_path) or os.path.getsize(part_path) != total_size):
+        state.discard()
+
+    def record(rng):
+        state.mark_done(rng)
+        if on_range_done:
+            on_range_done(rng)
+
+    download_ranges(fetch_range, part_path, total_size, ranges=state.missing_ranges(total_size, range_size),
+                    workers=workers, retries=retries, progress=progress, on_range_done=record,
+                    cancel_event=cancel_event)
+    if state.completed_bytes != total_size:
+        raise RangeDownloadError(f"Download incomplete: {state.completed_bytes} of {total_size} bytes")
+
+    if md5_checksum and md5_file(part_path) != md5_checksum:
+        state.discard()
+        os.remove(part_path)
+        raise ChecksumMismatchError(f"MD5 mismatch for {dest_path}; partial data discarded")
+
+    os.replace(part_path, dest_path)
+    state.discard()
+    return dest_path
+
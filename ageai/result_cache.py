@@ -0,0 +1,99 @@
+"""Filter results shared by every session viewing the same dataset.
+
+Each rerun re-applies the sidebar filters and the search, even when the
+user only turned a page, and users browsing one dataset often land on the
+same combinations. ``ResultCache`` keeps the rows a ``Selection``
+(``ageai.facet_index``) passed, keyed by the dataset's version and the
+selection's canonical key, so a filter state seen before costs a lookup.
+A result is kept as int32 row positions or, when that is smaller, as the
+packed bitmap. The cross-filtered option counts of each filter
+(``Selection.facet_counts``) are kept the same way, keyed by the filters
+they depend on. Least recently used entries are evicted once they hold
+more than ``max_bytes``. The cache is thread-safe, so one instance can
+serve every session of the server process.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, its size in bytes), oldest first
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+
+    def positions(self, version, selection):
+        """Row positions passing ``selection`` over dataset ``version``, evaluated only on a miss.
+
+        Selections without filters or without a key are evaluated every time.
+        The positions returned on a hit are shared: read-only.
+        """
+        key = selection.key if selection.active else None
+        if key is None:
+            return selection.positions()
+        entry = self._get(('rows', version, key))
+        if entry is not None:
+            rows, stored = entry
+            return stored if stored.dtype == np.int32 else np.flatnonzero(np.unpackbits(stored, count=rows))
+        positions = selection.positions()
+        rows = selection.index.rows
+        # A bitmap costs a bit per row, positions four bytes per row passing
+        stored = selection.bits.copy() if 32 * len(positions) > rows else positions.astype(np.int32)
+        stored.setflags(write=False)
+        self._put(('rows', version, key), (rows, stored), stored.nbytes)
+        return positions
+
+    def facet_counts(self, version, selection, columns):
+        """``selection.facet_counts(columns)``, each column's counts from the cache when its other filters were seen before.
+
+        The dicts returned are shared: do not modify them.
+        """
+        counts, missing = {}, []
+        for column in columns:
+            key = selection.key_without(column)
+            cached = self._get(('counts', version, column, key)) if key is not None else None
+            if cached is None:
+                missing.append(column)
+            else:
+                counts[column] = cached
+        if missing:  # evaluating the filters is what a full hit saves
+            for column, column_counts in selection.facet_counts(missing).items():
+                counts[column] = column_counts
+                key = selection.key_without(column)
+                if key is not None:  # about a hundred bytes per value: the dict slot, the int and the share of its string
+                    self._put(('counts', version, column, key), column_counts, 100 * len(column_counts) + 64)
+        return {column: counts[column] for column in columns}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                return  # another session evaluated the same filters meanwhile
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.nbytes}
@@ -0,0 +1,121 @@
+"""Load-time schema step for the metadata frame.
+
+Columns such as ``gender``, ``race``, ``age_group`` or ``shot`` hold a handful
+of distinct strings repeated over every row. ``optimize_dtypes`` stores them
+as pandas ``category`` (one small integer code per row) and normalises case
+once at load. ``isin_str`` and ``str_value_counts`` then filter and count on
+the codes, with the same results as the ``astype(str)`` comparisons the
+dashboards used on the full column. Missing cells read ``'nan'`` there,
+categorical or not, so they match and count as that string.
+"""
+import numpy as np
+import pandas as pd
+
+CATEGORY_MAX_RATIO = 0.5  # at most this many distinct values per non-null row
+MISSING_TEXT = 'nan'  # what astype(str) makes of a missing cell
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def is_categorical(series):
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def holds_lists(series):
+    """True if any cell is an actual list rather than a string (categoricals cannot hold lists)."""
+    if is_categorical(series):
+        return False
+    return bool(series.map(lambda value: isinstance(value, list)).any())
+
+
+def lowercase(series):
+    """``series`` with its strings lowercased; missing values stay missing.
+
+    A categorical column stays categorical: its categories are lowercased
+    (merging those that differ only in case) and its codes remapped.
+    """
+    if is_categorical(series):
+        lowered, categories = pd.factorize(series.cat.categories.astype(str).str.lower(), sort=True)
+        codes = series.cat.codes.to_numpy()
+        codes = np.where(codes < 0, -1, lowered[codes])
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+    present = series.notna()
+    lowered = series.copy()
+    lowered[present] = series[present].astype(str).str.lower()
+    return lowered
+
+
+def optimize_dtypes(df, lowercase_columns=(), max_ratio=CATEGORY_MAX_RATIO):
+    """Return ``(df, report)`` with low-cardinality columns as ``category``.
+
+    Object and integer columns qualify when they have at most ``max_ratio``
+    distinct values per non-null row. Columns already categorical (read from
+    the columnar cache) keep their dtype and lose the categories no row uses
+    any more. ``lowercase_columns`` are lowercased first. ``report`` holds the
+    memory use before and after and the categorical columns.
+    """
+    report = {'before_bytes': memory_bytes(df), 'categorical': []}
+    df = df.copy(deep=False)
+    for column in lowercase_columns:
+        if column in df.columns:
+            df[column] = lowercase(df[column])
+    for column in df.columns:
+        series = df[column]
+        if is_categorical(series):
+            df[column] = series.cat.remove_unused_categories()  # dropped rows may have held the only ones
+            report['categorical'].append(column)
+            continue
+        if not (series.dtype == object or pd.api.types.is_integer_dtype(series.dtype)):
+            continue
+        non_null = series.count()
+        try:
+            if not non_null or series.nunique() > max_ratio * non_null:
+                continue
+            df[column] = series.astype('category')
+        except TypeError:
+            continue  # unhashable cells (actual lists)
+        report['categorical'].append(column)
+    report['after_bytes'] = memory_bytes(df)
+    return df, report
+
+
+def isin_str(series, values, case=True):
+    """Boolean mask equal to ``series.astype(str).isin(values)``; ``case=False`` ignores case.
+
+    On a categorical column only the categories are converted and compared,
+    and rows are matched by their integer codes; missing rows (code -1) match
+    ``'nan'``, as ``astype(str)`` spells them.
+    """
+    values = [str(value) for value in values]
+    if not case:
+        values = [value.lower() for value in values]
+    if is_categorical(series):
+        categories = series.cat.categories.astype(str)
+        if not case:
+            categories = categories.str.lower()
+        wanted = np.flatnonzero(categories.isin(values))
+        codes = series.cat.codes.to_numpy()
+        matched = np.isin(codes, wanted)
+        if MISSING_TEXT in values:
+            matched |= codes < 0
+        return pd.Series(matched, index=series.index)
+    text = series.astype(str)
+    return (text if case else text.str.lower()).isin(values)
+
+
+def str_value_counts(series):
+    """``{str(value): rows}``, as counting ``series.astype(str) == value`` for each value (missing cells as ``'nan'``)."""
+    if is_categorical(series):
+        codes = series.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+        found = {}
+        for category, count in zip(series.cat.categories, counts):
+            if count:
+                found[str(category)] = found.get(str(category), 0) + int(count)
+        missing = int((codes < 0).sum())
+        if missing:
+            found[MISSING_TEXT] = found.get(MISSING_TEXT, 0) + missing
+        return found
+    return {value: int(count) for value, count in series.astype(str).value_counts().items()}
@@ -0,0 +1,348 @@
+"""Use a ZIP archive while it is still downloading.
+
+``StreamingArchive`` downloads the archive with ranged requests into its final
+path, but in an order that makes it useful early: first the tail (end of
+central directory record and the central directory itself), then the byte span
+of the metadata CSV, then everything else front to back. Each member's span is
+known from the central directory, so a member becomes readable the moment the
+last range overlapping it lands, long before the whole file is there.
+
+The download runs on a background thread owned by the archive object; the
+dashboards keep that object in ``st.session_state`` and poll it. Completed
+ranges are persisted with ``DownloadState``, so an interrupted stream resumes.
+A stream that fails is kept apart from the running ones: the members it
+finished stay readable, and the others report its error instead of waiting.
+"""
+import bisect
+import io
+import os
+import struct
+import threading
+import zipfile
+from dataclasses import dataclass
+
+from ageai.ranged_download import (DEFAULT_RANGE_SIZE, DEFAULT_WORKERS, ChecksumMismatchError,
+                                   DownloadState, RangeDownloadError, download_ranges, md5_file,
+                                   preallocate, write_at)
+from ageai.zip_store import (LOCAL_HEADER_LENGTHS, LOCAL_HEADER_SIZE, LOCAL_HEADER_SIGNATURE,
+                             MemberPending, MemberUnavailable, ZipMember, forget_store, open_store)
+
+TAIL_SIZE = 64 * 1024 + 22  # largest possible ZIP comment plus the end of central directory record
+EOCD_SIGNATURE = b'PK\x05\x06'
+EOCD = struct.Struct('<4s4H2LH')
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+ZIP64_EOCD = struct.Struct('<4sQ2H2L4Q')
+
+
+def central_directory_span(tail, tail_offset, read_at):
+    """``(offset, size)`` of the central directory, from the archive's last bytes.
+
+    ``tail`` holds the file from ``tail_offset`` to the end; ``read_at(offset,
+    length)`` fetches anything else needed (the ZIP64 record may lie before it).
+    """
+    eocd_at = tail.rfind(EOCD_SIGNATURE)
+    if eocd_at < 0 or eocd_at + EOCD.size > len(tail):
+        raise zipfile.BadZipFile("End of central directory record not found")
+    _, _, _, _, _, cd_size, cd_offset, _ = EOCD.unpack_from(tail, eocd_at)
+    if cd_offset != 0xFFFFFFFF and cd_size != 0xFFFFFFFF:
+        return cd_offset, cd_size
+    locator_at = eocd_at - ZIP64_LOCATOR.size
+    locator = tail[locator_at:eocd_at] if locator_at >= 0 else read_at(tail_offset + locator_at, ZIP64_LOCATOR.size)
+    signature, _, zip64_eocd_offset, _ = ZIP64_LOCATOR.unpack(locator)
+    if signature != ZIP64_LOCATOR_SIGNATURE:
+        raise zipfile.BadZipFile("ZIP64 end of central directory locator not found")
+    record = read_at(zip64_eocd_offset, ZIP64_EOCD.size)
+    fields = ZIP64_EOCD.unpack(record)
+    return fields[9], fields[8]
+
+
+@dataclass(frozen=True)
+class StreamedMember:
+    """Picklable handle to a member of an archive that may still be streaming in."""
+    zip_path: str
+    name: str
+
+    @property
+    def basename(self):
+        return self.name.rsplit('/', 1)[-1]
+
+    def read(self):
+        stream = active_stream(self.zip_path)
+        if stream is None:
+            stream = failed_stream(self.zip_path)
+            if stream is None:
+                return open_store(self.zip_path).read_member(self.name)
+        member = stream.member(self.name)
+        if member is None:
+            if stream.error is not None:
+                raise MemberUnavailable(f"{self.name}: {stream.error}")
+            raise MemberPending(self.name)
+        return member.read()
+
+    @property
+    def pending(self):
+        stream = active_stream(self.zip_path)
+        return stream is not None and stream.member(self.name) is None
+
+    @property
+    def error(self):
+        """The error of the failed stream this member never arrived from, else None."""
+        stream = failed_stream(self.zip_path)
+        if stream is None or stream.member(self.name) is not None:
+            return None
+        return stream.error
+
+
+class StreamingArchive:
+    """Background ranged download of a ZIP that exposes members as they complete.
+
+    ``fetch_range`` is the same callable ``download_ranges`` takes;
+    ``csv_member`` is the name (or list of names) of the members to fetch
+    first, or a callable that picks them from the list of member names. Wait
+    on ``directory_ready`` before listing members and on ``csv_ready`` before
+    reading them; ``done`` is set when the thread exits, with
+    ``error`` holding the exception if it failed. ``on_complete(archive)`` runs
+    on the download thread once the verified archive is in place, after
+    ``done`` is set and the stream has left the registry.
+    """
+
+    def __init__(self, fetch_range, dest_path, total_size, identity, md5_checksum=None,
+                 csv_member=None, workers=DEFAULT_WORKERS, range_size=DEFAULT_RANGE_SIZE,
+                 retries=3, on_complete=None):
+        self.fetch_range = fetch_range
+        self.dest_path = os.path.abspath(dest_path)
+        self.total_size = total_size
+        self.md5_checksum = md5_checksum
+        self.csv_member = csv_member
+        self.workers = workers
+        self.range_size = range_size
+        self.retries = retries
+        self.on_complete = on_complete
+        self.state = DownloadState.load(self.dest_path + '.part.json', identity)
+
+        self.directory_ready = threading.Event()
+        self.csv_ready = threading.Event()
+        self.done = threading.Event()
+        self.cancel_event = threading.Event()
+        self.error = None
+        self.names = []
+        self._spans = {}  # member name -> (start, end) of local header plus data
+        self._span_starts = []
+        self._span_names = []
+        self._available = {}
+        self._thread = None
+
+    # -- status -----------------------------------------------------------
+    @property
+    def downloaded_bytes(self):
+        return self.state.completed_bytes
+
+    @property
+    def finished(self):
+        return self.done.is_set() and self.error is None
+
+    @property
+    def available_count(self):
+        return len(self._available)
+
+    def member(self, name):
+        """``ZipMember`` for ``name`` once its bytes are on disk, otherwise None."""
+        return self._available.get(name)
+
+    def open_member(self, name):
+        member = self.member(name)
+        if member is None:
+            raise MemberPending(name)
+        return io.BytesIO(member.read())
+
+    def handles(self, prefix, extensions):
+        """``{file name: StreamedMember}`` for the files directly inside ``prefix``."""
+        prefix = prefix.rstrip('/') + '/'
+        found = {}
+        for name in self.names:
+            rest = name[len(prefix):]
+            if name.startswith(prefix) and rest and '/' not in rest and rest.lower().endswith(extensions):
+                found[rest] = StreamedMember(self.dest_path, name)
+        return found
+
+    def subfolders(self, prefix):
+        prefix = prefix.rstrip('/') + '/'
+        return sorted({name[len(prefix):].split('/', 1)[0] for name in self.names
+                       if name.startswith(prefix) and '/' in name[len(prefix):]})
+
+    # -- lifecycle --------------------------------------------------------
+    def start(self):
+        with _streams_lock:
+            _claim(self)
+        return self._launch()
+
+    def _launch(self):
+        self._thread = threading.Thread(target=self._run, name="archive-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def wait_for_csv(self, timeout=None, poll=0.25, progress=None):
+        """Block until the CSV member is readable; ``progress(done, total)`` runs between polls.
+
+        Raises the download error if the stream failed first.
+        """
+        while not self.csv_ready.wait(poll):
+            if self.done.is_set():
+                break
+            if progress:
+                progress(self.downloaded_bytes, self.total_size)
+            if timeout is not None:
+                timeout -= poll
+                if timeout <= 0:
+                    break
+        if self.error is not None:
+            raise self.error
+        return self.csv_ready.is_set()
+
+    def _run(self):
+        try:
+            if self.state.completed and (not os.path.exists(self.dest_path)
+                                         or os.path.getsize(self.dest_path) != self.total_size):
+                self.state.discard()
+            preallocate(self.dest_path, self.total_size)
+            self._read_directory()
+            first = [self.csv_member] if isinstance(self.csv_member, str) else self.csv_member or []
+            self._download([rng for name in first if name in self._spans
+                            for rng in self._ranges_within(*self._spans[name])])
+            self.csv_ready.set()
+            self._download(self.state.missing_ranges(self.total_size, self.range_size))
+            if self.state.completed_bytes != self.total_size:
+                raise RangeDownloadError(f"Download incomplete: {self.state.completed_bytes} of {self.total_size} bytes")
+            if self.md5_checksum and md5_file(self.dest_path) != self.md5_checksum:
+                self.state.discard()
+                raise ChecksumMismatchError(f"MD5 mismatch for {self.dest_path}; partial data discarded")
+            self.state.discard()
+            forget_store(self.dest_path)  # any store opened mid-stream saw missing members
+        except Exception as e:
+            self.error = e
+        finally:
+            # Set before leaving the registry, so a member never reads the file while it is incomplete
+            self.done.set()
+            _unregister(self)
+        if self.error is None and self.on_complete:
+            self.on_complete(self)  # sees the stream done and out of the registry
+
+    def _fetch_into_file(self, start, end):
+        if end > start and not self.state.covers(start, end):
+            write_at(self.dest_path, start, self.fetch_range(start, end))
+            self.state.mark_done((start, end))
+        with open(self.dest_path, 'rb') as fh:
+            fh.seek(start)
+            return fh.read(end - start)
+
+    def _read_directory(self):
+        tail_start = max(0, self.total_size - TAIL_SIZE)
+        tail = self._fetch_into_file(tail_start, self.total_size)
+        cd_offset, _ = central_directory_span(tail, tail_start, self._fetch_into_file)
+        if cd_offset < tail_start:
+            self._download(self._ranges_within(cd_offset, tail_start))
+
+        # zipfile only needs the central directory, which is now on disk
+        with zipfile.ZipFile(self.dest_path) as zf:
+            infos = sorted((info for info in zf.infolist() if not info.is_dir()),
+                           key=lambda info: info.header_offset)
+        for info, following in zip(infos, infos[1:] + [None]):
+            end = following.header_offset if following is not None else cd_offset
+            self._spans[info.filename] = (info.header_offset, end)
+        self._infos = {info.filename: info for info in infos}
+        self._span_starts = [self._spans[info.filename][0] for info in infos]
+        self._span_names = [info.filename for info in infos]
+        self.names = [info.filename for info in infos]
+        if self.csv_member is not None and callable(self.csv_member):
+            self.csv_member = self.csv_member(self.names)
+        for name, (start, end) in self._spans.items():
+            if self.state.covers(start, end):
+                self._make_available(name)
+        self.directory_ready.set()
+
+    def _ranges_within(self, start, end):
+        return [(max(start, rng_start), min(end, rng_end))
+                for rng_start, rng_end in self.state.missing_ranges(self.total_size, self.range_size)
+                if rng_start < end and rng_end > start]
+
+    def _download(self, ranges):
+        if ranges:
+            download_ranges(self.fetch_range, self.dest_path, self.total_size, ranges=ranges,
+                            workers=self.workers, retries=self.retries,
+                            on_range_done=self._range_done, cancel_event=self.cancel_event)
+        if self.cancel_event.is_set():
+            raise RangeDownloadError("Download cancelled")
+
+    def _range_done(self, rng):
+        self.state.mark_done(rng)
+        start, end = rng
+        first = max(0, bisect.bisect_right(self._span_starts, start) - 1)
+        for index in range(first, len(self._span_names)):
+            if self._span_starts[index] >= end:
+                break
+            name = self._span_names[index]
+            if name not in self._available and self.state.covers(*self._spans[name]):
+                self._make_available(name)
+
+    def _make_available(self, name):
+        info = self._infos[name]
+        with open(self.dest_path, 'rb') as fh:
+            fh.seek(info.header_offset)
+            header = fh.read(LOCAL_HEADER_SIZE)
+        if header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local header for {name}")
+        name_len, extra_len = LOCAL_HEADER_LENGTHS.unpack_from(header, 26)
+        self._available[name] = ZipMember(
+            self.dest_path, name, info.header_offset + LOCAL_HEADER_SIZE + name_len + extra_len,
+            info.compress_size, info.file_size, info.compress_type, bool(info.flag_bits & 0x1))
+
+
+_streams = {}  # dest path -> the stream writing it
+_failed = {}  # dest path -> the last stream that failed on it, until another one starts
+_streams_lock = threading.Lock()
+
+
+def _claim(stream):
+    """Make ``stream`` the one writing its path; call with ``_streams_lock`` held."""
+    previous = _streams.get(stream.dest_path)
+    if previous is not None and previous is not stream:
+        previous.cancel()  # another file for the same path: stop writing the old one
+    _streams[stream.dest_path] = stream
+    _failed.pop(stream.dest_path, None)
+
+
+def _unregister(stream):
+    with _streams_lock:
+        if _streams.get(stream.dest_path) is stream:
+            del _streams[stream.dest_path]
+            if stream.error is not None:
+                _failed[stream.dest_path] = stream
+
+
+def active_stream(zip_path):
+    """The in-flight ``StreamingArchive`` writing ``zip_path``, if any."""
+    return _streams.get(os.path.abspath(zip_path))
+
+
+def failed_stream(zip_path):
+    """The stream that last failed writing ``zip_path``, unless another has started since."""
+    return _failed.get(os.path.abspath(zip_path))
+
+
+def start_stream(fetch_range, dest_path, total_size, identity, **kwargs):
+    """Start streaming ``dest_path``, or join the stream another session already started for it.
+
+    The check and the registration happen under one lock, so concurrent
+    calls for the same file start a single download.
+    """
+    with _streams_lock:
+        existing = _streams.get(os.path.abspath(dest_path))
+        if existing is not None and existing.state.identity == identity and not existing.done.is_set():
+            return existing
+        stream = StreamingArchive(fetch_range, dest_path, total_size, identity, **kwargs)
+        _claim(stream)
+    return stream._launch()
@@ -0,0 +1,328 @@
+"""Trigram index for the sidebar text search, built per column on first use.
+
+The search box matched ``series.astype(str).str.contains(term, case=False)``
+against every row on every rerun. ``TrigramIndex`` keeps, for each distinct
+cell text of a column, the three-character sequences of its case key
+(``fold``) as CSR postings (``offsets`` into ``docs`` per trigram ``key``).
+A term of three or more characters then only has to be checked against the
+texts holding all of its trigrams, and each distinct text is checked once
+however many rows share it.
+
+Two characters match each other under the case-insensitive regular
+expression ``str.contains`` compiles exactly when their case keys are equal,
+so a plain-text term is in a text exactly when its key is in the text's key:
+a substring test instead of a regex search. Terms using regex syntax
+(``str.contains`` treats the term as a pattern), and the rare texts and terms
+whose keys do not line up character for character (``ß`` becomes ``SS``),
+are checked with that regular expression itself. Either way the rows found
+are exactly the ones the scan found.
+
+``SearchIndex`` builds a column's index the first time it is searched and,
+given a directory (the dataset's cache entry), writes it there so the next
+load of the same dataset reads it back instead. A search of every column at
+once (``contains_any``) ORs the columns' matches: low-cardinality columns
+hold a handful of distinct texts, so this replaces building a Series per
+row with a few lookups per column.
+
+Typing reruns the search once per character. ``SearchIndex`` keeps each
+column's last term and the texts it matched: a term that contains the last
+one can only match among those, so only they are checked, and an unchanged
+term is not checked at all. Any other term (a deleted character, a
+pattern) is evaluated in full.
+
+A search given the rows still in play after the other filters (``rows``)
+checks only the texts those rows hold. The last term's matches are then
+known only among the texts it checked: the next term narrows from them
+there, and checks the texts that came into play since in full.
+"""
+import functools
+import hashlib
+import io
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+
+SEARCH_DIR = "search"  # inside a dataset cache entry, one .npz per indexed column
+INDEX_VERSION = 2  # stored indexes of another version are rebuilt
+REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+def is_literal(term):
+    """True if ``str.contains`` would match ``term`` as plain text rather than as a pattern."""
+    return not REGEX_METACHARACTERS.intersection(term)
+
+
+def fold(text):
+    """Case key of ``text``: characters the regex engine matches to each other under IGNORECASE get the same key.
+
+    Mostly the uppercase; ``İ`` (U+0130, which lowercases to two characters)
+    is taken as the ``i`` it matches, and ``ſ`` or ``ı`` meet ``S`` and ``I``
+    through their uppercase.
+    """
+    return text.replace('\u0130', 'i').lower().upper()
+
+
+@functools.lru_cache(maxsize=None)
+def _irregular_pattern():
+    # The hundred-odd characters whose key is several characters long (ß -> SS, ligatures)
+    chars = [chr(code) for code in range(0x110000) if not 0xD800 <= code < 0xE000 and len(fold(chr(code))) != 1]
+    return re.compile(f"[{''.join(re.escape(char) for char in chars)}]")
+
+
+def is_regular(text):
+    """True if every character of ``text`` has a one-character key, so keys line up with the characters."""
+    return text.isascii() or _irregular_pattern().search(text) is None
+
+
+def refines(term, previous):
+    """True if every text containing ``term`` (ignoring case, as ``str.contains`` does) also contains ``previous``."""
+    return (is_literal(term) and is_literal(previous) and is_regular(term) and is_regular(previous)
+            and fold(previous) in fold(term))
+
+
+def cell_texts(series):
+    """The text ``astype(str)`` gives every cell (missing values as ``'nan'``, like the search did)."""
+    return series.astype(str).to_numpy(dtype=object)
+
+
+def fingerprint(texts):
+    """Short digest of a column's texts in row order, so a stored index is never used for other rows."""
+    return hashlib.sha1(pd.util.hash_array(texts).tobytes()).hexdigest()[:16]
+
+
+def _covers(checked, needed):
+    """Whether the texts ``checked`` include those ``needed`` (boolean arrays; None: every text)."""
+    if checked is None:
+        return True
+    return needed is not None and not (needed & ~checked).any()
+
+
+class TrigramIndex:
+    """Distinct texts of one column, the text of every row, and the texts holding each trigram."""
+
+    def __init__(self, texts, text_ids, alphabet, keys, offsets, docs):
+        self.texts = texts  # distinct cell texts, as astype(str) gives them
+        self.text_ids = text_ids.astype(np.int32, copy=False)  # text of every row
+        self.alphabet = {int(char): code for code, char in enumerate(alphabet)}  # key code point -> letter code
+        self.keys = keys  # sorted trigram keys ((a * A + b) * A + c over letter codes)
+        self.offsets = offsets  # docs[offsets[k]:offsets[k + 1]] hold trigram keys[k], ascending
+        self.docs = docs
+        self._folded = None  # case keys of the texts and which of them line up, kept from the build or made on first use
+
+    @classmethod
+    def build(cls, texts_or_series):
+        row_texts = texts_or_series if isinstance(texts_or_series, np.ndarray) else cell_texts(texts_or_series)
+        text_ids, texts = pd.factorize(row_texts)
+        folded = [fold(text) for text in texts]  # an irregular text's extra characters only add trigrams
+        lengths = np.fromiter((len(text) for text in folded), dtype=np.int64, count=len(folded))
+        # Every character of every text, as letter codes, in one array
+        code_points = np.frombuffer(''.join(folded).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        letters, alphabet = pd.factorize(code_points)
+        size = max(len(alphabet), 1)
+        letters = letters.astype(np.int64)
+        doc_of = np.repeat(np.arange(len(folded), dtype=np.int32), lengths)
+        # Trigram at each position, kept where its three characters lie in the same text
+        starts = np.flatnonzero(doc_of[:-2] == doc_of[2:]) if len(letters) > 2 else np.zeros(0, dtype=np.int64)
+        trigram_ids, keys = pd.factorize((letters[starts] * size + letters[starts + 1]) * size + letters[starts + 2],
+                                         sort=True)
+        # Group by trigram with a stable sort (a radix sort while the ids fit in 16 bits), so texts stay
+        # ascending within each trigram; then drop the repeats of a trigram within one text
+        order = np.argsort(trigram_ids.astype(np.uint16 if len(keys) <= 1 << 16 else np.int64), kind='stable')
+        trigram_ids, docs = trigram_ids[order], doc_of[starts][order]
+        first = np.ones(len(docs), dtype=bool)
+        first[1:] = (trigram_ids[1:] != trigram_ids[:-1]) | (docs[1:] != docs[:-1])
+        trigram_ids, docs = trigram_ids[first], docs[first]
+        offsets = np.searchsorted(trigram_ids, np.arange(len(keys) + 1)).astype(np.int64)
+        index = cls(np.asarray(texts, dtype=object), text_ids, np.asarray(alphabet, dtype=np.uint32),
+                    np.asarray(keys, dtype=np.int64), offsets, docs)
+        index._folded = folded, np.fromiter(map(is_regular, texts), dtype=bool, count=len(texts))
+        return index
+
+    @property
+    def rows(self):
+        return len(self.text_ids)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.offsets.nbytes + self.docs.nbytes + self.text_ids.nbytes
+
+    def folded(self):
+        """``(keys, regular)``: the case key of every text and whether it lines up with the text."""
+        if self._folded is None:
+            self._folded = ([fold(text) for text in self.texts],
+                            np.fromiter(map(is_regular, self.texts), dtype=bool, count=len(self.texts)))
+        return self._folded
+
+    def candidates(self, term):
+        """Texts that can contain ``term`` ignoring case, ascending; None when every text can."""
+        if not (is_literal(term) and is_regular(term)) or len(term) < 3:
+            return None
+        letters = [self.alphabet.get(ord(char)) for char in fold(term)]
+        if None in letters:
+            return np.zeros(0, dtype=np.int32)  # a character no text holds
+        size = max(len(self.alphabet), 1)
+        wanted = np.unique([(a * size + b) * size + c for a, b, c in zip(letters, letters[1:], letters[2:])])
+        slots = np.searchsorted(self.keys, wanted)
+        if (slots >= len(self.keys)).any() or (self.keys[slots] != wanted).any():
+            return np.zeros(0, dtype=np.int32)  # a trigram no text holds
+        postings = sorted((self.docs[self.offsets[slot]:self.offsets[slot + 1]] for slot in slots), key=len)
+        found = postings[0]
+        for docs in postings[1:]:
+            if not len(found):
+                break
+            found = np.intersect1d(found, docs, assume_unique=True)
+        return found
+
+    def matching_texts(self, term, within=None):
+        """Boolean array over the distinct texts: which contain ``term``, as ``str.contains`` decides.
+
+        ``within`` (a boolean array over the texts) limits the check to texts
+        known to hold every possible match, such as a shorter term's matches.
+        """
+        regex = re.compile(term, re.IGNORECASE)  # what str.contains compiles; a bad pattern raises the same error
+        if within is not None:
+            candidates = np.flatnonzero(within)  # already narrower than a trigram lookup, as a rule
+        else:
+            candidates = self.candidates(term)
+            if candidates is None:
+                candidates = np.arange(len(self.texts))
+        matched = np.zeros(len(self.texts), dtype=bool)
+        if is_literal(term) and is_regular(term):
+            # Plain text: a substring test on the case keys, except in texts whose keys do not line up
+            key = fold(term)
+            keys, regular = self.folded()
+            lined_up = regular[candidates]
+            plain = candidates[lined_up]
+            matched[plain] = np.fromiter((key in keys[doc] for doc in plain.tolist()), dtype=bool, count=len(plain))
+            candidates = candidates[~lined_up]
+        matched[[doc for doc in candidates.tolist() if regex.search(self.texts[doc])]] = True
+        return matched
+
+    def contains(self, term):
+        """Boolean array over rows, equal to ``astype(str).str.contains(term, case=False, na=False)``."""
+        return self.matching_texts(term)[self.text_ids]
+
+    def to_bytes(self, digest):
+        buffer = io.BytesIO()
+        alphabet = np.array(sorted(self.alphabet, key=self.alphabet.get), dtype=np.uint32)
+        np.savez(buffer, version=np.array(INDEX_VERSION), fingerprint=np.array(digest), texts=np.array(len(self.texts)),
+                 alphabet=alphabet, keys=self.keys, offsets=self.offsets, docs=self.docs)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, row_texts, digest):
+        """The index stored by ``to_bytes`` for these ``row_texts``, or None if it was built from other rows."""
+        with np.load(io.BytesIO(data)) as arrays:
+            if 'version' not in arrays.files or int(arrays['version']) != INDEX_VERSION \
+                    or str(arrays['fingerprint']) != digest:
+                return None
+            text_ids, texts = pd.factorize(row_texts)  # same order as at build time, rows being the same
+            if len(texts) != int(arrays['texts']):
+                return None
+            return cls(np.asarray(texts, dtype=object), text_ids, arrays['alphabet'],
+                       arrays['keys'], arrays['offsets'], arrays['docs'])
+
+
+class SearchIndex:
+    """Trigram indexes of a DataFrame's columns, built on first search and kept in ``directory`` if given."""
+
+    def __init__(self, df, directory=None):
+        self.df = df
+        self.directory = directory
+        self.indexes = {}
+        self.last = {}  # column -> (term, matching texts, texts checked or None for all) of its last search
+
+    def path(self, column):
+        return os.path.join(self.directory, SEARCH_DIR, re.sub(r'[^A-Za-z0-9_.-]', '_', str(column)) + '.npz')
+
+    def column(self, column):
+        """The ``TrigramIndex`` of ``column``: in memory, else read from ``directory``, else built (and stored)."""
+        if column in self.indexes:
+            return self.indexes[column]
+        row_texts = cell_texts(self.df[column])
+        digest = fingerprint(row_texts)
+        index = None
+        if self.directory and os.path.exists(self.path(column)):
+            try:
+                with open(self.path(column), 'rb') as fh:
+                    index = TrigramIndex.from_bytes(fh.read(), row_texts, digest)
+            except (OSError, ValueError, KeyError):
+                index = None  # truncated or foreign file: rebuild it
+        if index is None:
+            index = TrigramIndex.build(row_texts)
+            if self.directory:
+                self._store(column, index, digest)
+        self.indexes[column] = index
+        return index
+
+    def _store(self, column, index, digest):
+        path = self.path(column)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as fh:
+                fh.write(index.to_bytes(digest))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # read-only or evicted cache entry: the index still serves this session
+
+    def matching_texts(self, column, term, rows=None):
+        """``(index, matched)``: the column's ``TrigramIndex`` and which of its texts hold ``term``.
+
+        Given ``rows`` (positions), only the texts of those rows are checked.
+        """
+        index = self.column(column)
+        in_play = None  # texts to check; None: all of them
+        if rows is not None:
+            in_play = np.zeros(len(index.texts), dtype=bool)
+            in_play[index.text_ids[rows]] = True
+        previous = self.last.get(column)
+        if previous is not None and previous[0] == term and _covers(previous[2], in_play):
+            return index, previous[1]
+        within = None
+        if previous is not None and refines(term, previous[0]):
+            last_term, last_matched, last_checked = previous
+            # Among the texts the last term checked, only its matches can hold this one
+            within = last_matched if in_play is None else last_matched & in_play
+            if last_checked is not None:  # the rest are checked from the trigram candidates
+                unchecked = ~last_checked if in_play is None else in_play & ~last_checked
+                within = within | (unchecked & self._candidates(index, term))
+        elif in_play is not None:
+            within = in_play & self._candidates(index, term)
+        matched = index.matching_texts(term, within)
+        self.last[column] = (term, matched, in_play)
+        return index, matched
+
+    @staticmethod
+    def _candidates(index, term):
+        """Boolean array over the texts: which can hold ``term`` by their trigrams."""
+        candidates = index.candidates(term)
+        if candidates is None:
+            return np.ones(len(index.texts), dtype=bool)
+        flags = np.zeros(len(index.texts), dtype=bool)
+        flags[candidates] = True
+        return flags
+
+    def contains(self, column, term, rows=None):
+        """Boolean array over the frame's rows: ``column`` holds ``term``, ignoring case (see ``TrigramIndex``).
+
+        Given ``rows`` (positions), it is only right at those.
+        """
+        index, matched = self.matching_texts(column, term, rows)
+        return matched[index.text_ids]
+
+    def contains_any(self, term, columns=None, rows=None):
+        """Boolean array over the frame's rows: any of ``columns`` (default: all) holds ``term``.
+
+        The same rows as ``df.apply(lambda row: row.astype(str).str.contains(term, case=False, na=False).any(),
+        axis=1)``, one column's distinct texts at a time. Given ``rows``, it is only right at those.
+        """
+        found = np.zeros(len(self.df), dtype=bool)
+        for column in self.df.columns if columns is None else columns:
+            index, matched = self.matching_texts(column, term, rows)
+            if matched.any():
+                found |= matched[index.text_ids]
+        return found
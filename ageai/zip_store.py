@@ -0,0 +1,313 @@
+"""Serve archive members straight from a memory-mapped ZIP, without extracting it.
+
+``ZipStore`` reads the central directory once and records, for every member,
+where its data starts in the file. Reading a member is then a slice of the
+memory map (plus ``zlib`` for deflated members), which is thread-safe and
+needs no per-read seek on a shared file handle.
+"""
+import io
+import mmap
+import os
+import struct
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import pandas as pd
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+DEFAULT_EXTRACT_WORKERS = 8
+LOCAL_HEADER_SIZE = 30  # fixed part of a local file header
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER_LENGTHS = struct.Struct('<HH')  # file name length, extra field length (offset 26)
+
+
+class MemberPending(Exception):
+    """Raised when reading a member whose bytes have not been downloaded yet."""
+
+
+class MemberUnavailable(Exception):
+    """Raised when reading a member whose download failed before its bytes arrived."""
+
+
+@dataclass(frozen=True)
+class ZipMember:
+    """Picklable handle to one archive member; ``read()`` returns its bytes."""
+    zip_path: str
+    name: str
+    data_offset: int
+    compress_size: int
+    file_size: int
+    compress_type: int
+    encrypted: bool = False
+
+    @property
+    def basename(self):
+        return self.name.rsplit('/', 1)[-1]
+
+    @property
+    def data_end(self):
+        return self.data_offset + self.compress_size
+
+    def read(self):
+        return open_store(self.zip_path).read_member(self)
+
+
+class ZipStore:
+    def __init__(self, zip_path):
+        self.zip_path = os.path.abspath(zip_path)
+        self._fh = open(self.zip_path, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._zip = zipfile.ZipFile(self._fh)
+        self._zip_lock = threading.Lock()
+        self.members = {}
+        for info in self._zip.infolist():
+            member = None if info.is_dir() else self._member_from_info(info)
+            if member is not None:
+                self.members[info.filename] = member
+
+    def _member_from_info(self, info):
+        offset = info.header_offset
+        if self._mm[offset:offset + 4] != LOCAL_HEADER_SIGNATURE:
+            return None  # Not downloaded yet (see ageai.streaming)
+        name_len, extra_len = LOCAL_HEADER_LENGTHS.unpack_from(self._mm, offset + 26)
+        return ZipMember(self.zip_path, info.filename, offset + LOCAL_HEADER_SIZE + name_len + extra_len,
+                         info.compress_size, info.file_size, info.compress_type, bool(info.flag_bits & 0x1))
+
+    def member(self, name):
+        """``ZipMember`` for ``name``; members that were still downloading at open time are resolved late."""
+        member = self.members.get(name)
+        if member is None:
+            member = self._member_from_info(self._zip.getinfo(name))
+            if member is None:
+                raise MemberPending(name)
+            self.members[name] = member
+        return member
+
+    def read_member(self, member):
+        if isinstance(member, str):
+            member = self.member(member)
+        if not member.encrypted:
+            raw = self._mm[member.data_offset:member.data_offset + member.compress_size]
+            if member.compress_type == zipfile.ZIP_STORED:
+                return raw
+            if member.compress_type == zipfile.ZIP_DEFLATED:
+                return zlib.decompress(raw, -zlib.MAX_WBITS)
+        # Other compression methods go through zipfile, which needs the shared handle
+        with self._zip_lock:
+            return self._zip.read(member.name)
+
+    def open_member(self, name):
+        return io.BytesIO(self.read_member(name))
+
+    def namelist(self):
+        """Every member name in the central directory, including members still downloading."""
+        return self._zip.namelist()
+
+    def infolist(self):
+        return self._zip.infolist()
+
+    def listdir(self, prefix):
+        """Names of the immediate files and folders under ``prefix`` (like ``os.listdir``)."""
+        prefix = prefix.rstrip('/') + '/'
+        children = set()
+        for name in self._zip.namelist():
+            if name.startswith(prefix) and len(name) > len(prefix):
+                children.add(name[len(prefix):].split('/', 1)[0])
+        return sorted(children)
+
+    def subfolders(self, prefix):
+        prefix = prefix.rstrip('/') + '/'
+        return sorted({name[len(prefix):].split('/', 1)[0] for name in self._zip.namelist()
+                       if name.startswith(prefix) and '/' in name[len(prefix):]})
+
+    def files_in_folder(self, prefix, extensions=IMAGE_EXTENSIONS):
+        """``{file name: ZipMember}`` for the files directly inside ``prefix``."""
+        prefix = prefix.rstrip('/') + '/'
+        found = {}
+        for name, member in self.members.items():
+            rest = name[len(prefix):]
+            if name.startswith(prefix) and rest and '/' not in rest and rest.lower().endswith(extensions):
+                found[rest] = member
+        return found
+
+    def close(self):
+        self._zip.close()
+        self._mm.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(zip_path):
+    """Shared ``ZipStore`` for ``zip_path``; reopened if the file on disk was replaced."""
+    zip_path = os.path.abspath(zip_path)
+    stat = os.stat(zip_path)
+    # Not the mtime: an archive still being streamed in is written to in place
+    version = (stat.st_dev, stat.st_ino, stat.st_size)
+    with _stores_lock:
+        cached = _stores.get(zip_path)
+        if cached is None or cached[0] != version:
+            cached = _stores[zip_path] = (version, ZipStore(zip_path))
+        return cached[1]
+
+
+def forget_store(zip_path):
+    """Drop the shared store for ``zip_path`` so the next ``open_store`` re-reads it.
+
+    The old store is not closed: other threads may still be reading from it,
+    and its memory map is released once the last of them lets go.
+    """
+    with _stores_lock:
+        _stores.pop(os.path.abspath(zip_path), None)
+
+
+def image_source(image_ref):
+    """What ``st.image`` and the export ZIP need for an image handle.
+
+    Handles are either paths of extracted files or archive members
+    (``ZipMember``, ``ageai.streaming.StreamedMember``). Returns the path, the
+    member's bytes, or None if the image is not available (yet).
+    """
+    if not isinstance(image_ref, str):
+        try:
+            return image_ref.read()
+        except (OSError, KeyError, zlib.error, MemberPending, MemberUnavailable, AttributeError):
+            return None
+    if image_ref and os.path.exists(image_ref):
+        return image_ref
+    return None
+
+
+def image_pending(image_ref):
+    """True for archive members that are still downloading."""
+    return getattr(image_ref, 'pending', False)
+
+
+def image_error(image_ref):
+    """The download error that left an archive member missing, or None."""
+    return getattr(image_ref, 'error', None)
+
+
+def add_image_to_zip(zip_file, image_ref, arcname):
+    """Copy an image handle into an open ``ZipFile``; returns False if it is not available."""
+    source = image_source(image_ref)
+    if source is None:
+        return False
+    if isinstance(source, bytes):
+        zip_file.writestr(arcname, source)
+    else:
+        zip_file.write(source, arcname)
+    return True
+
+
+def find_csv_member(store, folder='data', name_prefix='df_'):
+    """Archive name of the metadata CSV in ``folder``, preferring ``df_*.csv``; None if there is none.
+
+    ``store`` is a ``ZipStore``, the member names of an archive (what a
+    stream knows before any member is on disk) or the root of an extracted
+    copy. The first name in sorted order wins in every case, so a streamed
+    download fetches the very CSV the loaders then read.
+    """
+    if isinstance(store, str):
+        entries = os.listdir(os.path.join(store, folder)) if os.path.isdir(os.path.join(store, folder)) else []
+    elif hasattr(store, 'listdir'):
+        entries = store.listdir(folder)
+    else:
+        prefix = folder.rstrip('/') + '/'
+        entries = [name[len(prefix):] for name in store if name.startswith(prefix) and '/' not in name[len(prefix):]]
+    csv_names = sorted(name for name in entries if name.endswith('.csv'))
+    preferred = [name for name in csv_names if name.startswith(name_prefix)]
+    chosen = preferred or csv_names
+    return f"{folder}/{chosen[0]}" if chosen else None
+
+
+def referenced_image_names(csv_source, columns, transform=None):
+    """File names listed in ``columns`` of the CSV; ``transform`` adds a derived name per value.
+
+    Only the filename columns are parsed, so this stays cheap on wide CSVs.
+    """
+    df = pd.read_csv(csv_source, usecols=lambda col: col in columns, dtype=str)
+    names = set()
+    for col in df.columns:
+        values = df[col].dropna()
+        names.update(values)
+        if transform is not None:
+            names.update(values.map(transform))
+    return names
+
+
+def manifest_members(store, columns, transform=None, folder='data', csv_member=None, extra_prefixes=()):
+    """Members the dashboard actually needs: the CSVs in ``folder`` and the images its rows reference.
+
+    Members under any of ``extra_prefixes`` (e.g. a precomputed bundle) are
+    always included. Returns None when there is no CSV or it has none of
+    ``columns``, in which case callers should fall back to extracting everything.
+    """
+    csv_member = csv_member or find_csv_member(store, folder)
+    if csv_member is None:
+        return None
+    names = referenced_image_names(store.open_member(csv_member), columns, transform)
+    if not names:
+        return None
+    prefix = folder.rstrip('/') + '/'
+    extra_prefixes = tuple(extra.rstrip('/') + '/' for extra in extra_prefixes)
+    selected = []
+    for name, member in store.members.items():
+        if extra_prefixes and name.startswith(extra_prefixes):
+            selected.append(member)
+            continue
+        if not name.startswith(prefix):
+            continue
+        rest = name[len(prefix):]
+        if ('/' not in rest and rest.endswith('.csv')) or member.basename in names:
+            selected.append(member)
+    return selected
+
+
+def safe_target(dest_dir, name):
+    # Same rule as ZipFile.extract: drop absolute and parent-directory components
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return os.path.join(dest_dir, *parts)
+
+
+def extract_members(store, members, dest_dir, workers=DEFAULT_EXTRACT_WORKERS, progress=None):
+    """Write ``members`` under ``dest_dir`` using a thread pool.
+
+    ``progress(done, total)`` is called from the calling thread about once per
+    percent. Returns the number of bytes written.
+    """
+    members = list(members)
+    total = len(members)
+    report_every = max(1, total // 100)
+
+    def work(member):
+        target = safe_target(dest_dir, member.name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as fh:
+            fh.write(store.read_member(member))
+        return member.file_size
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="zip-extract") as pool:
+        futures = [pool.submit(work, member) for member in members]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                written += future.result()
+                if progress and (done % report_every == 0 or done == total):
+                    progress(done, total)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return written
@@ -0,0 +1,125 @@
+"""Benchmark the facet index against the column scans the dashboards ran per filter.
+
+    python -m benchmarks.bench_facet_index --rows 1000000
+    python -m benchmarks.bench_facet_index --counts --rows 1000000
+
+The frame is synthetic: nine categorical columns of 3 to 100 values, an
+integer age and an ``objects`` list column, with one filter of several
+values on each of the ten. Both paths must select the same rows.
+``--counts`` times the cross-filtered option counts of all ten filters
+(each column counted among the rows the other nine leave) against one
+``value_counts`` per column over a boolean mask, and checks both agree.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ageai.facet_index import FacetIndex
+from ageai.list_columns import ListColumn
+from ageai.schema import isin_str, optimize_dtypes
+
+CARDINALITIES = [3, 5, 8, 12, 20, 40, 100, 6, 4]
+OBJECTS = [f"object {index}" for index in range(50)]
+
+
+def synthetic_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({f"column_{index}": rng.choice([f"value {value}" for value in range(values)], rows)
+                       for index, values in enumerate(CARDINALITIES)})
+    df.loc[::7, 'column_1'] = np.nan
+    df['age'] = rng.integers(20, 90, rows)
+    df['objects'] = [repr([str(item) for item in rng.choice(OBJECTS, rng.integers(0, 4), replace=False)])
+                     for _ in range(rows)]
+    return optimize_dtypes(df)[0]
+
+
+def filters():
+    selected = [(f"column_{index}", [f"value {value}" for value in range(max(1, values * 3 // 4))])
+                for index, values in enumerate(CARDINALITIES)]
+    return selected + [('age', [str(age) for age in range(20, 80)]), ('objects', OBJECTS[:10])]
+
+
+def scan(df):
+    filtered_df = df.copy()
+    for column, values in filters():
+        if column == 'objects':
+            pattern = '|'.join(f"'{value}'" for value in values)
+            filtered_df = filtered_df[filtered_df[column].astype(str).str.contains(pattern, na=False, regex=True)]
+        else:
+            filtered_df = filtered_df[filtered_df[column].astype(str).isin(values)]
+    return filtered_df
+
+
+def indexed(df, index):
+    selection = index.select()
+    for column, values in filters():
+        selection.add(column, values)
+    return df.take(selection.positions())
+
+
+def masked_counts(df, list_column):
+    masks = {column: isin_str(df[column], values).to_numpy(dtype=bool) for column, values in filters() if column != 'objects'}
+    wanted = {value.lower() for value in dict(filters())['objects']}
+    holds = np.array([value.lower() in wanted for value in list_column.vocabulary])[list_column.codes]
+    masks['objects'] = np.bincount(list_column.row_ids[holds], minlength=len(df)) > 0
+    counts = {}
+    for column, _ in filters():
+        others = np.logical_and.reduce([mask for other, mask in masks.items() if other != column])
+        if column == 'objects':
+            items = np.bincount(list_column.codes[others[list_column.row_ids]], minlength=len(list_column.vocabulary))
+            counts[column] = {value: int(count) for value, count in zip(list_column.vocabulary, items) if count}
+        else:
+            counts[column] = {value: int(count) for value, count in df[column][others].astype(str).value_counts().items() if count}
+    return counts
+
+
+def indexed_counts(index):
+    selection = index.select()
+    for column, values in filters():
+        selection.add(column, values)
+    return selection.facet_counts([column for column, _ in filters()])
+
+
+def timed(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--counts', action='store_true', help="time the cross-filtered option counts instead")
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.rows)
+    list_column = ListColumn.from_series(df['objects'])
+    started = time.perf_counter()
+    index = FacetIndex.build(df, {'objects': list_column})
+    print(f"{args.rows} rows; index built in {time.perf_counter() - started:.2f}s, "
+          f"{len(index.facets)} columns, {index.nbytes / 1024**2:.1f} MB")
+
+    if args.counts:
+        expected, masked = timed(lambda: masked_counts(df, list_column), args.repeat)
+        counts, indexed_time = timed(lambda: indexed_counts(index), args.repeat)
+        print(f"{'masked value_counts':<20s} {masked * 1000:8.1f} ms\n{'facet bitmaps':<20s} {indexed_time * 1000:8.1f} ms  "
+              f"({sum(len(column_counts) for column_counts in counts.values())} option counts)")
+        assert counts == expected, "facet counts and masked value_counts disagree"
+        print("both give the same counts")
+        return
+
+    for label, run in (("column scans", lambda: scan(df)), ("facet index", lambda: indexed(df, index))):
+        result, elapsed = timed(run, args.repeat)
+        print(f"{label:<14s} {elapsed * 1000:8.1f} ms  ({len(result)} rows)")
+    assert scan(df).index.equals(indexed(df, index).index)
+    print("both select the same rows")
+
+
+if __name__ == '__main__':
+    main()
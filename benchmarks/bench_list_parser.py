@@ -0,0 +1,87 @@
+"""Benchmark the list-literal parser against the eval-based parsing it replaced.
+
+    python -m benchmarks.bench_list_parser --rows 200000
+    python -m benchmarks.bench_list_parser --csv metadata.csv --column objects
+
+Without ``--csv`` the column is synthetic: zero to six objects per row drawn
+from a vocabulary of 60, a few with apostrophes. Every path must give the
+same items as ``ast.literal_eval`` on each cell, which is what ``eval``
+returned for these literals.
+"""
+import argparse
+import ast
+import random
+import time
+
+import pandas as pd
+
+from ageai.list_columns import ListColumn, parse_list_cells
+
+OBJECTS = [f"object {index}" for index in range(57)] + ["person's bag", "walker", "smartphone"]
+
+
+def synthetic_column(rows, seed=0):
+    rng = random.Random(seed)
+    cells = []
+    for _ in range(rows):
+        items = rng.sample(OBJECTS, rng.randint(0, 6))
+        cells.append(repr(items) if rng.random() > 0.02 else None)
+    return pd.Series(cells, dtype=object)
+
+
+def eval_items(value):
+    """What get_unique_list_items did per cell before the parser existed."""
+    if not isinstance(value, str):
+        return []
+    try:
+        evaluated = eval(value)
+    except Exception:
+        return [value]
+    return [str(item) for item in evaluated] if isinstance(evaluated, list) else [value]
+
+
+def literal_items(value):
+    if not isinstance(value, str):
+        return []
+    try:
+        evaluated = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return [value]
+    return [str(item) for item in evaluated] if isinstance(evaluated, list) else [value]
+
+
+def timed(label, fn, baseline=None):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    speedup = f"  x{baseline / elapsed:5.1f}" if baseline else ""
+    print(f"{label:<34s} {elapsed:7.3f}s{speedup}")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--csv', help="read the column from this CSV instead of generating it")
+    parser.add_argument('--column', default='objects')
+    args = parser.parse_args()
+
+    column = pd.read_csv(args.csv, usecols=[args.column])[args.column] if args.csv else synthetic_column(args.rows)
+    print(f"{len(column)} rows, {column.nunique()} distinct cells")
+
+    expected, baseline = timed("eval per cell", lambda: [eval_items(value) for value in column])
+    reference, _ = timed("ast.literal_eval per cell", lambda: [literal_items(value) for value in column], baseline)
+    assert reference == expected, "literal_eval and eval disagree on this column"
+    parsed, _ = timed("parse_list_cells (batched)", lambda: parse_list_cells(column), baseline)
+    list_column, _ = timed("ListColumn.from_series (deduplicated)", lambda: ListColumn.from_series(column), baseline)
+
+    cleaned = [[text for text in (item.strip().strip('\'"').strip() for item in items) if text] for items in expected]
+    assert parsed == cleaned, "parse_list_cells differs from eval"
+    rows = [[list_column.vocabulary[code] for code in list_column.codes[start:end]]
+            for start, end in zip(list_column.offsets[:-1], list_column.offsets[1:])]
+    assert rows == cleaned, "ListColumn differs from eval"
+    print("all paths give the same items")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark the parallel ranged download against a single stream, offline.
+
+    python -m benchmarks.bench_parallel_download --size-mb 256 --bps-mb 20
+
+The single-stream baseline uses one worker and 5MB ranges, the same request
+pattern as ``MediaIoBaseDownload(chunksize=5MB)``.
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from ageai.ranged_download import download_ranges
+from benchmarks.local_drive import LocalRangeFetcher, serve
+
+
+def md5_of(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run(url, size, dest, workers, range_size):
+    if os.path.exists(dest):
+        os.remove(dest)
+    started = time.perf_counter()
+    download_ranges(LocalRangeFetcher(url), dest, size, workers=workers, range_size=range_size)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--bps-mb', type=float, default=20.0, help="per-connection bandwidth cap (MB/s), 0 = none")
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8, 16])
+    parser.add_argument('--range-mb', type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.zip')
+        with open(source, 'wb') as fh:
+            for _ in range(args.size_mb):
+                fh.write(os.urandom(1024 * 1024))
+        size = os.path.getsize(source)
+        expected_md5 = md5_of(source)
+        server, url = serve(source, per_connection_bps=args.bps_mb * 1024 * 1024 or None)
+        dest = os.path.join(tmp, 'dest.zip')
+        try:
+            elapsed = run(url, size, dest, 1, 5 * 1024 * 1024)
+            assert md5_of(dest) == expected_md5
+            print(f"single stream        {elapsed:7.2f}s  {args.size_mb / elapsed:7.1f} MB/s")
+            for workers in args.workers:
+                elapsed = run(url, size, dest, workers, args.range_mb * 1024 * 1024)
+                assert md5_of(dest) == expected_md5
+                print(f"parallel x{workers:<3d} {args.range_mb:>3d}MB {elapsed:7.2f}s  {args.size_mb / elapsed:7.1f} MB/s")
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
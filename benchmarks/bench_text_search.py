@@ -0,0 +1,184 @@
+"""Benchmark the trigram search index against the scans the search box ran.
+
+    python -m benchmarks.bench_text_search --rows 200000
+    python -m benchmarks.bench_text_search --csv metadata.csv --column prompt --term cane --term "taking a"
+    python -m benchmarks.bench_text_search --all-columns --rows 500000
+    python -m benchmarks.bench_text_search --typed --rows 500000
+    python -m benchmarks.bench_text_search --filtered --rows 500000
+
+Without ``--csv`` the data is synthetic: prompts in the dashboards' style
+("A photo of an older woman reading books in the living room, ...") and,
+with ``--all-columns``, the metadata columns around them. For each term
+both paths must select the same rows as
+``astype(str).str.contains(term, case=False, na=False)`` on the column or,
+with ``--all-columns``, as the Spanish dashboard's row-wise ``apply`` over
+every column. ``--typed`` types each term one character at a time and
+times every keystroke from scratch and narrowed from the previous one.
+``--filtered`` searches the prompts along with two sidebar filters
+(``age_group`` and ``race``) and times the search over every row, ANDed
+with the filters, against the planned selection, which searches only the
+rows the filters leave.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from ageai.facet_index import TEXT_COST, FacetIndex
+from ageai.schema import optimize_dtypes
+from ageai.text_search import SearchIndex, TrigramIndex, is_literal
+
+SUBJECTS = ["an older woman", "an older man", "a middle-aged woman", "a young man", "two older people"]
+ACTIVITIES = ["reading books", "cooking dinner", "walking the dog", "taking a bath", "gardening", "using a smartphone",
+              "watching movies", "attending a webinar", "doing laundry", "meditating", "riding a bike", "shopping"]
+PLACES = ["in the living room", "in a library", "in the garden", "at work", "in a botanical garden", "in the kitchen"]
+DETAILS = ["with a cane", "wearing glasses", "smiling", "with a walker", "in natural light", "close-up shot",
+           "candid photo", "35mm film", "soft focus", "looking at the camera"]
+TERMS = ["cane", "Reading Books", "taking a", "botanical", "ok", "smartphone|walker", "zebra"]
+FILTERS = [('age_group', ["older"]), ('race', ["asian"])]
+METADATA = {'gender': ["male", "female"], 'race': ["asian", "black", "indian", "latino", "middle eastern", "white"],
+            'emotion': ["happy", "neutral", "sad", "surprised", "angry"], 'age_group': ["young", "adult", "older"],
+            'position': ["standing", "sitting", "lying down", "walking"], 'person_count': [1, 2, 3],
+            'location': ["indoors", "outdoors"], 'shot': ["close-up", "medium shot", "full shot"]}
+
+
+def synthetic_prompts(rows, seed=0):
+    rng = random.Random(seed)
+    prompts = [f"A photo of {rng.choice(SUBJECTS)} {rng.choice(ACTIVITIES)} {rng.choice(PLACES)}, "
+               f"{', '.join(rng.sample(DETAILS, rng.randint(1, 4)))}, seed {rng.randint(0, rows)}" for _ in range(rows)]
+    column = pd.Series(prompts, dtype=object)
+    column[::97] = np.nan
+    return column
+
+
+def synthetic_frame(rows, seed=0):
+    """The Spanish dashboard's frame: ids, file names, a prompt and low-cardinality metadata."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'ID': np.arange(rows), 'filename': [f"img_{index:07d}.png" for index in range(rows)]})
+    df['filename_jpg'] = df['filename'].str.replace('.png', '.jpg', regex=False)
+    df['prompt'] = synthetic_prompts(rows, seed)
+    for column, values in METADATA.items():
+        df[column] = np.array(values, dtype=object)[rng.integers(0, len(values), rows)]
+    df['objects'] = np.array(["['cane']", "['glasses', 'smartphone']", "[]", "['walker']"])[rng.integers(0, 4, rows)]
+    return optimize_dtypes(df)[0]
+
+
+def timed(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def all_columns(args):
+    df = synthetic_frame(args.rows)
+    search_index = SearchIndex(df)
+    started = time.perf_counter()
+    for column in df.columns:
+        search_index.column(column)
+    print(f"{len(df)} rows x {len(df.columns)} columns; indexes built in {time.perf_counter() - started:.2f}s, "
+          f"{sum(index.nbytes for index in search_index.indexes.values()) / 1024**2:.1f} MB")
+
+    for term in args.term or TERMS:
+        expected, applied = timed(lambda: df.apply(
+            lambda row: row.astype(str).str.contains(term, case=False, na=False).any(), axis=1).to_numpy(), 1)
+        found, indexed = timed(lambda: search_index.contains_any(term), args.repeat)
+        assert (found == expected).all(), f"index and apply disagree on {term!r}"
+        print(f"{term!r:<22} {int(expected.sum()):8d} rows  row-wise apply {applied:8.2f} s  index {indexed * 1000:8.1f} ms")
+    print("both select the same rows")
+
+
+def typed(args):
+    column = synthetic_prompts(args.rows)
+    df = column.to_frame('prompt')
+    index = SearchIndex(df).column('prompt')
+    for term in args.term or TERMS:
+        if not is_literal(term):
+            continue
+        search_index = SearchIndex(df)
+        search_index.indexes['prompt'] = index  # same index, fresh search history
+        keystrokes = [term[:length] for length in range(1, len(term) + 1)]
+        scratch, narrowed = [], []
+        for prefix in keystrokes:
+            expected, elapsed = timed(lambda: index.contains(prefix), 1)
+            scratch.append(elapsed)
+            found, elapsed = timed(lambda: search_index.contains('prompt', prefix), 1)
+            narrowed.append(elapsed)
+            assert (found == expected).all(), f"narrowed search disagrees on {prefix!r}"
+        print(f"{term!r:<22} {len(keystrokes):3d} keystrokes  from scratch {sum(scratch) * 1000:8.1f} ms "
+              f"(slowest {max(scratch) * 1000:6.1f})  narrowed {sum(narrowed) * 1000:8.1f} ms "
+              f"(slowest {max(narrowed) * 1000:6.1f})")
+    print("both select the same rows")
+
+
+def filtered(args):
+    df = synthetic_frame(args.rows)
+    facet_index = FacetIndex.build(df)
+    index = SearchIndex(df).column('prompt')
+
+    def sidebar():
+        selection = facet_index.select()
+        for column, values in FILTERS:
+            selection.add(column, values)
+        return selection
+
+    def select(term, planned):
+        search_index = SearchIndex(df)
+        search_index.indexes['prompt'] = index  # same index, no previous term to narrow from
+        selection = sidebar()
+        if planned:
+            selection.add_mask(lambda rows: search_index.contains('prompt', term, rows), cost=TEXT_COST, takes_rows=True)
+        else:
+            selection.add_mask(lambda: search_index.contains('prompt', term))
+        return selection.positions()
+
+    leave = sidebar().positions()
+    print(f"{len(df)} rows, {len(leave)} left by {' and '.join(f'{column} = {values[0]}' for column, values in FILTERS)}")
+    for term in args.term or TERMS:
+        expected, unplanned = timed(lambda: select(term, False), args.repeat)
+        found, planned = timed(lambda: select(term, True), args.repeat)
+        assert (found == expected).all(), f"planned and unplanned selections disagree on {term!r}"
+        print(f"{term!r:<22} {len(expected):8d} rows  search every row {unplanned * 1000:8.1f} ms  "
+              f"search after the filters {planned * 1000:8.1f} ms")
+    print("both select the same rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--csv', help="read the column from this CSV instead of generating it")
+    parser.add_argument('--column', default='prompt')
+    parser.add_argument('--term', action='append', help="search term (repeatable); default: a mixed set")
+    parser.add_argument('--all-columns', action='store_true', help="search every column of a synthetic frame")
+    parser.add_argument('--typed', action='store_true', help="type each term a character at a time")
+    parser.add_argument('--filtered', action='store_true', help="search after two sidebar filters, planned and not")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if args.all_columns:
+        return all_columns(args)
+    if args.typed:
+        return typed(args)
+    if args.filtered:
+        return filtered(args)
+
+    column = pd.read_csv(args.csv, usecols=[args.column])[args.column] if args.csv else synthetic_prompts(args.rows)
+    started = time.perf_counter()
+    index = TrigramIndex.build(column)
+    print(f"{len(column)} rows, {len(index.texts)} distinct texts; index built in {time.perf_counter() - started:.2f}s, "
+          f"{len(index.keys)} trigrams, {index.nbytes / 1024**2:.1f} MB")
+
+    for term in args.term or TERMS:
+        expected, scanned = timed(lambda: column.astype(str).str.contains(term, case=False, na=False).to_numpy(),
+                                  args.repeat)
+        found, indexed = timed(lambda: index.contains(term), args.repeat)
+        assert (found == expected).all(), f"index and scan disagree on {term!r}"
+        print(f"{term!r:<22} {int(expected.sum()):8d} rows  scan {scanned * 1000:8.1f} ms  index {indexed * 1000:8.1f} ms")
+    print("both select the same rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Local HTTP stand-in for the Drive media endpoint.
+
+Serves a single file with ``Range`` support and an optional per-connection
+bandwidth cap, which is what limits a single ``MediaIoBaseDownload`` stream
+against the real Drive API. Used by the download benchmarks to measure the
+ranged engine offline.
+"""
+import http.client
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from ageai.ranged_download import RangesNotSupportedError
+
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+def make_handler(file_path, per_connection_bps=None, fail_every=None):
+    size = os.path.getsize(file_path)
+    counter = {'requests': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with lock:
+                counter['requests'] += 1
+                n = counter['requests']
+            if fail_every and n % fail_every == 0:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            start, end = 0, size - 1
+            match = RANGE_RE.match(self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+
+            chunk = 256 * 1024
+            with open(file_path, 'rb') as fh:
+                fh.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    data = fh.read(min(chunk, remaining))
+                    self.wfile.write(data)
+                    remaining -= len(data)
+                    if per_connection_bps:
+                        time.sleep(len(data) / per_connection_bps)
+
+    return Handler
+
+
+def serve(file_path, per_connection_bps=None, fail_every=None, host='127.0.0.1', port=0):
+    """Start the stand-in server in a daemon thread; returns ``(server, url)``."""
+    server = ThreadingHTTPServer((host, port), make_handler(file_path, per_connection_bps, fail_every))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/file"
+
+
+class LocalRangeFetcher:
+    """``fetch_range`` for the stand-in server, one keep-alive connection per thread."""
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host, self.port, self.path = parsed.hostname, parsed.port, parsed.path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return conn
+
+    def __call__(self, start, end):
+        conn = self._connection()
+        try:
+            conn.request('GET', self.path, headers={'Range': f'bytes={start}-{end - 1}'})
+            resp = conn.getresponse()
+            body = resp.read()
+        except (http.client.HTTPException, OSError):
+            self._local.conn = None
+            raise
+        if resp.status == 200:
+            raise RangesNotSupportedError(f"HTTP 200 for bytes {start}-{end - 1}")
+        if resp.status != 206:
+            raise IOError(f"HTTP {resp.status}")
+        return body
@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_text_search import synthetic_frame
+
+
+@pytest.fixture(scope='session')
+def frame():
+    """The benchmarks' synthetic dashboard frame, with missing cells in a categorical and a text column."""
+    df = synthetic_frame(3000, seed=1)
+    rng = np.random.default_rng(2)
+    df.loc[rng.choice(len(df), 150, replace=False), 'emotion'] = np.nan
+    df.loc[rng.choice(len(df), 100, replace=False), 'prompt'] = np.nan
+    return df
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from ageai.columnar import read_columnar, read_csv_cached, write_columnar
+from ageai.schema import lowercase, optimize_dtypes
+
+
+def write_csv(tmp_path, rows=400):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'ID': np.arange(rows),
+        'filename': [f"img_{number}.jpg" for number in range(rows)],
+        'gender': np.array(['woman', 'man', 'Woman', None], dtype=object)[rng.integers(0, 4, rows)],
+        'age_group': np.array(['Young', 'older', 'Older', 'middle-aged'])[rng.integers(0, 4, rows)],
+        'score': rng.random(rows),
+    })
+    path = tmp_path / 'df_meta.csv'
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_cache_hit_returns_the_csv_values_with_categorical_columns(tmp_path):
+    csv_path, columnar_path = write_csv(tmp_path), str(tmp_path / 'metadata.arrow')
+    parsed, hit = read_csv_cached(csv_path, columnar_path)
+    assert not hit
+    cached, hit = read_csv_cached(lambda: 1 / 0, columnar_path)  # the CSV is not even opened
+    assert hit
+    assert cached['gender'].dtype == 'category' and cached['age_group'].dtype == 'category'
+    assert cached['filename'].dtype == object
+    assert list(cached['gender'].cat.categories) == sorted(parsed['gender'].dropna().unique())
+    assert cached.astype(str).equals(parsed.astype(str))
+    assert cached['gender'].isna().equals(parsed['gender'].isna())
+
+
+def test_optimized_frames_agree_after_dropped_rows(tmp_path):
+    csv_path, columnar_path = write_csv(tmp_path), str(tmp_path / 'metadata.arrow')
+    parsed, _ = read_csv_cached(csv_path, columnar_path)
+    cached, _ = read_csv_cached(csv_path, columnar_path)
+    keep = lambda df: df[df['age_group'].astype(str) != 'Young']
+    from_csv, csv_report = optimize_dtypes(keep(parsed), lowercase_columns=['age_group'])
+    from_cache, cache_report = optimize_dtypes(keep(cached), lowercase_columns=['age_group'])
+    assert csv_report['categorical'] == cache_report['categorical']
+    for column in csv_report['categorical']:
+        assert list(from_cache[column].cat.categories) == list(from_csv[column].cat.categories), column
+    assert from_cache.astype(str).equals(from_csv.astype(str))
+
+
+def test_lowercase_keeps_categoricals():
+    series = pd.Series(['Older', 'older', None, 'Young'], dtype='category')
+    lowered = lowercase(series)
+    assert lowered.dtype == 'category' and list(lowered.cat.categories) == ['older', 'young']
+    assert lowered.astype(object).where(lowered.notna(), None).tolist() == ['older', 'older', None, 'young']
+
+
+def test_mixed_columns_are_not_cached(tmp_path):
+    df = pd.DataFrame({'mixed': [1, 'a', 2.5]})
+    assert not write_columnar(df, str(tmp_path / 'metadata.arrow'))
+
+
+def test_read_columnar_keeps_missing_strings_as_nan(tmp_path):
+    df = pd.DataFrame({'prompt': [f"text {number}" for number in range(9)] + [np.nan]})
+    path = str(tmp_path / 'metadata.arrow')
+    assert write_columnar(df, path)
+    restored = read_columnar(path)
+    assert restored['prompt'].dtype == object and restored['prompt'].astype(str).iloc[-1] == 'nan'
@@ -0,0 +1,77 @@
+import os
+import time
+
+from ageai.dataset_cache import ARCHIVE_NAME, COMPLETE_MARKER, STALE_BUILD_AGE, DatasetCache, cache_key
+
+
+def age(path, seconds):
+    """Set the modification time of ``path`` and everything under it ``seconds`` into the past."""
+    past = time.time() - seconds
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            os.utime(os.path.join(dirpath, filename), (past, past))
+        os.utime(dirpath, (past, past))
+
+
+def fill(path, size=1000):
+    with open(os.path.join(path, ARCHIVE_NAME), 'wb') as fh:
+        fh.write(b'x' * size)
+
+
+def test_cache_key():
+    assert cache_key({'id': 'abc', 'md5Checksum': 'f00'}) == 'abc-f00'
+    assert cache_key({'id': 'abc', 'modifiedTime': '2024-01-01T00:00:00Z'}, variant='zip') == \
+        'abc-2024-01-01T00_00_00Z-zip'
+    assert cache_key({'id': 'abc'}) is None
+
+
+def test_lookup_ignores_entries_until_finalized(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    path = cache.building_dir('a')
+    fill(path)
+    assert cache.lookup('a') is None and cache.entries() == []
+    assert cache.finalize('a', {'name': 'a.zip'}) == path
+    assert cache.lookup('a') == path
+    assert [entry['key'] for entry in cache.entries()] == ['a']
+
+
+def test_commit_publishes_staging(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    staging = cache.staging_dir('b')
+    fill(staging)
+    path = cache.commit('b', staging)
+    assert path == cache.entry_path('b') and not os.path.exists(staging)
+    assert os.path.exists(os.path.join(path, COMPLETE_MARKER))
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = DatasetCache(str(tmp_path), max_bytes=3500)  # three entries of about 1100 bytes
+    for key in ('old', 'mid', 'new'):
+        fill(cache.building_dir(key))
+        cache.finalize(key)
+        time.sleep(0.01)
+    fill(cache.building_dir('newest'))
+    cache.finalize('newest')
+    assert sorted(entry['key'] for entry in cache.entries()) == ['mid', 'new', 'newest']
+
+
+def test_abandoned_builds_are_removed(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    abandoned = cache.building_dir('abandoned')
+    fill(abandoned)
+    age(abandoned, STALE_BUILD_AGE + 60)
+    running = cache.building_dir('running')  # an old directory whose download is still writing
+    fill(running)
+    age(running, STALE_BUILD_AGE + 60)
+    fill(running)
+    old_staging = cache.staging_dir('staged')
+    age(old_staging, STALE_BUILD_AGE + 60)
+    complete = cache.building_dir('complete')
+    fill(complete)
+    cache.finalize('complete')
+    age(complete, STALE_BUILD_AGE + 60)
+
+    cache.evict()
+    assert not os.path.exists(abandoned) and not os.path.exists(old_staging)
+    assert os.path.exists(running)
+    assert cache.lookup('complete') == complete
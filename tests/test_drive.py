@@ -0,0 +1,55 @@
+import os
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from ageai.drive import DriveRangeFetcher
+from ageai.ranged_download import RangesNotSupportedError, download_ranges, resumable_download
+
+DATA = os.urandom(50_000)
+
+
+class FakePool:
+    """Stands in for ``DriveClientPool``: a server that honours ``Range`` or always sends the whole file."""
+
+    def __init__(self, honours_range=True):
+        self.honours_range = honours_range
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self, url, method, headers):
+        with self.lock:
+            self.requests += 1
+        if not self.honours_range:
+            return SimpleNamespace(status=200), DATA
+        start, end = (int(bound) for bound in headers['Range'][len('bytes='):].split('-'))
+        return SimpleNamespace(status=206), DATA[start:end + 1]
+
+    @contextmanager
+    def client(self):
+        yield SimpleNamespace(http=SimpleNamespace(request=self.request))
+
+
+def test_ranges_are_fetched(tmp_path):
+    pool = FakePool()
+    download_ranges(DriveRangeFetcher(pool, 'file'), str(tmp_path / 'out'), len(DATA), workers=4, range_size=5_000)
+    assert pool.requests == 10
+    with open(tmp_path / 'out', 'rb') as fh:
+        assert fh.read() == DATA
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_whole_file_reply_stops_the_ranged_download(tmp_path, workers):
+    """A 200 reply is not retried or sliced: at most the requests already in flight get one."""
+    pool = FakePool(honours_range=False)
+    fetcher = DriveRangeFetcher(pool, 'file')
+    with pytest.raises(RangesNotSupportedError):
+        resumable_download(fetcher, str(tmp_path / 'out'), len(DATA), {'id': 'file'}, workers=workers,
+                           range_size=1_000, retries=3)
+    assert 1 <= pool.requests <= workers
+    assert not fetcher.ranges_supported
+    with pytest.raises(RangesNotSupportedError):
+        fetcher(0, 10)
+    assert pool.requests <= workers
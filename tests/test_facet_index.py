@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+
+from ageai.facet_index import TEXT_COST, FacetIndex
+from ageai.list_columns import ListColumn, parse_list_cell
+from ageai.text_search import SearchIndex
+
+COLUMNS = ['gender', 'race', 'emotion', 'age_group', 'position']
+
+
+@pytest.fixture(scope='module')
+def index(frame):
+    return FacetIndex.build(frame, {'objects': ListColumn.from_series(frame['objects'])})
+
+
+def pick(rng, series, count):
+    return rng.sample(sorted(series.astype(str).unique()), count)
+
+
+def test_value_counts_match_astype_str(frame, index):
+    for column in COLUMNS + ['shot']:
+        assert index.value_counts(column) == frame[column].astype(str).value_counts().to_dict()
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_selection_matches_pandas_masks(frame, index, seed):
+    """Positions and facet counts equal the dashboards' former ``astype(str).isin`` and ``str.contains`` masks."""
+    rng = random.Random(seed)
+    selection, masks = index.select(), {}
+    for column in rng.sample(COLUMNS, rng.randint(0, 3)):
+        values = pick(rng, frame[column], rng.randint(1, 2))
+        selection.add(column, values)
+        masks[column] = frame[column].astype(str).isin(values).to_numpy()
+    if rng.random() < .5:  # a column the index does not hold
+        names = [f"img_{position:07d}.png" for position in rng.sample(range(len(frame)), 1000)]
+        selection.add('filename', names)
+        masks['filename'] = frame['filename'].astype(str).isin(names).to_numpy()
+    if rng.random() < .5:
+        wanted = {'cane', 'walker'}
+        selection.add('objects', sorted(wanted))
+        masks['objects'] = frame['objects'].map(lambda cell: bool(wanted & set(parse_list_cell(cell)))).to_numpy(bool)
+    if rng.random() < .7:
+        term = rng.choice(['cane', 'taking a', 'zebra', 'Reading', 'ca.e'])
+        search = SearchIndex(frame)
+        selection.add_mask(lambda rows: search.contains('prompt', term, rows), key=('search', term),
+                           cost=TEXT_COST, takes_rows=True)
+        masks['prompt'] = frame['prompt'].astype(str).str.contains(term, case=False, na=False).to_numpy()
+
+    counts = selection.facet_counts(COLUMNS + ['shot'])
+    for column in COLUMNS + ['shot']:
+        others = np.ones(len(frame), dtype=bool)
+        for masked, mask in masks.items():
+            if masked != column:
+                others &= mask
+        assert counts[column] == frame[column].astype(str)[others].value_counts().to_dict(), column
+
+    expected = np.ones(len(frame), dtype=bool)
+    for mask in masks.values():
+        expected &= mask
+    assert selection.positions().tolist() == np.flatnonzero(expected).tolist()
+    assert selection.count() == int(expected.sum())
+
+
+def test_missing_cells_match_as_nan(frame, index):
+    selection = index.select().add('emotion', ['nan'])
+    assert selection.positions().tolist() == np.flatnonzero(frame['emotion'].isna()).tolist()
+
+
+def test_key_ignores_filter_and_value_order(index):
+    first = index.select().add('race', ['a', 'b']).add('gender', ['x'])
+    second = index.select().add('gender', ['x']).add('race', ['b', 'a'])
+    assert first.key == second.key
+    assert first.key_without('race') == index.select().add('gender', ['x']).key
+    assert index.select().add_mask(np.ones(index.rows, dtype=bool)).key is None
+
+
+def test_plan_puts_lookups_before_masks(index):
+    selection = index.select()
+    selection.add_mask(lambda rows: np.ones(index.rows, dtype=bool), key='m', cost=TEXT_COST, takes_rows=True)
+    selection.add('race', ['x'])
+    assert [predicate.column for predicate in selection.plan()] == ['race', None]
@@ -0,0 +1,78 @@
+import ast
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ageai.list_columns import ListColumn, explode_list_cells, is_list_column, parse_list_cell, parse_list_cells
+
+CELLS = [
+    "['cane', 'glasses']",
+    "['walker']",
+    "[]",
+    "['a, b', 'c']",
+    """["b's", 'x']""",
+    "[ 'spaced' ,'odd',]",
+    "[1, 2.50, -3]",
+    "['esc\\'aped', \"dq\"]",
+    "['  padded  ', '']",
+    "['ñandú', 'café']",
+    "[['nested'], 'x']",
+    "'scalar'",
+    "[bare, names]",
+    "not a list",
+    None,
+    float('nan'),
+]
+
+
+def literal_items(cell):
+    """The dashboards' original parsing: ``ast.literal_eval``, a comma split when that fails, then stripped."""
+    if not isinstance(cell, str):
+        return []
+    try:
+        items = ast.literal_eval(cell)
+    except (ValueError, SyntaxError):
+        items = cell.strip().strip('[]').split(',')
+    if not isinstance(items, (list, tuple)):
+        items = [items]
+    return [text for text in (str(item).strip().strip('\'"').strip() for item in items) if text]
+
+
+@pytest.mark.parametrize('cell', CELLS)
+def test_parse_list_cell_matches_literal_eval(cell):
+    assert parse_list_cell(cell) == literal_items(cell)
+
+
+def test_explode_list_cells_matches_literal_eval_per_cell():
+    rng = np.random.default_rng(0)
+    cells = [CELLS[position] for position in rng.integers(0, len(CELLS), 500)]
+    cell_of_item, items = explode_list_cells(cells)
+    assert (np.diff(cell_of_item) >= 0).all()
+    expected = [(position, item) for position, cell in enumerate(cells) for item in literal_items(cell)]
+    assert list(zip(cell_of_item.tolist(), items.tolist())) == expected
+
+
+def test_parse_list_cells_keeps_one_list_per_cell():
+    assert parse_list_cells(["['a']", "[]", None, "['b', 'c']"]) == [['a'], [], [], ['b', 'c']]
+
+
+def test_list_column_rows_and_counts():
+    series = pd.Series(["['cane', 'glasses']", "['cane']", None, "[]", "['cane', 'glasses']"])
+    column = ListColumn.from_series(series)
+    rows = [[column.vocabulary[code] for code in column.codes[start:end]]
+            for start, end in zip(column.offsets[:-1], column.offsets[1:])]
+    assert rows == [['cane', 'glasses'], ['cane'], [], [], ['cane', 'glasses']]
+    assert column.counts() == {'cane': 3, 'glasses': 2}
+    assert column.row_ids.tolist() == [0, 0, 1, 4, 4]
+
+    restored = ListColumn.from_bytes(column.to_bytes())
+    assert restored.offsets.tolist() == column.offsets.tolist()
+    assert restored.codes.tolist() == column.codes.tolist()
+    assert restored.vocabulary == column.vocabulary
+
+
+def test_is_list_column():
+    assert is_list_column(pd.Series(["['a']", " [] ", None]))
+    assert not is_list_column(pd.Series(["['a']", "b"]))
+    assert not is_list_column(pd.Series([1, 2]))
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+from ageai.ranged_download import (ChecksumMismatchError, DownloadState, RangeDownloadError, download_ranges,
+                                   merge_intervals, plan_ranges, resumable_download)
+
+DATA = os.urandom(100_000)
+IDENTITY = {'id': 'file', 'size': len(DATA)}
+
+
+def fetch(start, end):
+    return DATA[start:end]
+
+
+def fetch_recording(requested):
+    def fetch_range(start, end):
+        requested.append((start, end))
+        return DATA[start:end]
+    return fetch_range
+
+
+def test_plan_ranges():
+    assert plan_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert plan_ranges(0, 4) == []
+    with pytest.raises(ValueError):
+        plan_ranges(10, 0)
+
+
+def test_merge_intervals():
+    assert merge_intervals([]) == []
+    assert merge_intervals([(5, 8), (0, 2), (2, 4), (7, 10), (12, 13)]) == [[0, 4], [5, 10], [12, 13]]
+    assert merge_intervals([(0, 10), (2, 3)]) == [[0, 10]]
+
+
+def test_missing_ranges_cover_the_gaps(tmp_path):
+    state = DownloadState(str(tmp_path / 'state.json'), IDENTITY, [(0, 10), (25, 30), (95, 100)])
+    assert state.missing_ranges(100, 20) == [(10, 25), (30, 50), (50, 70), (70, 90), (90, 95)]
+    assert state.completed_bytes == 20
+    assert state.covers(2, 10) and state.covers(25, 30)
+    assert not state.covers(8, 12) and not state.covers(10, 11)
+    assert DownloadState(str(tmp_path / 'none.json'), IDENTITY).missing_ranges(5, 2) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_state_is_dropped_for_another_identity(tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = DownloadState(path, IDENTITY)
+    state.mark_done((0, 10))
+    assert DownloadState.load(path, IDENTITY).completed == [[0, 10]]
+    assert DownloadState.load(path, dict(IDENTITY, id='other')).completed == []
+
+
+def test_download_ranges_writes_every_range(tmp_path):
+    dest = str(tmp_path / 'out')
+    seen = []
+    completed = download_ranges(fetch, dest, len(DATA), workers=4, range_size=7_000, on_range_done=seen.append)
+    assert sorted(completed) == sorted(seen) == plan_ranges(len(DATA), 7_000)
+    with open(dest, 'rb') as fh:
+        assert fh.read() == DATA
+
+
+def test_download_ranges_raises_after_retries(tmp_path):
+    def failing(start, end):
+        raise OSError("unreachable")
+    with pytest.raises(RangeDownloadError):
+        download_ranges(failing, str(tmp_path / 'out'), len(DATA), workers=2, range_size=10_000, retries=1)
+
+
+def test_resume_fetches_only_missing_ranges(tmp_path):
+    dest = str(tmp_path / 'file.zip')
+    requested, calls = [], threading.Lock()
+
+    def flaky(start, end):
+        with calls:
+            requested.append((start, end))
+            if len(requested) > 3:
+                raise OSError("connection reset")
+        return DATA[start:end]
+
+    with pytest.raises(RangeDownloadError):
+        resumable_download(flaky, dest, len(DATA), IDENTITY, workers=1, range_size=10_000, retries=1)
+    assert os.path.exists(dest + '.part') and not os.path.exists(dest)
+    done = DownloadState.load(dest + '.part.json', IDENTITY).completed
+    assert done == [[0, 30_000]]
+
+    requested.clear()
+    resumable_download(fetch_recording(requested), dest, len(DATA), IDENTITY,
+                       md5_checksum=hashlib.md5(DATA).hexdigest(), workers=2, range_size=10_000)
+    assert min(start for start, _ in requested) == 30_000
+    with open(dest, 'rb') as fh:
+        assert fh.read() == DATA
+    assert not os.path.exists(dest + '.part') and not os.path.exists(dest + '.part.json')
+
+
+def test_checksum_mismatch_discards_the_partial_file(tmp_path):
+    dest = str(tmp_path / 'file.zip')
+    with pytest.raises(ChecksumMismatchError):
+        resumable_download(fetch, dest, len(DATA), IDENTITY, md5_checksum='0' * 32, range_size=10_000)
+    assert not os.path.exists(dest + '.part') and not os.path.exists(dest + '.part.json')
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ageai.schema import isin_str, optimize_dtypes, str_value_counts
+
+VALUES = ['Happy', 'sad', None, 'happy', np.nan, '1', 1, 1.0, 'nan', 'Sad']
+
+
+@pytest.fixture(params=['object', 'category'])
+def series(request):
+    rng = np.random.default_rng(0)
+    series = pd.Series(np.array(VALUES, dtype=object)[rng.integers(0, len(VALUES), 400)])
+    return series.astype(request.param)
+
+
+@pytest.mark.parametrize('values', [['happy'], ['Happy', 'sad'], ['nan'], ['1', '1.0'], [1], ['missing'], []])
+@pytest.mark.parametrize('case', [True, False])
+def test_isin_str_matches_astype_str(series, values, case):
+    text = series.astype(str)
+    if case:
+        expected = text.isin([str(value) for value in values])
+    else:
+        expected = text.str.lower().isin([str(value).lower() for value in values])
+    assert isin_str(series, values, case).tolist() == expected.tolist()
+
+
+def test_str_value_counts_matches_astype_str(series):
+    assert str_value_counts(series) == series.astype(str).value_counts().to_dict()
+
+
+def test_optimize_dtypes_keeps_values():
+    df = pd.DataFrame({'low': ['a', 'b'] * 50, 'high': [str(number) for number in range(100)], 'number': range(100)})
+    optimized, report = optimize_dtypes(df.copy())
+    assert report['categorical'] == ['low']
+    assert optimized['low'].dtype == 'category' and optimized['high'].dtype == object
+    assert optimized.astype(str).equals(df.astype(str))
@@ -0,0 +1,184 @@
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+
+from ageai.streaming import TAIL_SIZE, StreamingArchive, active_stream, failed_stream, start_stream
+from ageai.zip_store import (MemberPending, MemberUnavailable, find_csv_member, image_error, image_pending, image_source,
+                             open_store)
+
+
+def make_archive(images=40):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('data/df_meta.csv', 'a,b\n1,2\n')
+        for number in range(images):
+            archive.writestr(f'data/img/{number}.jpg', os.urandom(20_000))
+    return buffer.getvalue()
+
+
+DATA = make_archive()
+
+
+def fetcher(fail_after=None):
+    calls, lock = [], threading.Lock()
+
+    def fetch_range(start, end):
+        with lock:
+            calls.append(start)
+            if fail_after is not None and len(calls) > fail_after:
+                raise OSError("connection reset")
+        return DATA[start:end]
+    return fetch_range
+
+
+def stream(path, fetch_range, **kwargs):
+    return start_stream(fetch_range, str(path), len(DATA), 'archive', csv_member='data/df_meta.csv',
+                        range_size=16_384, workers=2, retries=1, **kwargs)
+
+
+def test_members_read_while_streaming_and_after(tmp_path):
+    gate = threading.Event()
+    base = fetcher()
+
+    def gated(start, end):
+        if start < len(DATA) - TAIL_SIZE:  # the members wait; the tail, central directory included, does not
+            gate.wait(10)
+        return base(start, end)
+
+    archive = stream(tmp_path / 'a.zip', gated)
+    assert archive.directory_ready.wait(10)
+    handles = archive.handles('data/img', ('.jpg',))
+    assert len(handles) == 40 and archive.subfolders('data') == ['img']
+    first = handles['0.jpg']
+    assert image_pending(first) and image_source(first) is None
+    with pytest.raises(MemberPending):
+        first.read()
+
+    gate.set()
+    assert archive.done.wait(10) and archive.finished
+    assert active_stream(tmp_path / 'a.zip') is None
+    with zipfile.ZipFile(io.BytesIO(DATA)) as original:
+        for name, handle in handles.items():
+            assert handle.read() == original.read(f'data/img/{name}')
+            assert not image_pending(handle) and image_error(handle) is None
+
+
+def test_one_stream_per_path(tmp_path):
+    gate = threading.Event()
+    base = fetcher()
+
+    def gated(start, end):
+        gate.wait(10)
+        return base(start, end)
+
+    first = stream(tmp_path / 'a.zip', gated)
+    try:
+        assert stream(tmp_path / 'a.zip', gated) is first
+        assert active_stream(tmp_path / 'a.zip') is first
+    finally:
+        gate.set()
+    assert first.done.wait(10) and first.finished
+
+
+def test_failed_stream_reports_missing_members(tmp_path):
+    archive = stream(tmp_path / 'a.zip', fetcher(fail_after=8))
+    assert archive.done.wait(10)
+    assert archive.error is not None and not archive.finished
+    assert active_stream(tmp_path / 'a.zip') is None and failed_stream(tmp_path / 'a.zip') is archive
+
+    handles = archive.handles('data/img', ('.jpg',))
+    arrived = [handle for handle in handles.values() if archive.member(handle.name) is not None]
+    missing = [handle for handle in handles.values() if archive.member(handle.name) is None]
+    assert missing
+    assert all(not image_pending(handle) for handle in handles.values())
+    for handle in arrived:
+        assert image_source(handle) is not None and image_error(handle) is None
+    for handle in missing:
+        assert image_source(handle) is None and image_error(handle) is archive.error
+        with pytest.raises(MemberUnavailable):
+            handle.read()
+
+    # A new stream for the path resumes the download and clears the failure
+    retry = stream(tmp_path / 'a.zip', fetcher())
+    assert failed_stream(tmp_path / 'a.zip') is None
+    assert retry.done.wait(10) and retry.finished
+    assert all(image_source(handle) is not None for handle in missing)
+    with open(tmp_path / 'a.zip', 'rb') as fh:
+        assert fh.read() == DATA
+
+
+def test_on_complete_sees_the_stream_done(tmp_path):
+    seen = []
+
+    def on_complete(archive):
+        seen.append((archive.done.is_set(), archive.finished, active_stream(archive.dest_path)))
+
+    archive = stream(tmp_path / 'a.zip', fetcher(), on_complete=on_complete)
+    archive._thread.join(10)
+    assert seen == [(True, True, None)]
+
+    failed = stream(tmp_path / 'b.zip', fetcher(fail_after=2), on_complete=on_complete)
+    failed._thread.join(10)
+    assert failed.error is not None and len(seen) == 1
+
+
+def test_streaming_archive_start_registers_it(tmp_path):
+    archive = StreamingArchive(fetcher(), str(tmp_path / 'b.zip'), len(DATA), 'archive', range_size=16_384)
+    archive.start()
+    assert archive.done.wait(10) and archive.finished
+    assert zipfile.ZipFile(tmp_path / 'b.zip').testzip() is None
+
+
+
+def test_prefetched_csv_is_the_one_the_loaders_read(tmp_path):
+    """With several CSVs stored out of name order, the stream fetches the one ``find_csv_member`` picks on the store."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('data/df_zeta.csv', 'a\n1\n')
+        archive.writestr('data/other.csv', 'b\n2\n')
+        for number in range(20):
+            archive.writestr(f'data/img/{number}.jpg', os.urandom(20_000))
+        archive.writestr('data/df_alpha.csv', 'c\n3\n')
+        archive.writestr('data/img/last.jpg', os.urandom(20_000))
+    data = buffer.getvalue()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        offsets = sorted(info.header_offset for info in archive.infolist())
+        csv_start = archive.getinfo('data/df_alpha.csv').header_offset
+        csv_end = offsets[offsets.index(csv_start) + 1]
+    gate = threading.Event()
+
+    def gated(start, end):
+        if end > csv_start and start < csv_end or start >= len(data) - TAIL_SIZE:
+            return data[start:end]  # the chosen CSV and the central directory come through
+        gate.wait(10)
+        return data[start:end]
+
+    path = str(tmp_path / 'a.zip')
+    archive = start_stream(gated, path, len(data), 'csvs', csv_member=lambda names: [find_csv_member(names)],
+                           range_size=4_096, workers=2, retries=1)
+    try:
+        assert archive.csv_ready.wait(5) and not archive.done.is_set()
+        store = open_store(path)
+        assert find_csv_member(store) == 'data/df_alpha.csv'
+        assert store.read_member(find_csv_member(store)) == b'c\n3\n'
+        with pytest.raises(MemberPending):
+            store.read_member('data/df_zeta.csv')
+    finally:
+        gate.set()
+    assert archive.done.wait(10) and archive.finished
+
+
+def test_find_csv_member_on_names_stores_and_folders(tmp_path):
+    names = ['data/df_b.csv', 'data/x/df_a.csv', 'data/a.csv', 'data/df_a.csv', 'other/df_0.csv']
+    assert find_csv_member(names) == 'data/df_a.csv'
+    assert find_csv_member(names, name_prefix='') == 'data/a.csv'
+    assert find_csv_member(['data/a.csv']) == 'data/a.csv'
+    assert find_csv_member(['data/img/1.jpg']) is None
+    (tmp_path / 'data').mkdir()
+    for name in ('df_b.csv', 'df_a.csv', 'a.csv'):
+        (tmp_path / 'data' / name).write_text('x\n')
+    assert find_csv_member(str(tmp_path)) == 'data/df_a.csv'
+    assert find_csv_member(str(tmp_path / 'missing')) is None
@@ -0,0 +1,68 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ageai.text_search import SearchIndex, TrigramIndex, refines
+
+TERMS = ['cane', 'CANE', 'ca', 'c', 'taking a bath', 'Reading', 'zebra', 'ca.e', 'smartphone|walker',
+         'seed 1', 'ñ', 'straße', 'STRASSE', 'İ', 'ǅ', '']
+
+
+@pytest.fixture(scope='module')
+def texts(frame):
+    extra = pd.Series(['Straße café', 'STRASSE', 'İstanbul', 'ǅemal', 'ﬁne print', None, 42])
+    return pd.concat([frame['prompt'], extra], ignore_index=True)
+
+
+def expected(series, term):
+    return series.astype(str).str.contains(term, case=False, na=False).to_numpy()
+
+
+@pytest.mark.parametrize('term', TERMS)
+def test_trigram_index_matches_str_contains(texts, term):
+    index = TrigramIndex.build(texts)
+    assert (index.contains(term) == expected(texts, term)).all()
+    matched = index.matching_texts(term)
+    assert matched.tolist() == [bool(flag) for flag in pd.Series(index.texts).str.contains(term, case=False)]
+
+
+def test_search_index_narrows_typed_terms(texts):
+    """Each keystroke refines the last term; with ``rows`` the result need only be right at those rows."""
+    search = SearchIndex(texts.to_frame('prompt'))
+    rng = random.Random(0)
+    checks = 0
+    for word in ['cane', 'taking a bath', 'reading', 'smartphone|walker', 'seed 1', 'straße'] * 3:
+        rows = None
+        for end in range(1, len(word) + 1):
+            if rng.random() < .3:
+                rows = None if rng.random() < .3 else np.sort(rng.sample(range(len(texts)), rng.randint(10, 2000)))
+            term = word[:end]
+            found, wanted = search.contains('prompt', term, rows), expected(texts, term)
+            at = slice(None) if rows is None else rows
+            assert (found[at] == wanted[at]).all(), (term, rows is None)
+            checks += 1
+    assert checks > 100
+
+
+def test_contains_any_matches_row_apply(frame):
+    df = frame[['prompt', 'race', 'objects']].head(500)
+    search = SearchIndex(df)
+    wanted = df.apply(lambda row: row.astype(str).str.contains('walk', case=False, na=False).any(), axis=1)
+    assert (search.contains_any('walk') == wanted.to_numpy()).all()
+
+
+def test_stored_index_is_reused_and_checked(tmp_path, frame):
+    df = frame[['prompt']]
+    SearchIndex(df, str(tmp_path)).column('prompt')
+    reloaded = SearchIndex(df, str(tmp_path)).column('prompt')
+    assert (reloaded.contains('cane') == expected(df['prompt'], 'cane')).all()
+    other = df.assign(prompt=df['prompt'].astype(str) + ' x')
+    assert (SearchIndex(other, str(tmp_path)).contains('prompt', 'e x') == expected(other['prompt'], 'e x')).all()
+
+
+def test_refines():
+    assert refines('cane', 'can')
+    assert not refines('can', 'cane')
+    assert not refines('ca.e', 'ca.')